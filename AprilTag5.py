@@ -1,57 +1,173 @@
+import math
+import time
 import numpy as np
 import robotpy_apriltag
 import cv2
 import wpimath.geometry as geo
+from Results import ResultBatch
 
 METERS_TO_INCHES = 39.3701
+INCHES_PER_MILLIMETER = 0.0393701
+
+UNDISTORT_STEP = 8          # Spacing in pixels of the undistortion lookup table
+WARM_START_AGE = 0.5        # Seconds a tag's last pose is used as the starting point for the next
+MAX_REPROJECTION_ERROR = 2.0    # Pixels; a warm-started pose worse than this is solved from scratch
+
+# Undistortion lookup tables, shared by every AprilTag object with the same calibration and frame size
+
+_undistortMaps = {}
+
+
+# A table of where every UNDISTORT_STEP'th pixel of a width x height frame lands once the lens
+# distortion is removed.  Corners are looked up in it with bilinear interpolation, so the (iterative)
+# cv2.undistortPoints only runs once per camera, and never on the whole image.
+
+def undistortMap(cameraMatrix, distortion, width, height):
+    key = (cameraMatrix.tobytes(), distortion.tobytes(), width, height)
+    table = _undistortMaps.get(key)
+    if table is None:
+        xs = np.arange(0, width + UNDISTORT_STEP, UNDISTORT_STEP, dtype=np.float64)
+        ys = np.arange(0, height + UNDISTORT_STEP, UNDISTORT_STEP, dtype=np.float64)
+        grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 1, 2)
+        table = cv2.undistortPoints(grid, cameraMatrix, distortion, P=cameraMatrix).reshape(len(ys), len(xs), 2)
+        _undistortMaps[key] = table
+    return table
+
 
 class AprilTag:
-    def __init__(self, tagFamily, tagSize, cameraIntrinsics=None, field=None):
+
+    # distortion: the RGB camera's distortion coefficients from the calibration (see
+    # CalibrationCache); None or all zeros for an ideal lens
+
+    def __init__(self, tagFamily, tagSize, cameraIntrinsics=None, field=None, distortion=None):
         self.detector = robotpy_apriltag.AprilTagDetector()
         self.detector.addFamily(tagFamily)  
         self.tagFamily = tagFamily
 
         self.haveIntrinsics = cameraIntrinsics is not None
-        self.estimator = None
 
-        # Set up Pose Estimator - parameters come from the cameraIntrinsics object
+        # Pose is solved with OpenCV from the undistorted corners.  The tag's corners, in the order
+        # the detector reports them, in the tag's own frame (the same one AprilTagPoseEstimator uses)
 
         if (self.haveIntrinsics):
-            poseEstConfig = robotpy_apriltag.AprilTagPoseEstimator.Config(
-                tagSize,
-                cameraIntrinsics[0][0],       # fx
-                cameraIntrinsics[1][1],       # fy
-                cameraIntrinsics[0][2],       # cx
-                cameraIntrinsics[1][2]        # cy
-            )
-            self.estimator = robotpy_apriltag.AprilTagPoseEstimator(poseEstConfig)
+            self.cameraMatrix = np.array(cameraIntrinsics, dtype=np.float64)
+            self.distortion = np.array(distortion if distortion is not None else [], dtype=np.float64)
+            if not np.any(self.distortion):
+                self.distortion = None
+
+            s = tagSize / 2
+            self.objectPoints = np.array([[-s, s, 0], [s, s, 0], [s, -s, 0], [-s, -s, 0]], dtype=np.float64)
+            self.lastPoses = {}         # tag id -> (rvec, tvec, time) of its last pose
 
         if field is not None:
             robotpy_apriltag.AprilTagFieldLayout.loadField(field) 
 
+    # corners: (N, 2) pixel coordinates in the distorted image.  Returns them as an ideal pinhole
+    # camera with the same intrinsics would have seen them.
+
+    def undistortCorners(self, corners, shape):
+        if self.distortion is None:
+            return corners
+
+        (height, width) = shape[:2]
+        table = undistortMap(self.cameraMatrix, self.distortion, width, height)
+
+        g = np.clip(corners / UNDISTORT_STEP, 0, np.array(table.shape[1::-1]) - 1.001)
+        i = g.astype(np.int32)
+        f = g - i
+        (x0, y0) = (i[:, 0], i[:, 1])
+        fx = f[:, 0:1]
+        fy = f[:, 1:2]
+
+        top = table[y0, x0] * (1 - fx) + table[y0, x0 + 1] * fx
+        bottom = table[y0 + 1, x0] * (1 - fx) + table[y0 + 1, x0 + 1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    # Pose of one tag from its undistorted corners, as (X, Y, Z, XA, YA, ZA).  A tag seen within the
+    # last WARM_START_AGE seconds starts from its previous pose, which is cheaper and keeps the
+    # solution from flipping between the two mirror-image poses a small tag allows.
+
+    def estimatePose(self, tagId, imagePoints, now):
+        last = self.lastPoses.get(tagId)
+        ok = False
+
+        if last is not None and now - last[2] < WARM_START_AGE:
+            ok, rvec, tvec = cv2.solvePnP(self.objectPoints, imagePoints, self.cameraMatrix, None,
+                                          last[0].copy(), last[1].copy(), True, cv2.SOLVEPNP_ITERATIVE)
+            if ok:
+                projected = cv2.projectPoints(self.objectPoints, rvec, tvec, self.cameraMatrix, None)[0].reshape(-1, 2)
+                ok = np.max(np.linalg.norm(projected - imagePoints, axis=1)) < MAX_REPROJECTION_ERROR
+
+        if not ok:
+            ok, rvec, tvec = cv2.solvePnP(self.objectPoints, imagePoints, self.cameraMatrix, None, flags=cv2.SOLVEPNP_IPPE_SQUARE)
+
+        if not ok:
+            self.lastPoses.pop(tagId, None)
+            return None
+
+        self.lastPoses[tagId] = (rvec, tvec, now)
+
+        # Same angles as wpimath's Rotation3d x/y/z (roll, pitch, yaw)
+
+        r = cv2.Rodrigues(rvec)[0]
+        roll = math.degrees(math.atan2(r[2, 1], r[2, 2]))
+        pitch = math.degrees(math.asin(max(-1.0, min(1.0, -r[2, 0]))))
+        yaw = math.degrees(math.atan2(r[1, 0], r[0, 0]))
+        (x, y, z) = tvec.ravel()
+        return (float(x), float(y), float(z), roll, pitch, yaw)
+
+
+    # Find the tags in a grayscale image.  Returns one compact record per tag:
+    #   (id, corners, center, pose)
+    # where corners is the 8-tuple from the detector, center is (x, y) and pose is
+    # (X, Y, Z, XA, YA, ZA) in meters and degrees, or None if we have no intrinsics.
+    # Records are plain tuples so they are cheap to send back from a TagWorkerPool process.
+
+    def findTags(self, gray):
+        records = []
 
-    def detect(self, image, depthFrame):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         detections = self.detector.detect(gray)
-        objects = []
+        if len(detections) == 0:
+            return records
+
+        allCorners = [detection.getCorners((0, 0, 0, 0, 0, 0, 0, 0)) for detection in detections]
+
+        # Every tag's corners are undistorted in one go
+
+        if (self.haveIntrinsics):
+            undistorted = self.undistortCorners(np.array(allCorners, dtype=np.float64).reshape(-1, 2), gray.shape).reshape(-1, 4, 2)
+            now = time.monotonic()
+
+        for i, detection in enumerate(detections):
+            center = detection.getCenter()
 
-        for detection in detections:
-            corners = (0, 0, 0, 0, 0, 0, 0, 0)
-            corners = detection.getCorners(corners)
+            pose = None
+            if (self.haveIntrinsics):
+                pose = self.estimatePose(detection.getId(), undistorted[i], now)
+
+            records.append((detection.getId(), tuple(allCorners[i]), (center.x, center.y), pose))
+
+        return records
+
+
+    def drawTags(self, image, records):
+        for (tagId, corners, center, pose) in records:
             # cv2.rectangle(image, (int(corners[0]), int(corners[1])), (int(corners[4]), int(corners[5])), color=(0, 255, 0), thickness=3)
 
             pts = np.array([[int(corners[0]), int(corners[1])], [int(corners[2]), int(corners[3])], [int(corners[4]), int(corners[5])], [int(corners[6]), int(corners[7])]], np.int32)
             pts = pts.reshape((-1, 1, 2))
             cv2.polylines(image, [pts], True, (0, 255, 0), 1)
-            cv2.putText(image, str(detection.getId()), (int(corners[0]), int(corners[1])), cv2.FONT_HERSHEY_TRIPLEX, 0.5, (0, 255, 0))
-            center = detection.getCenter()            
-            cv2.circle(image, (int(center.x), int(center.y)), 5, (0, 255, 0), -1)
+            cv2.putText(image, str(tagId), (int(corners[0]), int(corners[1])), cv2.FONT_HERSHEY_TRIPLEX, 0.5, (0, 255, 0))
+            cv2.circle(image, (int(center[0]), int(center[1])), 5, (0, 255, 0), -1)
+
+            if pose is None:
+                continue
 
             wd = abs(corners[6]-corners[0])
             ht = abs(corners[3]-corners[1])
 
-            lblX = int(center.x - wd/2)
-            lblY = int(center.y - ht/2)
+            lblX = int(center[0] - wd/2)
+            lblY = int(center[1] - ht/2)
             # draw the tag family on the image
             # tagID= '{}: {}'.format(r.tag_family.decode("utf-8"), r.tag_id)
             tagID = self.tagFamily
@@ -62,26 +178,54 @@ class AprilTag:
             if lblY > image.shape[0]:
                 lblY = image.shape[0]
 
-            if (self.haveIntrinsics):
-                pose = self.estimator.estimate(detection)
-                rot = pose.rotation()
-
+            (X, Y, Z, XA, YA, ZA) = pose
             units = "in"
 
             cv2.putText(image, tagID, (lblX, lblY - 75), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f" X: {round(pose.X()*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 60), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f" Y: {round(pose.Y()*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 45), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f" Z: {round(pose.Z()*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 30), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f"XA: {round(rot.x_degrees, 1)} deg", (lblX, lblY - 15), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f"YA: {round(rot.y_degrees, 1)} deg", (lblX, lblY + 0), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            cv2.putText(image, f"ZA: {round(rot.z_degrees, 1)} deg", (lblX, lblY + 15), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
-            # print(f"X: {pose.X()*METERS_TO_INCHES}, Y: {pose.Y()*METERS_TO_INCHES}, Z: {pose.Z()*METERS_TO_INCHES}, XR: {rot.x_degrees}, YR: {rot.y_degrees}, ZR: {rot.z_degrees}")
-
-            objects.append({"objectLabel": tagID + ": " + str(detection.getId()), "x": round(pose.X()*METERS_TO_INCHES, 1), "y": round(pose.Y()*METERS_TO_INCHES, 1), "z": round(pose.Z()*METERS_TO_INCHES, 1),
-                            "confidence": 1.0, "rotation": {"x": round(rot.x_degrees), "y": round(rot.y_degrees), "z": round(rot.z_degrees)}})
-            # objects.append({"objectLabel": tagID, "x": pose.X()*METERS_TO_INCHES, "y": pose.Y()*METERS_TO_INCHES, "z": pose.Z()*METERS_TO_INCHES,
-            #                 "confidence": 1.0, "rotation": {"x": rot.x_degrees, "y": rot.y_degrees, "z": rot.z_degrees}})
-            
-        return objects
+            cv2.putText(image, f" X: {round(X*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 60), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            cv2.putText(image, f" Y: {round(Y*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 45), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            cv2.putText(image, f" Z: {round(Z*METERS_TO_INCHES, 1)} {units}", (lblX, lblY - 30), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            cv2.putText(image, f"XA: {round(XA, 1)} deg", (lblX, lblY - 15), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            cv2.putText(image, f"YA: {round(YA, 1)} deg", (lblX, lblY + 0), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            cv2.putText(image, f"ZA: {round(ZA, 1)} deg", (lblX, lblY + 15), cv2.FONT_HERSHEY_TRIPLEX, 0.5, color)
+            # print(f"X: {X*METERS_TO_INCHES}, Y: {Y*METERS_TO_INCHES}, Z: {Z*METERS_TO_INCHES}, XR: {XA}, YR: {YA}, ZR: {ZA}")
+
+
+    # Add the tags with a pose to results (a new ResultBatch if None), in inches and degrees.  stereo
+    # optionally maps a tag id to its stereo (x, y, z) in mm.
+
+    def tagResults(self, records, stereo=None, results=None):
+        if results is None:
+            results = ResultBatch(tagFamily=self.tagFamily)
+
+        for (tagId, corners, center, pose) in records:
+            if pose is None:
+                continue
 
+            (X, Y, Z, XA, YA, ZA) = pose
+            tagStereo = None
+            if stereo is not None and tagId in stereo:
+                tagStereo = tuple(v * INCHES_PER_MILLIMETER for v in stereo[tagId])
+            results.addTag(tagId, X*METERS_TO_INCHES, Y*METERS_TO_INCHES, Z*METERS_TO_INCHES, XA, YA, ZA, tagStereo)
+            # objects.append({"objectLabel": tagID, "x": X*METERS_TO_INCHES, "y": Y*METERS_TO_INCHES, "z": Z*METERS_TO_INCHES,
+            #                 "confidence": 1.0, "rotation": {"x": XA, "y": YA, "z": ZA}})
 
+        return results
+
+
+    # Each tag's bounding box, normalized to the frame, for CameraPipeline.requestSpatialLocations
+
+    def tagRois(self, records, shape) -> dict:
+        (height, width) = shape[:2]
+        rois = {}
+        for (tagId, corners, center, pose) in records:
+            xs = corners[0::2]
+            ys = corners[1::2]
+            rois[tagId] = (min(xs) / width, min(ys) / height, max(xs) / width, max(ys) / height)
+        return rois
+
+    def detect(self, image, depthFrame):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        records = self.findTags(gray)
+        self.drawTags(image, records)
+        return self.tagResults(records)
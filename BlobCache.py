@@ -0,0 +1,61 @@
+import time
+
+import depthai as dai
+
+
+# Loading an NN blob reads and parses a multi-megabyte file, and every camera running the model
+# used to load its own copy.  Blobs are now loaded once per process and shared: cameras that run
+# the same model upload the same dai.OpenVINO.Blob.
+#
+# depthai cannot construct a dai.Pipeline from its serialized form, and a parsed blob only lives as
+# long as the process, so nothing is kept between boots; the node graph is built and the blob loaded
+# on every start.
+#
+# Each load is timed.  A camera that reuses a loaded blob saves that blob's load time, and the
+# totals are reported at startup.
+
+
+class BlobCache:
+
+    def __init__(self):
+        self.blobs = {}             # Blob path -> (dai.OpenVINO.Blob, seconds it took to load)
+        self.loads = 0
+        self.loadTime = 0.0
+        self.reuses = 0
+        self.timeSaved = 0.0
+
+    def get(self, blobPath: str) -> dai.OpenVINO.Blob:
+        cached = self.blobs.get(blobPath)
+        if cached is not None:
+            self.reuses += 1
+            self.timeSaved += cached[1]
+            return cached[0]
+
+        start = time.perf_counter()
+        blob = dai.OpenVINO.Blob(blobPath)
+        elapsed = time.perf_counter() - start
+
+        self.blobs[blobPath] = (blob, elapsed)
+        self.loads += 1
+        self.loadTime += elapsed
+        return blob
+
+    def report(self) -> str:
+        return (f"Blob cache: {self.loads} blob(s) loaded in {self.loadTime * 1000:.1f} ms, "
+                f"{self.reuses} reuse(s) saved {self.timeSaved * 1000:.1f} ms")
+
+
+blobCache = None
+
+
+def getBlobCache() -> BlobCache:
+    global blobCache
+    if blobCache is None:
+        blobCache = BlobCache()
+    return blobCache
+
+
+# Load a blob once per process, no matter how many cameras use it
+
+def getBlob(blobPath: str) -> dai.OpenVINO.Blob:
+    return getBlobCache().get(blobPath)
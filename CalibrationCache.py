@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import depthai as dai
+import ConfigManager as cm
+import Log
+
+
+# Calibration data lives in each OAK's EEPROM.  Reading it is a round trip over XLink, and we used to
+# do that several times per camera on every boot.  The cache keeps everything we derive from the
+# calibration (lens position, intrinsics at each resolution we have asked for, distortion coefficients)
+# on disk, one JSON file per MXID.
+#
+# A cached entry is only trusted when its fingerprint matches the EEPROM contents the device reported
+# on this boot.  Offline tools (replay, re-evaluation) can call CalibrationCache.load(mxid) to get
+# exactly the numbers the camera used, with no device attached.
+
+CACHE_VERSION = 1
+
+
+def _fingerprint(eeprom) -> str:
+    return hashlib.sha256(json.dumps(eeprom, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _sizeKey(width, height) -> str:
+    return f"{int(width)}x{int(height)}"
+
+
+class CameraCalibration:
+
+    def __init__(self, mxid: str, path: Path, data: dict, calibHandler: dai.CalibrationHandler = None):
+        self.mxid = mxid
+        self.path = path
+        self.eeprom = data['eeprom']
+        self.fingerprint = data['fingerprint']
+        self.lensPosition = data.get('lensPosition')
+        self.distortion = data.get('distortion')
+        self.intrinsics = data.get('intrinsics', {})
+        self.cacheHit = calibHandler is None
+        self._calibHandler = calibHandler
+
+    # The dai.CalibrationHandler is only rebuilt from the cached EEPROM image if we actually need to
+    # compute something that is not cached yet
+
+    def getCalibrationHandler(self) -> dai.CalibrationHandler:
+        if self._calibHandler is None:
+            self._calibHandler = dai.CalibrationHandler.fromJson(self.eeprom)
+        return self._calibHandler
+
+    # Returns the RGB camera intrinsics scaled to width x height, computing and caching them if needed
+
+    def getIntrinsics(self, width, height):
+        key = _sizeKey(width, height)
+        if key not in self.intrinsics:
+            self.intrinsics[key] = self.getCalibrationHandler().getCameraIntrinsics(dai.CameraBoardSocket.CAM_A, int(width), int(height))
+            self.save()
+        return self.intrinsics[key]
+
+    def toJson(self) -> dict:
+        return {
+            "version": CACHE_VERSION,
+            "mxid": self.mxid,
+            "fingerprint": self.fingerprint,
+            "lensPosition": self.lensPosition,
+            "distortion": self.distortion,
+            "intrinsics": self.intrinsics,
+            "eeprom": self.eeprom
+        }
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(self.toJson(), f)
+            os.replace(tmp, self.path)      # Never leave a half-written cache file behind
+        except OSError as err:
+            Log.warning("Could not write calibration cache '%s': %s", self.path, err)
+
+
+class CalibrationCache:
+
+    def __init__(self, cacheDir: str = None):
+        if cacheDir is None:
+            cacheDir = cm.mvConfig.cacheDir
+        self.cacheDir = Path(cacheDir).expanduser() / "calibration"
+
+    def _path(self, mxid: str) -> Path:
+        return self.cacheDir / (mxid + ".json")
+
+    def _read(self, mxid: str) -> dict:
+        try:
+            with open(self._path(mxid), "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return None
+        return data
+
+    # Offline use: return whatever is cached for mxid without talking to a device
+
+    def load(self, mxid: str) -> CameraCalibration:
+        data = self._read(mxid)
+        if data is None:
+            return None
+        return CameraCalibration(mxid, self._path(mxid), data)
+
+    # Return the calibration for mxid, validated against the calibration just read from the device.
+    # If the cached entry is missing or stale, it is rebuilt from calibHandler and written back.
+
+    def get(self, mxid: str, calibHandler: dai.CalibrationHandler) -> CameraCalibration:
+        eeprom = calibHandler.eepromToJson()
+        fingerprint = _fingerprint(eeprom)
+
+        data = self._read(mxid)
+        if data is not None and data['fingerprint'] == fingerprint:
+            calibration = CameraCalibration(mxid, self._path(mxid), data, calibHandler)
+            calibration.cacheHit = True
+            return calibration
+
+        try:
+            lensPosition = calibHandler.getLensPosition(dai.CameraBoardSocket.RGB)
+        except RuntimeError:
+            lensPosition = None
+
+        try:
+            distortion = calibHandler.getDistortionCoefficients(dai.CameraBoardSocket.CAM_A)
+        except RuntimeError:
+            distortion = None
+
+        data = {
+            "fingerprint": fingerprint,
+            "lensPosition": lensPosition,
+            "distortion": distortion,
+            "intrinsics": {},
+            "eeprom": eeprom
+        }
+        calibration = CameraCalibration(mxid, self._path(mxid), data, calibHandler)
+        calibration.save()
+        return calibration
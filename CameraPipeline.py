@@ -4,10 +4,95 @@ import sys
 import time
 import cv2
 import depthai as dai
+import numpy as np
 import ConfigManager as cm
+import Log
+from CalibrationCache import CalibrationCache, CameraCalibration
+from BlobCache import getBlob
+from FrameBus import FrameBusWriter
+from YoloDecoder import SpatialPoint, YoloDecoder
+from Profiles import DEFAULT_PROFILE, PROFILES, gatePeriods
+from Models import ModelScheduler
+from PointCloud import PointCloud
+
+
+# How many of the ROI sets last sent to the SpatialLocationCalculator are remembered.  Its results
+# lag the requests by a frame or two, so each one is matched against the set it was computed for.
+
+SPATIAL_HISTORY = 4
+
+# Runs in a Script node on the device.  Forwards every Nth message from "in" to "out" (none if N is
+# 0); N is changed by "name=N,..." text messages on "control".  "name=once" forwards the next
+# message whatever N is.
+
+GATE_SCRIPT = """
+every = {every}
+count = 0
+once = False
+while True:
+    frame = node.io['in'].get()
+    control = node.io['control'].tryGet()
+    if control is not None:
+        for item in bytes(control.getData()).decode().split(','):
+            (key, value) = item.split('=')
+            if key == '{name}':
+                if value == 'once':
+                    once = True
+                else:
+                    every = int(value)
+                    count = 0
+    count += 1
+    if once or (every > 0 and count % every == 0):
+        once = False
+        node.io['out'].send(frame)
+"""
+
+# Also a Script node: hands each frame from "in" to the next model in the schedule, on output
+# "nn<model index>".  A "schedule=0:1:0" message on "control" replaces the schedule.  See Models.
+
+ROUTER_SCRIPT = """
+schedule = [{schedule}]
+index = 0
+while True:
+    frame = node.io['in'].get()
+    control = node.io['control'].tryGet()
+    if control is not None:
+        for item in bytes(control.getData()).decode().split(','):
+            (key, value) = item.split('=')
+            if key == 'schedule':
+                schedule = [int(m) for m in value.split(':') if m != '']
+                index = 0
+    if len(schedule) > 0:
+        node.io['nn' + str(schedule[index % len(schedule)])].send(frame)
+        index += 1
+"""
+
+
+
+# The false-colour depth image used for display and to tell the NN overlay that depth is available
+
+def colorizeDepth(depthFrame):
+    depthFrameColor = cv2.normalize(depthFrame, None, 255, 0, cv2.NORM_MINMAX, cv2.CV_8UC1)
+    depthFrameColor = cv2.equalizeHist(depthFrameColor)
+    return cv2.applyColorMap(depthFrameColor, cv2.COLORMAP_RAINBOW)
+
 
-scaleFactor = 1     # Scale factor for the image to reduce processing time
+class DeviceTelemetry:
 
+    __slots__ = ("temperature", "cssCpu", "mssCpu", "ddr", "cmx", "cssMemory", "mssMemory")
+
+    def __init__(self, temperature, cssCpu, mssCpu, ddr, cmx, cssMemory, mssMemory):
+        self.temperature = temperature
+        self.cssCpu = cssCpu
+        self.mssCpu = mssCpu
+        self.ddr = ddr
+        self.cmx = cmx
+        self.cssMemory = cssMemory
+        self.mssMemory = mssMemory
+
+
+def _percent(memory) -> float:
+    return 100 * memory.used / memory.total if memory.total > 0 else 0.0
 
 
 class CameraPipeline:
@@ -23,8 +108,9 @@ class CameraPipeline:
     # devInfo: dai.DeviceInfo    # The device info object
     # useDepth: bool             # True: use depth if available, False: use RGB only
     # nnFile: str                # The neural network config file.  None if no NN is to be used
+    # calibration: CameraCalibration  # Cached calibration for this device (see CalibrationCache)
 
-    def __init__(self, name: str, devInfo : dai.DeviceInfo, useDepth : bool, nnFile : str):
+    def __init__(self, name: str, devInfo : dai.DeviceInfo, useDepth : bool, nnFile : str, calibration : CameraCalibration = None):
         self.name = name
         device: dai.Device = dai.Device(devInfo)
         self.devInfo = devInfo
@@ -44,10 +130,28 @@ class CameraPipeline:
 
         self.ispScale = (2, 3)
 
+        cameraConfig = cm.mvConfig.getCamera(devInfo.getMxId())
+        self.stereoConfig = cameraConfig.stereo if cameraConfig is not None else cm.StereoConfig()
+        self.nnEvery = cameraConfig.nnEvery if cameraConfig is not None else 1
+        self.mount = cameraConfig.mount if cameraConfig is not None else cm.MountConfig()
+
+        # The NN models this camera time-slices between (see Models); None if it has none
+
+        if cameraConfig is not None and cameraConfig.models:
+            modelConfigs = cameraConfig.models
+        else:
+            modelConfigs = [cm.ModelConfig(nnFile)] if nnFile is not None else []
+        schedule = cameraConfig.nnSchedule if cameraConfig is not None else "round-robin"
+        self.models = ModelScheduler(modelConfigs, schedule) if len(modelConfigs) > 0 else None
+
         self.bbfraction = 0.2 # The size of the inner bounding box as a fraction of the original
+        self.inputSize = None       # The first model's input size, which is also the preview size
 
         self.NN_FILE = nnFile
         self.LABELS = None
+        self.nn = None              # The first model's NN config
+        self.openvinoVersion = ''
+        self.modelQueues = []
 
         self.pipeline = dai.Pipeline()
 
@@ -58,40 +162,65 @@ class CameraPipeline:
         self.detections = None
         self.depthFrameColor = None
         self.cameraIntrinsics = None
-        self.calibData = None
+        self.calibData = calibration
+        self.frameBus = None
+        self.spatialCalc = None
+        self.spatialRois = {}       # Config sequence number -> {ROI sent to the SpatialLocationCalculator: the caller's key}
+        self.spatialSeq = 0
+        self.spatialLocations = {}  # key -> (x, y, z) in mm, from the latest spatial data
+        self.frameTimestamp = 0.0
+        self.frameSequenceNum = -1
+        self.pointCloud = None
+        self.pointCloudUpdated = False
+        self.telemetry = None
+        self.telemetryUpdated = False
+        self.telemetryQueue = None
+        self.profile = DEFAULT_PROFILE
+        self.requestedProfile = None
+        self.controlQueue = None
+
+        # With cached calibration the intrinsics are known before the pipeline is even built,
+        # so the AprilTag pose estimator can be created right away
+
+        if self.calibData is not None:
+            self.cameraIntrinsics = self.calibData.getIntrinsics(*self.getIspSize())
 
         return
+
+    # The ISP output size follows directly from the sensor resolution and ISP scale
+
+    def getIspSize(self):
+        return (self.rgbWidth * self.ispScale[0] // self.ispScale[1], self.rgbHeight * self.ispScale[0] // self.ispScale[1])
+
+    # Size of the depth frames the host receives, after on-device decimation
+
+    def getDepthSize(self):
+        return (self.monoWidth // self.stereoConfig.decimation, self.monoHeight // self.stereoConfig.decimation)
     
-    def parse_error(self, mess):
+    def parse_error(self, nnFile, mess):
         """Report parse error."""
-        print("config error in '" + self.NN_FILE + "': " + mess, file=sys.stderr)
+        Log.error("config error in '%s': %s", nnFile, mess)
 
-    def read_nn_config(self):
+    def read_nn_config(self, nnFile):
         try: # Try to open the NN config file
-            with open(self.NN_FILE, "rt", encoding="utf-8") as f:
+            with open(nnFile, "rt", encoding="utf-8") as f:
                 j = json.load(f) # Load in json format
         except OSError as err: # If file doesn't exist then throw an error
-            print("could not open '{}': {}".format(self.NN_FILE, err), file=sys.stderr)
+            Log.error("could not open '%s': %s", nnFile, err)
             return {}
 
         # top level must be an object
         if not isinstance(j, dict):
-            self.parse_error("must be JSON object")
+            self.parse_error(nnFile, "must be JSON object")
             return {}
 
         return j # Return the config json
 
 
-    def setupSDN(self):
-
-# If no neural network config is given, assume we are depth-only on an OAK-D
-# On an OAK-1, I guess this means we're using an overly-expensive webcam :-)
+    # Parse and validate the NN config file.  Everything setupSDN needs is returned in a flat dict.
 
-        if self.NN_FILE is None:
-            return None
-        
-        nnJSON = self.read_nn_config()
-        self.LABELS = nnJSON['mappings']['labels']
+    def parseNNConfig(self, nnFile) -> dict:
+        nnJSON = self.read_nn_config(nnFile)
         nnConfig = nnJSON['nn_config']
     
         # Get path to blob
@@ -100,39 +229,112 @@ class CameraPipeline:
         nnBlobPath = str((Path(__file__).parent / Path('models/' + blob)).resolve().absolute())
 
         if not Path(nnBlobPath).exists():
-            import sys
-
             raise FileNotFoundError(f'Required file/s not found, please run "{sys.executable} install_requirements.py"')
 
         try:
-            self.openvinoVersion = nnConfig['openvino_version']
+            openvinoVersion = nnConfig['openvino_version']
         except KeyError:
-            self.openvinoVersion = ''
-
-        if self.openvinoVersion != '':
-            self.pipeline.setOpenVINOVersion(self.openvinoVersionMap[self.openvinoVersion])
+            openvinoVersion = ''
 
         try:
-            self.inputSize = tuple(map(int, nnConfig.get("input_size").split('x')))
-        except KeyError:
-            self.inputSize = (300, 300)
+            inputSize = tuple(map(int, nnConfig.get("input_size").split('x')))
+        except (KeyError, AttributeError):
+            inputSize = (300, 300)
 
         family = nnConfig['NN_family']
-        if family == 'mobilenet':
-            if self.hasDepth: detectionNodeType = dai.node.MobileNetSpatialDetectionNetwork
-            else: detectionNodeType = dai.node.MobileNetDetectionNetwork
-        elif family == 'YOLO':
-            if self.hasDepth: detectionNodeType = dai.node.YoloSpatialDetectionNetwork
-            else: detectionNodeType = dai.node.YoloDetectionNetwork
-        else:
+        if family not in ('mobilenet', 'YOLO'):
             raise Exception(f'Unknown NN_family: {family}')
 
+        # "device": the detection network node decodes the outputs.  "host": a plain NeuralNetwork
+        # node runs the model and YoloDecoder decodes the raw tensors here.
+
+        decode = nnConfig.get('decode', 'device')
+        if decode not in ('device', 'host'):
+            raise Exception(f'Unknown decode: {decode}')
+        if decode == 'host' and family != 'YOLO':
+            raise Exception('decode "host" is only supported for YOLO models')
+
         try:
-            self.bbfraction = nnConfig['bb_fraction']
+            bbfraction = nnConfig['bb_fraction']
         except KeyError:
-            self.bbfraction = self.bbfraction			# No change fromn default
+            bbfraction = self.bbfraction			# No change fromn default
+
+        nn = {
+            "labels": nnJSON['mappings']['labels'],
+            "blobPath": nnBlobPath,
+            "openvinoVersion": openvinoVersion,
+            "inputSize": inputSize,
+            "family": family,
+            "decode": decode,
+            "bbfraction": bbfraction
+        }
 
+        if family == 'YOLO':
+            metadata = nnConfig['NN_specific_metadata']
+            nn["classes"] = metadata['classes']
+            nn["coordinates"] = metadata['coordinates']
+            nn["anchors"] = metadata['anchors']
+            nn["anchorMasks"] = metadata['anchor_masks']
+            nn["iouThreshold"] = metadata['iou_threshold']
+            nn["confidenceThreshold"] = metadata['confidence_threshold']
+            nn["classThresholds"] = metadata.get('class_confidence_thresholds', {})
+            nn["topK"] = metadata.get('top_k', 100)
+            nn["sigmoid"] = metadata.get('sigmoid', False)
+        else:
+            nn["confidenceThreshold"] = nnConfig['confidence_threshold']
+
+        return nn
+
+
+    # Creates the detection network for each of the camera's models.  Returns the list of them, in
+    # model order, or None if the camera has no NN.
+
+    def setupSDN(self):
+
+# If no neural network config is given, assume we are depth-only on an OAK-D
+# On an OAK-1, I guess this means we're using an overly-expensive webcam :-)
+
+        if self.models is None:
+            return None
+
+        networks = [self.setupModel(model) for model in self.models]
+
+        # Everything that has to be the same for the whole camera comes from the first model
+
+        self.models.mergeLabels()
+        self.models.setSchedule(self.profile)
+        first = self.models.models[0]
+        self.nn = first.nn
+        self.LABELS = self.models.labels
+        self.inputSize = first.inputSize
+        self.bbfraction = first.bbfraction
+
+        return networks
+
+    def setupModel(self, model):
+        startTime = time.perf_counter()
+
+        nn = self.parseNNConfig(model.config.file)
+        model.setNN(nn)
+        family = nn['family']
+
+        # The OpenVINO version is set for the whole pipeline, so the models have to agree on it
+
+        if nn['openvinoVersion'] != '':
+            if self.openvinoVersion not in ('', nn['openvinoVersion']):
+                raise Exception(f"{model.config.file} needs OpenVINO {nn['openvinoVersion']}, but {self.name} already uses {self.openvinoVersion}")
+            self.openvinoVersion = nn['openvinoVersion']
+            self.pipeline.setOpenVINOVersion(self.openvinoVersionMap[self.openvinoVersion])
 
+        if nn.get('decode') == 'host':
+            return self.setupHostDecodedNN(model, startTime)
+
+        if family == 'mobilenet':
+            if self.hasDepth: detectionNodeType = dai.node.MobileNetSpatialDetectionNetwork
+            else: detectionNodeType = dai.node.MobileNetDetectionNetwork
+        else:
+            if self.hasDepth: detectionNodeType = dai.node.YoloSpatialDetectionNetwork
+            else: detectionNodeType = dai.node.YoloDetectionNetwork
 
         # Create the spatial detection network node - either MobileNet or YOLO (from above)
 
@@ -141,46 +343,74 @@ class CameraPipeline:
         # Set the NN-specific stuff
 
         if family == 'YOLO':
-            spatialDetectionNetwork.setNumClasses(nnConfig['NN_specific_metadata']['classes'])
-            spatialDetectionNetwork.setCoordinateSize(nnConfig['NN_specific_metadata']['coordinates'])
-            spatialDetectionNetwork.setAnchors(nnConfig['NN_specific_metadata']['anchors'])
-            spatialDetectionNetwork.setAnchorMasks(nnConfig['NN_specific_metadata']['anchor_masks'])
-            spatialDetectionNetwork.setIouThreshold(nnConfig['NN_specific_metadata']['iou_threshold'])
-            x = nnConfig['NN_specific_metadata']['confidence_threshold']
-            spatialDetectionNetwork.setConfidenceThreshold(x)
-        else:
-            x = nnConfig['confidence_threshold']
-            spatialDetectionNetwork.setConfidenceThreshold(x)
+            spatialDetectionNetwork.setNumClasses(nn['classes'])
+            spatialDetectionNetwork.setCoordinateSize(nn['coordinates'])
+            spatialDetectionNetwork.setAnchors(nn['anchors'])
+            spatialDetectionNetwork.setAnchorMasks(nn['anchorMasks'])
+            spatialDetectionNetwork.setIouThreshold(nn['iouThreshold'])
+
+        spatialDetectionNetwork.setConfidenceThreshold(nn['confidenceThreshold'])
         
-        spatialDetectionNetwork.setBlobPath(nnBlobPath)
-        spatialDetectionNetwork.setConfidenceThreshold(0.5)
+        spatialDetectionNetwork.setBlob(getBlob(nn['blobPath']))      # Shared by every camera using this model
         spatialDetectionNetwork.input.setBlocking(False)
 
         if self.hasDepth:
-            spatialDetectionNetwork.setBoundingBoxScaleFactor(self.bbfraction)
-            spatialDetectionNetwork.setDepthLowerThreshold(100)
-            spatialDetectionNetwork.setDepthUpperThreshold(5000)
+            spatialDetectionNetwork.setBoundingBoxScaleFactor(model.bbfraction)
+            (minDepth, maxDepth) = self.stereoConfig.depthRange()
+            spatialDetectionNetwork.setDepthLowerThreshold(minDepth)
+            spatialDetectionNetwork.setDepthUpperThreshold(maxDepth)
+
+        self.reportSetupTime(model, startTime)
 
         return spatialDetectionNetwork
-    
 
+    # Raw output mode: the device only runs the model, and the host decodes the output tensors (with
+    # per-class thresholds and top-k) and works out the spatial coordinates from the depth frame.
+    # This allows YOLO heads the on-device decoder doesn't understand.
 
-    def buildPipeline(self, spatialDetectionNetwork, invert : bool = False):
+    def setupHostDecodedNN(self, model, startTime):
+        neuralNetwork = self.pipeline.create(dai.node.NeuralNetwork)
+        neuralNetwork.setBlob(getBlob(model.nn['blobPath']))
+        neuralNetwork.setNumInferenceThreads(2)
+        neuralNetwork.input.setQueueSize(1)
+        neuralNetwork.input.setBlocking(False)
 
-        # Linking      
-        try:
-            lensPosition = dai.Device(self.devInfo).readCalibration2().getLensPosition(dai.CameraBoardSocket.RGB)
-            if lensPosition:
-                self.camRgb.initialControl.setManualFocus(lensPosition)
-        except:
-            pass
+        model.decoder = YoloDecoder.fromNN(model.nn)
+
+        self.reportSetupTime(model, startTime)
+
+        return neuralNetwork
+
+    def reportSetupTime(self, model, startTime):
+        model.setupTime = time.perf_counter() - startTime
+        Log.info("Set up %s %s in %.1f ms", self.name, model.name, model.setupTime * 1000)
+    
+    # networks is setupSDN's list of detection networks, or None
+
+    def buildPipeline(self, networks, invert : bool = False):
 
         # Define sources and outputs
 
         self.camRgb = self.pipeline.create(dai.node.ColorCamera)
+
+        # For now, RGB needs fixed focus to properly align with depth.
+        # This value was used during calibration
+
+        if self.calibData is not None:
+            if self.calibData.lensPosition:
+                self.camRgb.initialControl.setManualFocus(self.calibData.lensPosition)
+            elif self.hasDepth:
+                Log.warning("Camera calibration failed for %s!", self.name)
+
         self.xoutRgb = self.pipeline.create(dai.node.XLinkOut)
         self.xoutRgb.setStreamName("rgb")
 
+        # Host -> device control for the frame gates (see Profiles)
+
+        self.gates = gatePeriods(self.profile, cm.mvConfig.CAMERA_FPS, self.nnEvery)
+        self.xinControl = self.pipeline.create(dai.node.XLinkIn)
+        self.xinControl.setStreamName("control")
+
         if cm.mvConfig.showPreview and cm.frcConfig.hasDisplay:
             self.xoutPreview = self.pipeline.create(dai.node.XLinkOut)
             self.xoutPreview.setStreamName("preview")
@@ -192,16 +422,25 @@ class CameraPipeline:
             self.monoLeft = self.pipeline.create(dai.node.MonoCamera)
             self.monoRight = self.pipeline.create(dai.node.MonoCamera)
             self.stereo = self.pipeline.create(dai.node.StereoDepth)
-            if scaleFactor != 1:
-                # self.ispScaleNode = self.pipeline.create(dai.node.ImageManip)
-                self.depthScaleNode = self.pipeline.create(dai.node.ImageManip)
             self.xoutDepth = self.pipeline.create(dai.node.XLinkOut)
-            # self.xoutIsp = self.pipeline.create(dai.node.XLinkOut)
             self.xoutDepth.setStreamName("depth")
 
-        if spatialDetectionNetwork is not None:
-            self.xoutNN = self.pipeline.create(dai.node.XLinkOut)
-            self.xoutNN.setStreamName("detections")
+            if cm.mvConfig.tagStereoDepth:
+                self.buildSpatialCalculator()
+
+        if cm.mvConfig.telemetryRate > 0:
+            self.sysLog = self.pipeline.create(dai.node.SystemLogger)
+            self.sysLog.setRate(cm.mvConfig.telemetryRate)
+            self.xoutSysInfo = self.pipeline.create(dai.node.XLinkOut)
+            self.xoutSysInfo.setStreamName("sysinfo")
+            self.sysLog.out.link(self.xoutSysInfo.input)
+
+        if networks is not None:
+            self.xoutNN = []
+            for model in self.models:
+                xoutNN = self.pipeline.create(dai.node.XLinkOut)
+                xoutNN.setStreamName(model.stream)
+                self.xoutNN.append(xoutNN)
             self.camRgb.setPreviewSize(self.inputSize)
 
         # Properties
@@ -217,7 +456,7 @@ class CameraPipeline:
         else:
             self.camRgb.setImageOrientation(dai.CameraImageOrientation.NORMAL) 
 
-        print("Camera FPS: {}".format(self.camRgb.getFps()))
+        Log.info("Camera FPS: %s", self.camRgb.getFps())
 
         if self.hasDepth:
             self.monoLeft.setResolution(self.monoResolution)
@@ -231,13 +470,7 @@ class CameraPipeline:
             self.stereo.setLeftRightCheck(True)
             self.stereo.setDepthAlign(dai.CameraBoardSocket.RGB)
             self.stereo.setOutputSize(self.monoLeft.getResolutionWidth(), self.monoLeft.getResolutionHeight())
-
-            if scaleFactor != 1:
-                w = self.monoLeft.getResolutionWidth()
-                h = self.monoLeft.getResolutionHeight()
-
-                self.ispScaleNode.setResize(int(w/scaleFactor), int(h/scaleFactor))
-                self.depthScaleNode.setResize(int(w/scaleFactor), int(h/scaleFactor))
+            self.configureStereoFilters()       # Decimation then shrinks this by its factor
 
             # Linking
 
@@ -246,36 +479,273 @@ class CameraPipeline:
             sizeForIntrinsic = self.camRgb.getIspSize()
 
 
-            if spatialDetectionNetwork is not None:
-                self.camRgb.preview.link(spatialDetectionNetwork.input)
-                self.camRgb.isp.link(self.xoutRgb.input)
+            if networks is not None:
+                self.linkModels(networks)
+                self.linkThroughGate("rgb", self.camRgb.isp, self.xoutRgb.input)
 
-                spatialDetectionNetwork.out.link(self.xoutNN.input)
+                for (model, network) in zip(self.models, networks):
+                    if model.decoder is None:
+                        self.stereo.depth.link(network.inputDepth)
 
-                self.stereo.depth.link(spatialDetectionNetwork.inputDepth)
+                # With one on-device model that sees every frame, the depth comes through it, in step
+                # with its detections.  Otherwise the models see different frames, detections are
+                # located on the host, or (nnEvery other than 1) the passthrough would only carry the
+                # frames the NN ran on, so the depth stream and point cloud would slow down or stop.
 
-                if scaleFactor == 1:
-                    spatialDetectionNetwork.passthroughDepth.link(self.xoutDepth.input)
+                first = self.models.models[0]
+                if len(networks) == 1 and first.decoder is None and self.nnEvery == 1:
+                    self.linkThroughGate("depth", networks[0].passthroughDepth, self.xoutDepth.input)
                 else:
-                    self.depthScaleNode.out.link(self.xoutDepth.input)
+                    self.linkThroughGate("depth", self.stereo.depth, self.xoutDepth.input)
             else:
-                self.camRgb.isp.link(self.xoutRgb.input)
+                self.linkThroughGate("rgb", self.camRgb.isp, self.xoutRgb.input)
                 sizeForIntrinsic = self.camRgb.getIspSize()
-                self.stereo.depth.link(self.xoutDepth.input)
+                self.linkThroughGate("depth", self.stereo.depth, self.xoutDepth.input)
         else:
-            self.camRgb.isp.link(self.xoutRgb.input) # If not using a NN then link the camera output directly to the xLink rgb output node
+            self.linkThroughGate("rgb", self.camRgb.isp, self.xoutRgb.input) # If not using a NN then link the camera output directly to the xLink rgb output node
             sizeForIntrinsic = self.camRgb.getIspSize()
-            if spatialDetectionNetwork is not None:
-                self.camRgb.preview.link(spatialDetectionNetwork.input) # Link camera's preview output to the input of the NN node
-                spatialDetectionNetwork.out.link(self.xoutNN.input) # Link NN output to the xLink detections output node
+            if networks is not None:
+                self.linkModels(networks) # Link camera's preview output to the input of the NN nodes
 
         self.device = dai.Device(self.pipeline, self.devInfo)
 
-        self.cameraIntrinsics = self.device.readCalibration().getCameraIntrinsics(dai.CameraBoardSocket.CAM_A, sizeForIntrinsic[0], sizeForIntrinsic[1])
+        if self.calibData is None:
+            self.calibData = CalibrationCache().get(self.devInfo.getMxId(), self.device.readCalibration())
+        self.cameraIntrinsics = self.calibData.getIntrinsics(sizeForIntrinsic[0], sizeForIntrinsic[1])
         
         return
     
 
+    # Link source to destination through a Script node gate that the host can open, throttle or close
+
+    def linkThroughGate(self, name: str, source, destination):
+        gate = self.pipeline.create(dai.node.Script)
+        gate.setScript(GATE_SCRIPT.format(name=name, every=self.gates[name]))
+        gate.inputs['in'].setBlocking(False)
+        gate.inputs['in'].setQueueSize(1)
+        gate.inputs['control'].setBlocking(False)
+        gate.inputs['control'].setQueueSize(4)
+
+        source.link(gate.inputs['in'])
+        self.xinControl.out.link(gate.inputs['control'])
+        gate.outputs['out'].link(destination)
+
+    # The camera's preview goes through the "nn" gate to the model, or with several models to a
+    # router that shares the frames out between them (see Models).  A model whose input size differs
+    # from the first model's gets the preview resized for it.  Each model's output has its own stream.
+
+    def linkModels(self, networks):
+        if len(networks) == 1:
+            self.linkThroughGate("nn", self.camRgb.preview, networks[0].input)
+        else:
+            router = self.pipeline.create(dai.node.Script)
+            router.setScript(ROUTER_SCRIPT.format(schedule=", ".join(str(i) for i in self.models.schedule)))
+            router.inputs['in'].setBlocking(False)
+            router.inputs['in'].setQueueSize(1)
+            router.inputs['control'].setBlocking(False)
+            router.inputs['control'].setQueueSize(4)
+
+            self.linkThroughGate("nn", self.camRgb.preview, router.inputs['in'])
+            self.xinControl.out.link(router.inputs['control'])
+
+            for (model, network) in zip(self.models, networks):
+                output = router.outputs['nn' + str(model.index)]
+                if model.inputSize != self.inputSize:
+                    (width, height) = model.inputSize
+                    manip = self.pipeline.create(dai.node.ImageManip)
+                    manip.initialConfig.setResize(width, height)
+                    manip.initialConfig.setFrameType(dai.ImgFrame.Type.BGR888p)
+                    manip.setMaxOutputFrameSize(width * height * 3)
+                    output.link(manip.inputImage)
+                    output = manip.out
+                output.link(network.input)
+
+        for (network, xoutNN) in zip(networks, self.xoutNN):
+            network.out.link(xoutNN.input)
+
+    # Switch to one of the Profiles.PROFILES.  The device's gates are changed right away; the host
+    # stages check runNN and runTags.
+
+    def setProfile(self, profile: str):
+        self.gates = gatePeriods(profile, cm.mvConfig.CAMERA_FPS, self.nnEvery)
+        self.profile = profile
+        if self.models is not None:
+            self.models.setSchedule(profile)
+        self.sendControl()
+
+        if not self.runNN:
+            self.detections = None
+            if self.models is not None:
+                self.models.clear()
+        if not PROFILES[profile][2]:
+            self.depthFrame = None
+            self.depthFrameColor = None
+
+        Log.info("%s profile: %s", self.name, profile)
+
+    def sendControl(self, text: str = None):
+        if self.controlQueue is None:
+            return
+        if text is None:
+            text = ",".join(f"{name}={every}" for name, every in self.gates.items())
+            if self.models is not None and len(self.models) > 1:
+                text += "," + self.models.control()
+        buffer = dai.Buffer()
+        buffer.setData(list(text.encode()))
+        self.controlQueue.send(buffer)
+
+    # Run the NN on the next frame, e.g. for a camera with nnEvery 0
+
+    def triggerNN(self):
+        if self.runNN:
+            self.sendControl("nn=once")
+
+    # Every model's latest detections, each dropped once it is older than two of its model's NN
+    # periods (however long the NN actually takes).  So with nnEvery > 1, or several models sharing
+    # the frames, the last result is used for the frames in between, and a triggered result is only
+    # used for a frame or two.
+
+    def currentDetections(self):
+        if self.models is None:
+            return None
+        return self.models.current(time.monotonic(), 1 / cm.mvConfig.CAMERA_FPS, self.nnEvery)
+
+    # Applies a changed confidence_threshold to the models using nnFile.  Returns True if the camera
+    # has to be restarted for it (see Models).
+
+    def setConfidenceThreshold(self, nnFile: str, threshold: float) -> bool:
+        if self.models is None:
+            return False
+        return self.models.setConfidenceThreshold(nnFile, threshold)
+
+    @property
+    def runNN(self) -> bool:
+        return PROFILES[self.profile][0]
+
+    @property
+    def runTags(self) -> bool:
+        return PROFILES[self.profile][1]
+
+    # A SpatialLocationCalculator lets the host ask for the stereo XYZ of any regions it likes (the
+    # tags it found in the last frame, say) without averaging the depth frame itself.  ROIs go in
+    # through the "spatialCalcConfig" queue, results come back on "spatialData".
+
+    def buildSpatialCalculator(self):
+        self.spatialCalc = self.pipeline.create(dai.node.SpatialLocationCalculator)
+        self.spatialCalc.inputConfig.setWaitForMessage(False)
+
+        # The node needs an ROI to start with; its results don't match any key, so they are ignored
+
+        config = dai.SpatialLocationCalculatorConfigData()
+        config.roi = dai.Rect(dai.Point2f(0.45, 0.45), dai.Point2f(0.55, 0.55))
+        self.spatialCalc.initialConfig.addROI(config)
+
+        self.xinSpatialConfig = self.pipeline.create(dai.node.XLinkIn)
+        self.xinSpatialConfig.setStreamName("spatialCalcConfig")
+        self.xinSpatialConfig.out.link(self.spatialCalc.inputConfig)
+
+        self.xoutSpatialData = self.pipeline.create(dai.node.XLinkOut)
+        self.xoutSpatialData.setStreamName("spatialData")
+        self.spatialCalc.out.link(self.xoutSpatialData.input)
+
+        self.stereo.depth.link(self.spatialCalc.inputDepth)
+
+    # rois: {key: (xmin, ymin, xmax, ymax)}, normalized to the RGB frame.  The results show up in
+    # spatialLocations[key] once the device has processed a depth frame with the new ROIs.
+
+    def requestSpatialLocations(self, rois: dict):
+        if self.spatialCalc is None or len(rois) == 0:
+            return
+
+        # Coordinates are quantized so the ROI echoed back by the device can be matched exactly
+
+        config = dai.SpatialLocationCalculatorConfig()
+        keys = {}
+        (minDepth, maxDepth) = self.stereoConfig.depthRange()
+
+        for key, box in rois.items():
+            (x1, y1, x2, y2) = (round(min(max(v, 0.0), 1.0), 3) for v in box)
+            if x2 <= x1 or y2 <= y1:
+                continue
+
+            data = dai.SpatialLocationCalculatorConfigData()
+            data.depthThresholds.lowerThreshold = minDepth
+            data.depthThresholds.upperThreshold = maxDepth
+            data.calculationAlgorithm = dai.SpatialLocationCalculatorAlgorithm.MEDIAN
+            data.roi = dai.Rect(dai.Point2f(x1, y1), dai.Point2f(x2, y2))
+            config.addROI(data)
+            keys[(x1, y1, x2, y2)] = key
+
+        if len(keys) > 0:
+            self.spatialSeq += 1
+            self.spatialRois[self.spatialSeq] = keys
+            while len(self.spatialRois) > SPATIAL_HISTORY:
+                del self.spatialRois[next(iter(self.spatialRois))]
+            self.spatialConfigQueue.send(config)
+
+    # The device computes all the ROIs of one config together, so a result belongs to the newest
+    # config that asked for every ROI in it.  A result that matches none (the initial ROI, or a config
+    # that has aged out) is dropped.
+
+    def readSpatialData(self, spatialData):
+        locations = spatialData.getSpatialLocations()
+        rois = [(round(l.config.roi.x, 3), round(l.config.roi.y, 3),
+                 round(l.config.roi.x + l.config.roi.width, 3), round(l.config.roi.y + l.config.roi.height, 3)) for l in locations]
+
+        keys = {}
+        for seq in reversed(self.spatialRois):
+            if all(roi in self.spatialRois[seq] for roi in rois):
+                keys = self.spatialRois[seq]
+                break
+
+        self.spatialLocations = {}
+        for (roi, location) in zip(rois, locations):
+            key = keys.get(roi)
+            if key is not None and location.spatialCoordinates.z > 0:
+                c = location.spatialCoordinates
+                self.spatialLocations[key] = (c.x, c.y, c.z)
+
+    # Post-processing filters run on the device, in the order median, spatial, temporal, threshold,
+    # decimation, so the host gets a smaller and cleaner depth frame
+
+    def configureStereoFilters(self):
+        sc = self.stereoConfig
+        config = self.stereo.initialConfig.get()
+
+        config.postProcessing.median = {
+            0: dai.MedianFilter.MEDIAN_OFF,
+            3: dai.MedianFilter.KERNEL_3x3,
+            5: dai.MedianFilter.KERNEL_5x5,
+            7: dai.MedianFilter.KERNEL_7x7
+        }[sc.median]
+
+        config.postProcessing.spatialFilter.enable = sc.spatial
+        config.postProcessing.spatialFilter.alpha = sc.spatialAlpha
+        config.postProcessing.spatialFilter.delta = sc.spatialDelta
+        config.postProcessing.spatialFilter.holeFillingRadius = sc.holeFillingRadius
+        config.postProcessing.spatialFilter.numIterations = 1
+
+        config.postProcessing.temporalFilter.enable = sc.temporal
+        config.postProcessing.temporalFilter.alpha = sc.temporalAlpha
+
+        # Left at the device's full range unless a range is configured
+
+        if sc.hasDepthRange():
+            (config.postProcessing.thresholdFilter.minRange, config.postProcessing.thresholdFilter.maxRange) = sc.depthRange()
+
+        decimationModes = dai.RawStereoDepthConfig.PostProcessing.DecimationFilter.DecimationMode
+        config.postProcessing.decimationFilter.decimationFactor = sc.decimation
+        config.postProcessing.decimationFilter.decimationMode = {
+            "pixel_skipping": decimationModes.PIXEL_SKIPPING,
+            "non_zero_median": decimationModes.NON_ZERO_MEDIAN,
+            "non_zero_mean": decimationModes.NON_ZERO_MEAN
+        }[sc.decimationMode]
+
+        self.stereo.initialConfig.set(config)
+
+        if sc.spatial or sc.temporal or sc.decimation > 1:
+            self.stereo.setPostProcessingHardwareResources(3, 3)
+
     def serializePipeline(self, filename: str):
         serialized = self.pipeline.serializeToJson()
 
@@ -286,26 +756,21 @@ class CameraPipeline:
     def startPipeline(self):
 
         self.queues = []
+        self.controlQueue = self.device.getInputQueue(name="control", maxSize=4, blocking=False)
+
+        # Telemetry is read separately from the frame queues, so it doesn't count as a frame
+
+        if cm.mvConfig.telemetryRate > 0:
+            self.telemetryQueue = self.device.getOutputQueue(name="sysinfo", maxSize=1, blocking=False)
         self.lastFrameTime = time.time_ns() / 1.0e9
         self.fps = 0
 
-        if self.NN_FILE is not None:
-            detectionNNQueue = self.device.getOutputQueue(name="detections", maxSize=4, blocking=False) # Get the NN data from the queue
-            self.queues.append((detectionNNQueue, "detectionNN"))
+        # Each model's results come on their own queue
 
-        # For now, RGB needs fixed focus to properly align with depth.
-        # This value was used during calibration
-            # Try to calibrate the camera
-        if self.hasDepth:
-            try:
-                self.calibData = self.device.readCalibration2()
-                lensPosition = self.calibData.getLensPosition(dai.CameraBoardSocket.RGB)
-                if lensPosition:
-                    self.camRgb.initialControl.setManualFocus(lensPosition)
-            except:
-                print("Camera calibration failed!")
-                pass
+        if self.models is not None:
+            self.modelQueues = [(self.device.getOutputQueue(name=model.stream, maxSize=4, blocking=False), model) for model in self.models]
 
+        if self.hasDepth:
             # Output queues will be used to get the rgb frames and nn data from the outputs defined above
             rgbQueue = self.device.getOutputQueue(name="rgb", maxSize=4, blocking=False)
             self.queues.append((rgbQueue, "rgb"))
@@ -317,18 +782,45 @@ class CameraPipeline:
                 previewQueue = self.device.getOutputQueue(name="preview", maxSize=4, blocking=False)
                 self.queues.append((previewQueue, "preview"))
 
-            if self.hasLaser:
-                if not self.device.setIrLaserDotProjectorBrightness(cm.frcConfig.LaserDotProjectorCurrent):
-                    print("Projector Fail")
+            if self.spatialCalc is not None:
+                self.spatialConfigQueue = self.device.getInputQueue(name="spatialCalcConfig", maxSize=1, blocking=False)
+                spatialDataQueue = self.device.getOutputQueue(name="spatialData", maxSize=1, blocking=False)
+                self.queues.append((spatialDataQueue, "spatialData"))
+
+            self.setLaser()
 
         else:
             rgbQueue = self.device.getOutputQueue(name="rgb", maxSize=4, blocking=False)
             self.queues.append((rgbQueue, "rgb"))
 
 
+    # Can be called at any time to apply the current LaserDotProjectorCurrent setting
+
+    def setLaser(self):
+        if self.hasDepth and self.hasLaser:
+            if not self.device.setIrLaserDotProjectorBrightness(cm.frcConfig.LaserDotProjectorCurrent):
+                Log.warning("Projector Fail on %s", self.name)
+
+    def close(self):
+        if self.frameBus is not None:
+            self.frameBus.close()
+            self.frameBus = None
+        self.device.close()
+        self.queues = []
+        self.modelQueues = []
+
     def processNextFrame(self):
         anyChanges = False
         depthChanged = False
+        rgbChanged = False
+
+        if self.telemetryQueue is not None and self.telemetryQueue.has():
+            self.readTelemetry(self.telemetryQueue.get())
+
+        for q, model in self.modelQueues:
+            if q.has():
+                anyChanges = True
+                self.readDetections(model, q.get())
 
         for q, name in self.queues:
             if q.has():
@@ -338,11 +830,15 @@ class CameraPipeline:
                         self.depthFrame = q.get().getFrame()
                         depthChanged = True
                     case "rgb":
-                        self.frame = q.get().getCvFrame()
+                        rgbMsg = q.get()
+                        self.frame = rgbMsg.getCvFrame()
+                        self.frameTimestamp = rgbMsg.getTimestamp().total_seconds()
+                        self.frameSequenceNum = rgbMsg.getSequenceNum()
+                        rgbChanged = True
+                    case "spatialData":
+                        self.readSpatialData(q.get())
                     case "preview":
                         self.previewFrame = q.get().getCvFrame()
-                    case "detectionNN":
-                        self.detections = q.get().detections
         
         if anyChanges:
             now = time.time_ns() / 1.0e9
@@ -352,9 +848,128 @@ class CameraPipeline:
 
 
         if depthChanged:
-            self.depthFrameColor = cv2.normalize(self.depthFrame, None, 255, 0, cv2.NORM_MINMAX, cv2.CV_8UC1)
-            self.depthFrameColor = cv2.equalizeHist(self.depthFrameColor)
-            self.depthFrameColor = cv2.applyColorMap(self.depthFrameColor, cv2.COLORMAP_RAINBOW)
+            self.depthFrameColor = colorizeDepth(self.depthFrame)
+
+            if cm.mvConfig.pointCloud is not None and self.cameraIntrinsics is not None:
+                self.updatePointCloud()
+
+        if rgbChanged and (cm.mvConfig.frameBusSlots > 0 or self.frameBus is not None):
+            self.publishFrame()
+
+        if self.models is not None:
+            self.models.updateStats(time.monotonic())
 
         return anyChanges
+
+    # The device's SystemInformation: chip temperature in C, LeonOS CPU load and memory use in percent
+
+    def readTelemetry(self, info):
+        self.telemetry = DeviceTelemetry(
+            info.chipTemperature.average,
+            100 * info.leonCssCpuUsage.average,
+            100 * info.leonMssCpuUsage.average,
+            _percent(info.ddrMemoryUsage),
+            _percent(info.cmxMemoryUsage),
+            _percent(info.leonCssMemoryUsage),
+            _percent(info.leonMssMemoryUsage))
+        self.telemetryUpdated = True
+
+    # Robot-frame points and occupancy grid from the new depth frame (see PointCloud)
+
+    def updatePointCloud(self):
+        if self.pointCloud is None or self.pointCloud.config != cm.mvConfig.pointCloud:
+            self.pointCloud = PointCloud(cm.mvConfig.pointCloud, self.mount)
+        self.pointCloud.update(self.depthFrame, self.cameraIntrinsics, self.getIspSize()[0] / self.depthFrame.shape[1])
+        self.pointCloudUpdated = True
+
+    # A result from one of the models: hand it to the model, and keep the merged detections of all
+    # of them for the frame bus
+
+    def readDetections(self, model, message):
+        if model.decoder is not None:
+            detections = self.decodeDetections(model, message)
+        else:
+            detections = message.detections
+
+        model.accept(detections, time.monotonic())
+        self.detections = self.currentDetections()
+
+    # Turn a raw NNData message into the same kind of detection list the detection network sends
+
+    def decodeDetections(self, model, nnData):
+        start = time.perf_counter()
+        try:
+            outputs = [model.decoder.shapeOutput(nnData.getLayerFp16(name)) for name in nnData.getAllLayerNames()]
+            detections = model.decoder.decode(outputs)[0]
+        except ValueError as err:
+            # The model's outputs don't match its NN config.  Restarting the camera wouldn't help, so
+            # drop the result and keep the loop running.
+            Log.error("Could not decode %s output on %s: %s", model.name, self.name, err)
+            return []
+
+        if self.hasDepth and self.depthFrame is not None and self.cameraIntrinsics is not None:
+            self.locateDetections(detections, model.inputSize, model.bbfraction)
+
+        model.decodeTime = time.perf_counter() - start
+        return detections
+
+    # What the spatial detection network does on the device: take the median depth over the middle
+    # bbfraction of each box and project it through the camera intrinsics.  Coordinates are in mm,
+    # with y up, like the device's.
+
+    def locateDetections(self, detections, inputSize, bbfraction):
+        (nnWidth, nnHeight) = inputSize
+        (height, width) = self.depthFrame.shape[:2]
+        scale = nnHeight / height           # The preview is a centre crop of the frame, scaled by this
+        k = width / self.getIspSize()[0]    # The intrinsics are for the full-size RGB frame
+        fx = self.cameraIntrinsics[0][0] * k
+        fy = self.cameraIntrinsics[1][1] * k
+        cx0 = self.cameraIntrinsics[0][2] * k
+        cy0 = self.cameraIntrinsics[1][2] * k
+        (minDepth, maxDepth) = self.stereoConfig.depthRange()
+
+        for d in detections:
+            cx = ((d.xmin + d.xmax) / 2 * nnWidth - nnWidth / 2) / scale + width / 2
+            cy = ((d.ymin + d.ymax) / 2 * nnHeight - nnHeight / 2) / scale + height / 2
+            halfW = (d.xmax - d.xmin) * nnWidth / scale * bbfraction / 2
+            halfH = (d.ymax - d.ymin) * nnHeight / scale * bbfraction / 2
+
+            x1 = max(int(cx - halfW), 0)
+            x2 = min(int(cx + halfW) + 1, width)
+            y1 = max(int(cy - halfH), 0)
+            y2 = min(int(cy + halfH) + 1, height)
+
+            roi = self.depthFrame[y1:y2, x1:x2]
+            valid = roi[(roi >= minDepth) & (roi <= maxDepth)]
+            if valid.size == 0:
+                continue
+
+            z = float(np.median(valid))
+            d.spatialCoordinates = SpatialPoint((cx - cx0) * z / fx, -(cy - cy0) * z / fy, z)
+
+    # Put the raw (not yet annotated) frame, the latest depth and the device's detections on this
+    # camera's frame bus for other processes to read
+
+    def publishFrame(self):
+
+        # A changed frameBusSlots replaces (or removes) the bus; readers have to attach again
+
+        if self.frameBus is not None and self.frameBus.nSlots != cm.mvConfig.frameBusSlots:
+            self.frameBus.close()
+            self.frameBus = None
+        if cm.mvConfig.frameBusSlots == 0:
+            return
+
+        if self.frameBus is None:
+            depthShape = self.getDepthSize()[::-1] if self.hasDepth else None
+            self.frameBus = FrameBusWriter(self.name, cm.mvConfig.frameBusSlots, self.frame.shape, depthShape)
+
+        detections = None
+        if self.detections is not None:
+            detections = np.array([(d.label, d.confidence, d.xmin, d.ymin, d.xmax, d.ymax,
+                                    d.spatialCoordinates.x if self.hasDepth else 0.0,
+                                    d.spatialCoordinates.y if self.hasDepth else 0.0,
+                                    d.spatialCoordinates.z if self.hasDepth else 0.0) for d in self.detections], dtype=np.float32)
+
+        self.frameBus.publish(self.frame, self.depthFrame, detections, self.frameTimestamp, self.frameSequenceNum)
     
\ No newline at end of file
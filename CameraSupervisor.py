@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+
+import depthai as dai
+import ConfigManager as cm
+import Log
+from VisionLoop import LINK_ERRORS
+
+
+# The CameraSupervisor keeps the set of running cameras healthy while the main loop runs.
+#
+#   - A camera whose link fails (processNextFrame raises, typically X_LINK_ERROR after a brown-out or
+#     USB reset) or that stops delivering frames for stallTimeout seconds is taken out of the
+#     camera list and rebuilt on a background thread.  The other cameras keep running.
+#   - Every hotplugInterval seconds a background thread looks for OAKs that aren't in use yet and
+#     starts them.
+#   - Both settings are read from cm.mvConfig as they are used, so they follow mv.json reloads.
+#   - Pipelines that must be rebuilt for a config change go through the same path.
+#
+# The camera list is only ever modified on the main thread, in poll(), so the main loop never sees a
+# half-built camera.  Each camera's uptime, number of failures and last recovery time are published
+# to NetworkTables as Uptime-<name>, Failures-<name> and Recovery-<name>.
+
+
+class CameraHealth:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.upSince = time.monotonic()
+        self.downSince = None
+        self.failures = 0
+        self.lastRecovery = None        # Seconds from failure to running again
+
+
+class CameraSupervisor:
+
+    # cameras: the main loop's list of (cam, mxId, detector, tagDetector) tuples
+    # connect: deviceInfo -> tuple, used for cameras that weren't running before
+    # recover: mxId -> tuple, used to rebuild a camera that failed or needs a new pipeline
+
+    def __init__(self, cameras: list, connect, recover, table = None):
+        self.cameras = cameras
+        self.connect = connect
+        self.recover = recover
+        self.table = table
+
+        self.health = {}
+        self.recovering = set()
+        self.lock = threading.Lock()
+        self.started = queue.SimpleQueue()      # Tuples built by background threads, waiting to be added
+        self.lastPublish = 0
+
+        for entry in cameras:
+            self.health[entry[1]] = CameraHealth(entry[0].name)
+
+        threading.Thread(target=self._scan, name="hotplug", daemon=True).start()
+
+    def _known(self) -> set:
+        with self.lock:
+            return set(self.health.keys())
+
+    # Called by the main loop when a camera raises while processing a frame
+
+    def failed(self, entry, err):
+        Log.error("Camera %s failed: %s", entry[0].name, err)
+        self._remove(entry)
+        self._startRecovery(entry, failure=True)
+
+    # Rebuild a healthy camera, e.g. because its configuration changed
+
+    def restart(self, entry, reason: str):
+        Log.info("Restarting %s: %s", entry[0].name, reason)
+        self._remove(entry)
+        self._startRecovery(entry, failure=False)
+
+    def _remove(self, entry):
+        if entry in self.cameras:
+            self.cameras.remove(entry)
+
+    def _startRecovery(self, entry, failure: bool):
+        (cam, mxId, detector, tagDetector) = entry
+
+        with self.lock:
+            if mxId in self.recovering:
+                return
+            self.recovering.add(mxId)
+            health = self.health.setdefault(mxId, CameraHealth(cam.name))
+            health.downSince = time.monotonic()
+            if failure:
+                health.failures += 1
+
+        threading.Thread(target=self._recover, args=(cam, mxId), name="recover-" + cam.name, daemon=True).start()
+
+    def _recover(self, cam, mxId):
+        try:
+            cam.close()
+        except Exception:
+            pass            # The link is probably already gone
+
+        delay = 0.5
+        while True:
+            try:
+                self.started.put(self.recover(mxId))
+                return
+            except Exception as err:
+                Log.warning("Could not restart %s yet: %s", cam.name, err)
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def _scan(self):
+        while True:
+            time.sleep(cm.mvConfig.hotplugInterval or 1.0)
+            if cm.mvConfig.hotplugInterval == 0:
+                continue                # Off, but it may be turned on again
+            try:
+                deviceInfos = dai.Device.getAllAvailableDevices()
+            except LINK_ERRORS:
+                continue
+
+            for deviceInfo in deviceInfos:
+                if deviceInfo.getMxId() in self._known():
+                    continue
+
+                Log.info("New camera %s attached", deviceInfo.getMxId())
+                try:
+                    self.started.put(self.connect(deviceInfo))
+                except Exception as err:
+                    Log.error("Could not start new camera %s: %s", deviceInfo.getMxId(), err)
+
+    # Called once per pass of the main loop: adds cameras that finished starting, checks for stalls
+    # and publishes the health numbers
+
+    def poll(self):
+        now = time.monotonic()
+
+        while not self.started.empty():
+            entry = self.started.get()
+            (cam, mxId, detector, tagDetector) = entry
+
+            with self.lock:
+                self.recovering.discard(mxId)
+                health = self.health.setdefault(mxId, CameraHealth(cam.name))
+
+            health.name = cam.name
+            if health.downSince is not None:
+                health.lastRecovery = now - health.downSince
+                Log.info("Camera %s running again after %.1f s", cam.name, health.lastRecovery)
+            health.downSince = None
+            health.upSince = now
+            self.cameras.append(entry)
+
+        stallTimeout = cm.mvConfig.stallTimeout
+        if stallTimeout > 0:
+            wallNow = time.time_ns() / 1.0e9
+            for entry in list(self.cameras):
+                if wallNow - entry[0].lastFrameTime > stallTimeout:
+                    self.failed(entry, f"no frames for {stallTimeout} s")
+
+        if self.table is not None and now - self.lastPublish >= 1.0:
+            self.lastPublish = now
+            self.publish(now)
+
+    def uptime(self, mxId: str, now: float = None) -> float:
+        health = self.health[mxId]
+        if health.downSince is not None:
+            return 0.0
+        return (now or time.monotonic()) - health.upSince
+
+    def publish(self, now: float):
+        with self.lock:
+            items = list(self.health.items())
+
+        for mxId, health in items:
+            self.table.putNumber("Uptime-" + health.name, round(self.uptime(mxId, now), 1))
+            self.table.putNumber("Failures-" + health.name, health.failures)
+            if health.lastRecovery is not None:
+                self.table.putNumber("Recovery-" + health.name, round(health.lastRecovery, 2))
@@ -1,5 +1,5 @@
 import json
-import sys
+from dataclasses import dataclass, field, fields, MISSING
 
 ROMI_FILE = "/boot/romi.json"   # used when running on a Romi robot
 FRC_FILE = "/boot/frc.json"     # Some camera settings incuding laser power
@@ -7,164 +7,364 @@ NN_FILE = "/boot/nn.json"       # NN config file
 MV_FILE = "/boot/mv.json"       # MonsterVision Configuration file
 
 
-
-
-
-# The purpase a ComputedValue object is to allow the value to be set in the ConfigManager class
-# and then read in the derived class.  This is a way to get around the fact that Python does not
-# have pointers.  The value in the ComputedValue object is set in the ConfigManager class and then
-# read in the derived class. 
-
-
-class ComputedValue:
-    def __init__(self, value):
-        self.value = value
-
-# ConfigManager is a class that reads a JSON file and sets the values of a set of variables
-
-# __init__ takes a file name and a list of dictionaries.
+# Each config file is described by a slotted dataclass.  The field's type and default say what the
+# JSON may contain; field metadata can add:
 #
-# Each dictionary has three keys:
-#   name: the name of the variable to set
-#   value: a ComputedValue object that will be set to the value in the JSON file
-#   mess: a ComputedValue object that will be set to a message if the value is not found in the JSON file
+#   key     the name used in the JSON file, if it differs from the attribute name
+#   mess    the error message to use when a required value is missing
+#   parse   a function (value, file, key) -> value for anything that isn't a plain scalar
+#
+# Values are checked against the declared type when a file is loaded, so a typo in /boot/mv.json
+# shows up as a ConfigError at startup (or is rejected by the ConfigWatcher) rather than as a
+# crash somewhere in the vision loop.  Unknown keys are ignored.
 
 
+class ConfigError(Exception):
+    pass
 
 
-class ConfigManager:
+def _readJSON(file: str, drillDown: str = None) -> dict:
+    try:
+        with open(file, "rt", encoding="utf-8") as f:
+            j = json.load(f)
+    except OSError as err:
+        raise ConfigError("could not open '{}': {}".format(file, err))
+    except ValueError as err:
+        raise ConfigError("could not parse '{}': {}".format(file, err))
 
-    def __init__(self, file: str, configTable, drillDown : str = None):
-        self.file = file
-        self.success = False
+    # top level must be an object
+    if not isinstance(j, dict):
+        raise ConfigError(f"'{file}' must be JSON object")
 
-        try:
-            with open(self.file, "rt", encoding="utf-8") as f:
-                j = json.load(f)
-        except OSError as err:
-            raise Exception("could not open '{}': {}".format(self.file, err))
-        
-        # top level must be an object
+    if drillDown is not None:
+        j = j.get(drillDown)
         if not isinstance(j, dict):
-            raise Exception("must be JSON object")
-
-        if drillDown is not None:
-            j = j[drillDown]
-        
-        for entry in configTable:
-       
-            try:
-                entry['value'].value = j[entry['name']]
-            except:
-                if entry['mess'] is not None:
-                    raise Exception("config error in '" + self.file + "': " + entry['mess'].value)
-                pass
-
-        self.success = True
-
-
-# Derive a new class from ConfigManager
-
-
-class FRCConfig (ConfigManager):
-
-    __team = ComputedValue(0)
-    __hasDisplay = ComputedValue(False)
-    __ntmode = ComputedValue("client")
-    __LaserDotProjectorCurrent = ComputedValue(0)
-
-    __table = [
-        { "name" : "team", "value" : __team, "mess" : "Could not read team number"},
-        { "name" : "hasDisplay", "value" : __hasDisplay, "mess" : None},
-        { "name" : "ntmode", "value" : __ntmode, "mess" : None},
-        { "name" : "LaserDotProjectorCurrent", "value" : __LaserDotProjectorCurrent, "mess" : None}
-    ]
-
-    def __init__(self, file: str):
-        super().__init__( file, self.__table)
-
-        if self.success:
-            if self.__ntmode.value == "client":
-                self.server = False
-            elif self.__ntmode.value == "server":
-                self.server = True
-            else:
-                success = False
-                raise Exception(f"could not understand ntmode value '{self.__ntmode.value}'")
-            self.team = self.__team.value
-            self.hasDisplay = self.__hasDisplay.value
-            self.LaserDotProjectorCurrent = self.__LaserDotProjectorCurrent.value * 1.0
-
-            
-
-class NNConfig(ConfigManager):
-
-    __bb_fraction = ComputedValue("bb_fraction")
-    __inputSize = ComputedValue((300, 300))
-    __NNFamily = ComputedValue("")
-
-    __table = [
-        { "name" : "bb_fraction", "value" : __bb_fraction, "mess" : None},
-        { "name" : "input_size", "value" : __inputSize, "mess" : None},
-        { "name" : "NN_family", "value" : __NNFamily, "mess" : None}
-    ]
-
-    def __init__(self, file: str):
-        super().__init__( file, self.__table, "nn_config")
-
-        if self.success:
-            self.bb_fraction = self.__bb_fraction.value
-            self.inputSize = tuple(map(int, self.__inputSize.value.split('x')))
-            self.NNFamily = self.__NNFamily.value
-
-    
-
-class MVConfig(ConfigManager):
-
-    __tagFamily = ComputedValue("tag36h11")
-    __tagSize = ComputedValue(0.1651)
-    __CAMERA_FPS = ComputedValue(25)
-    __DS_SUBSAMPLING = ComputedValue(4)
-    __PREVIEW_WIDTH = ComputedValue(200)
-    __PREVIEW_HEIGHT = ComputedValue(200)
-    __DS_SCALE = ComputedValue(0.5)
-    __cameras = ComputedValue([])
-    __showPreview = ComputedValue(False)
-
-
-    __table = [
-        { "name" : "cameras", "value" : __cameras, "mess" : None},
-        { "name" : "tagFamily", "value" : __tagFamily, "mess" : None},
-        { "name" : "tagSize", "value" : __tagSize, "mess" : None},
-        { "name" : "CAMERA_FPS", "value" : __CAMERA_FPS, "mess" : None},
-        { "name" : "DS_SUBSAMPLING", "value" : __DS_SUBSAMPLING, "mess" : None},
-        { "name" : "PREVIEW_WIDTH", "value" : __PREVIEW_WIDTH, "mess" : None},
-        { "name" : "PREVIEW_HEIGHT", "value" : __PREVIEW_HEIGHT, "mess" : None},
-        { "name" : "DS_SCALE", "value" : __DS_SCALE, "mess" : None},
-        { "name" : "showPreview", "value" : __showPreview, "mess" : None}
-    ]
-
-    def __init__(self, file: str):
-        super().__init__( file, self.__table)
-
-        if self.success:
-            self.cameras = self.__cameras.value
-            self.tagFamily = self.__tagFamily.value
-            self.tagSize = self.__tagSize.value
-            self.CAMERA_FPS = self.__CAMERA_FPS.value
-            self.DS_SUBSAMPLING = self.__DS_SUBSAMPLING.value
-            self.PREVIEW_WIDTH = self.__PREVIEW_WIDTH.value
-            self.PREVIEW_HEIGHT = self.__PREVIEW_HEIGHT.value
-            self.DS_SCALE = self.__DS_SCALE.value
-            self.showPreview = self.__showPreview.value
-
-    def getCamera(self, mxid) -> dict:
+            raise ConfigError(f"'{file}' must contain a '{drillDown}' object")
+
+    return j
+
+
+def _convert(value, kind, file: str, key: str):
+    if kind is bool and isinstance(value, (bool, int)):
+        return bool(value)
+    if kind is int and isinstance(value, (int, float)) and not isinstance(value, bool) and int(value) == value:
+        return int(value)
+    if kind is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if kind is str and isinstance(value, str):
+        return value
+    raise ConfigError(f"config error in '{file}': '{key}' must be {kind.__name__}, not {value!r}")
+
+
+def _build(cls, j: dict, file: str):
+    values = {}
+    for f in fields(cls):
+        key = f.metadata.get("key", f.name)
+        if key not in j:
+            if f.default is MISSING and f.default_factory is MISSING:
+                raise ConfigError(f"config error in '{file}': " + f.metadata.get("mess", f"'{key}' is required"))
+            continue
+
+        value = j[key]
+        if "parse" in f.metadata:
+            values[f.name] = f.metadata["parse"](value, file, key)
+        elif value is None and f.default is None:
+            values[f.name] = None
+        else:
+            values[f.name] = _convert(value, f.type, file, key)
+
+    try:
+        return cls(**values)
+    except ValueError as err:
+        raise ConfigError(f"config error in '{file}': {err}")
+
+
+@dataclass(slots=True)
+class FRCConfig:
+    team: int = field(metadata={"mess": "Could not read team number"})
+    hasDisplay: bool = False
+    ntmode: str = "client"
+    LaserDotProjectorCurrent: float = 0.0
+
+    def __post_init__(self):
+        if self.ntmode not in ("client", "server"):
+            raise ValueError(f"could not understand ntmode value '{self.ntmode}'")
+
+    @property
+    def server(self) -> bool:
+        return self.ntmode == "server"
+
+    @classmethod
+    def load(cls, file: str) -> "FRCConfig":
+        return _build(cls, _readJSON(file), file)
+
+
+def _parseInputSize(value, file: str, key: str):
+    try:
+        return tuple(map(int, value.split('x')))
+    except (AttributeError, ValueError):
+        raise ConfigError(f"config error in '{file}': '{key}' must look like '640x640', not {value!r}")
+
+
+@dataclass(slots=True)
+class NNConfig:
+    bb_fraction: float = 0.2
+    inputSize: tuple = field(default=(300, 300), metadata={"key": "input_size", "parse": _parseInputSize})
+    NNFamily: str = field(default="", metadata={"key": "NN_family"})
+
+    @classmethod
+    def load(cls, file: str) -> "NNConfig":
+        return _build(cls, _readJSON(file, "nn_config"), file)
+
+
+# On-device stereo post-processing for one camera (the "stereo" object in a camera's entry)
+
+@dataclass(slots=True)
+class StereoConfig:
+    decimation: int = 1             # 1 (off), 2, 3 or 4: depth is sent at 1/decimation the size
+    decimationMode: str = "non_zero_median"
+    median: int = 7                 # 0 (off), 3, 5 or 7
+    spatial: bool = False
+    spatialAlpha: float = 0.5
+    spatialDelta: int = 0
+    holeFillingRadius: int = 2
+    temporal: bool = False
+    temporalAlpha: float = 0.4
+    minDepth: int = None            # mm; if either is set, depth outside minDepth..maxDepth is zeroed
+    maxDepth: int = None
+
+    def __post_init__(self):
+        if self.decimation not in (1, 2, 3, 4):
+            raise ValueError("'decimation' must be 1, 2, 3 or 4")
+        if self.decimationMode not in ("pixel_skipping", "non_zero_median", "non_zero_mean"):
+            raise ValueError(f"could not understand decimationMode value '{self.decimationMode}'")
+        if self.median not in (0, 3, 5, 7):
+            raise ValueError("'median' must be 0, 3, 5 or 7")
+        if not 0 <= self.spatialAlpha <= 1 or not 0 <= self.temporalAlpha <= 1:
+            raise ValueError("'spatialAlpha' and 'temporalAlpha' must be between 0 and 1")
+        (minDepth, maxDepth) = self.depthRange()
+        if not 0 <= minDepth < maxDepth:
+            raise ValueError("'minDepth' must be 0 or more and less than 'maxDepth'")
+
+    def hasDepthRange(self) -> bool:
+        return self.minDepth is not None or self.maxDepth is not None
+
+    # The configured range (an unset end is open), or 100..5000 mm if there isn't one.  Depth is
+    # only filtered on the device with a configured range, but distances are always measured over this.
+
+    def depthRange(self) -> tuple:
+        if not self.hasDepthRange():
+            return (100, 5000)
+        return (self.minDepth if self.minDepth is not None else 0, self.maxDepth if self.maxDepth is not None else 65535)
+
+
+def _parseStereo(value, file: str, key: str):
+    if not isinstance(value, dict):
+        raise ConfigError(f"config error in '{file}': '{key}' must be an object")
+    return _build(StereoConfig, value, file)
+
+
+# Where a camera is on the robot, for turning its depth into robot coordinates.  Meters from the
+# robot's origin (x forward, y left, z up) and degrees (yaw left, pitch down, roll right side down).
+
+@dataclass(slots=True)
+class MountConfig:
+    x: float = 0.0
+    y: float = 0.0
+    z: float = 0.0
+    yaw: float = 0.0
+    pitch: float = 0.0
+    roll: float = 0.0
+
+
+def _parseMount(value, file: str, key: str):
+    if not isinstance(value, dict):
+        raise ConfigError(f"config error in '{file}': '{key}' must be an object")
+    return _build(MountConfig, value, file)
+
+
+def _parseProfiles(value, file: str, key: str):
+    from Profiles import PROFILES          # Profiles logs, and Log reads this module's config
+
+    if not isinstance(value, list) or not all(isinstance(profile, str) for profile in value):
+        raise ConfigError(f"config error in '{file}': '{key}' must be a list of profile names")
+    for profile in value:
+        if profile not in PROFILES:
+            raise ConfigError(f"config error in '{file}': unknown profile '{profile}' in '{key}' (must be one of {', '.join(PROFILES)})")
+    return value
+
+
+# One of the NN models a camera time-slices between (an entry of "models" in a camera's mv.json
+# entry; a plain string is just the file)
+
+@dataclass(slots=True)
+class ModelConfig:
+    file: str
+    priority: int = 1               # Frames it gets, relative to the others, under the "priority" schedule
+    profiles: list = field(default_factory=list, metadata={"parse": _parseProfiles})
+
+    def __post_init__(self):
+        if self.priority < 1:
+            raise ValueError("a model's 'priority' must be 1 or more")
+
+
+def _parseModels(value, file: str, key: str):
+    if not isinstance(value, list):
+        raise ConfigError(f"config error in '{file}': '{key}' must be a list")
+    models = []
+    for model in value:
+        if isinstance(model, str):
+            models.append(ModelConfig(model))
+        elif isinstance(model, dict):
+            models.append(_build(ModelConfig, model, file))
+        else:
+            raise ConfigError(f"config error in '{file}': each of '{key}' must be a file name or an object")
+    return models
+
+
+NN_SCHEDULES = ("round-robin", "priority")
+
+
+@dataclass(slots=True)
+class CameraConfig:
+    mxid: str
+    name: str = ""
+    invert: bool = False
+    useDepth: bool = True
+    nnFile: str = None
+    dumpPipeline: bool = False
+    nnEvery: int = 1                # Run the NN on every Nth frame; 0: only when triggered
+    stereo: StereoConfig = field(default_factory=StereoConfig, metadata={"parse": _parseStereo})
+    mount: MountConfig = field(default_factory=MountConfig, metadata={"parse": _parseMount})
+    models: list = field(default_factory=list, metadata={"parse": _parseModels})
+    nnSchedule: str = "round-robin"
+
+
+    def __post_init__(self):
+        if self.nnEvery < 0:
+            raise ValueError("'nnEvery' must be 0 (only when triggered) or more")
+        if self.nnSchedule not in NN_SCHEDULES:
+            raise ValueError(f"could not understand nnSchedule value '{self.nnSchedule}'")
+        if self.models and self.nnFile is not None:
+            raise ValueError("give either 'nnFile' or 'models', not both")
+
+    # The models this camera runs: its "models", or just its nnFile
+
+    def nnModels(self) -> list:
+        if self.models:
+            return self.models
+        return [ModelConfig(self.nnFile)] if self.nnFile is not None else []
+
+
+# The point cloud / occupancy grid stage (the "pointCloud" object in mv.json).  The grid covers
+# range meters ahead of the robot and width meters across; points between minHeight and maxHeight
+# above the floor count as obstacles.
+
+@dataclass(slots=True)
+class PointCloudConfig:
+    step: int = 4                   # Use every step'th depth pixel in each direction
+    cellSize: float = 0.05
+    range: float = 4.0
+    width: float = 4.0
+    minHeight: float = 0.05
+    maxHeight: float = 0.6
+    minPoints: int = 3              # Points needed in a cell to call it occupied
+
+    def __post_init__(self):
+        if self.step < 1:
+            raise ValueError("'step' must be 1 or more")
+        if self.cellSize <= 0 or self.range <= 0 or self.width <= 0:
+            raise ValueError("'cellSize', 'range' and 'width' must be positive")
+        if self.minHeight >= self.maxHeight:
+            raise ValueError("'minHeight' must be less than 'maxHeight'")
+
+
+def _parsePointCloud(value, file: str, key: str):
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ConfigError(f"config error in '{file}': '{key}' must be an object")
+    return _build(PointCloudConfig, value, file)
+
+
+def _parseCameras(value, file: str, key: str):
+    if not isinstance(value, list) or not all(isinstance(cam, dict) for cam in value):
+        raise ConfigError(f"config error in '{file}': '{key}' must be a list of objects")
+    return [_build(CameraConfig, cam, file) for cam in value]
+
+
+@dataclass(slots=True)
+class MVConfig:
+    cameras: list = field(default_factory=list, metadata={"parse": _parseCameras})
+    tagFamily: str = "tag36h11"
+    tagSize: float = 0.1651
+    CAMERA_FPS: int = 25
+    DS_SUBSAMPLING: int = 4
+    PREVIEW_WIDTH: int = 200
+    PREVIEW_HEIGHT: int = 200
+    DS_SCALE: float = 0.5
+    showPreview: bool = False
+    cacheDir: str = "~/.cache/MonsterVision"
+    stallTimeout: float = 3.0
+    hotplugInterval: float = 5.0
+    tagWorkers: int = 0
+    frameBusSlots: int = 0
+    tagStereoDepth: bool = False
+    publishJSON: bool = True
+    telemetryRate: float = 1.0
+    profileSeconds: float = 10.0
+    logRate: float = 10.0           # Times a second the same message may be logged; 0: no limit
+    logMaxKB: int = 1024            # Log file size before it is rotated; 0: no log file
+    logBackups: int = 3
+    logDumpSeconds: float = 30.0
+    pointCloud: PointCloudConfig = field(default=None, metadata={"parse": _parsePointCloud})
+
+    def __post_init__(self):
+        if self.tagSize <= 0:
+            raise ValueError("'tagSize' must be positive")
+        if self.CAMERA_FPS <= 0:
+            raise ValueError("'CAMERA_FPS' must be positive")
+        if self.DS_SUBSAMPLING < 0:
+            raise ValueError("'DS_SUBSAMPLING' must be 0 (no DS stream) or more")
+        if self.DS_SCALE <= 0:
+            raise ValueError("'DS_SCALE' must be positive")
+        if self.stallTimeout < 0 or self.hotplugInterval < 0:
+            raise ValueError("'stallTimeout' and 'hotplugInterval' must be 0 (off) or more")
+        if self.tagWorkers < 0:
+            raise ValueError("'tagWorkers' must be 0 (detect in the main process) or more")
+        if self.profileSeconds <= 0:
+            raise ValueError("'profileSeconds' must be positive")
+        if self.telemetryRate < 0:
+            raise ValueError("'telemetryRate' must be 0 (off) or more")
+        if self.frameBusSlots < 0:
+            raise ValueError("'frameBusSlots' must be 0 (no frame bus) or more")
+        if self.logRate < 0 or self.logMaxKB < 0 or self.logBackups < 0 or self.logDumpSeconds < 0:
+            raise ValueError("'logRate', 'logMaxKB', 'logBackups' and 'logDumpSeconds' must be 0 or more")
+
+    @classmethod
+    def load(cls, file: str) -> "MVConfig":
+        return _build(cls, _readJSON(file), file)
+
+    def getCamera(self, mxid) -> CameraConfig:
         for cam in self.cameras:
-            if cam['mxid'] == mxid:
+            if cam.mxid == mxid:
                 return cam
         return None
-    
 
-frcConfig = FRCConfig(FRC_FILE)
-mvConfig = MVConfig(MV_FILE)
-nnConfig = NNConfig(NN_FILE)
+
+# frcConfig, mvConfig and nnConfig are loaded the first time they are used rather than at import
+# time, and only once.  The ConfigWatcher replaces them when a file changes.
+
+_loaders = {
+    "frcConfig": lambda: FRCConfig.load(FRC_FILE),
+    "mvConfig": lambda: MVConfig.load(MV_FILE),
+    "nnConfig": lambda: NNConfig.load(NN_FILE)
+}
+
+
+def __getattr__(name):
+    if name in _loaders:
+        value = _loaders[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
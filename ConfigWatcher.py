@@ -0,0 +1,218 @@
+import json
+import os
+import time
+
+import ConfigManager as cm
+import Log
+
+
+# ConfigWatcher lets us tune MonsterVision in the pits without restarting the process.
+#
+# poll() is called from the main loop.  At most once per interval it stats the /boot config files
+# (and every NN file referenced by mv.json); if any of them changed, the files are reloaded and
+# validated.  A file that fails to load or validate is reported and ignored, and the running
+# configuration stays in place.
+#
+# Valid changes replace the module globals in ConfigManager, so everything that reads
+# cm.mvConfig.X at use time (DS scaling/subsampling, etc.) picks them up immediately.  Changes that
+# need more than that are described by the returned ConfigChanges:
+#
+#   retag           tagFamily/tagSize changed; the AprilTag detectors must be rebuilt (host only)
+#   laser           LaserDotProjectorCurrent changed; applied to the device with a control call
+#   thresholds      {nnFile: confidence} for NN files where only the confidence threshold changed;
+#                   applied host-side by the cameras using them (see Models).  A camera whose
+#                   detection network was built with a higher threshold is restarted instead.
+#   restart         MXIDs whose pipeline has to be rebuilt because something on the device changed
+#   restartAll      a global device setting (e.g. CAMERA_FPS) changed; every pipeline is rebuilt
+
+# mv.json settings that are baked into every camera's pipeline
+
+DEVICE_SETTINGS = ("CAMERA_FPS", "showPreview", "tagStereoDepth", "telemetryRate")
+
+# mv.json settings that are only read when MonsterVision starts (the tag workers are forked first
+# thing, and the log file is opened once)
+
+RESTART_SETTINGS = ("tagWorkers", "cacheDir", "logMaxKB", "logBackups", "logDumpSeconds")
+
+# NN settings that the host can apply without touching the device
+
+HOST_NN_SETTINGS = ("confidence_threshold",)
+
+
+class ConfigChanges:
+
+    def __init__(self):
+        self.retag = False
+        self.laser = False
+        self.thresholds = {}
+        self.restart = set()
+        self.restartAll = False
+
+    def any(self) -> bool:
+        return self.retag or self.laser or len(self.thresholds) > 0 or len(self.restart) > 0 or self.restartAll
+
+
+def _readNN(file: str) -> dict:
+    with open(file, "rt", encoding="utf-8") as f:
+        j = json.load(f)
+    if not isinstance(j, dict) or 'nn_config' not in j:
+        raise Exception(f"'{file}' is not an NN config file")
+    cm.NNConfig.load(file)  # Same validation as at startup
+    return j
+
+
+# Strip out the settings the host can change on its own, so what's left can be compared to decide
+# whether the device needs a new pipeline
+
+def _deviceView(nnJSON: dict) -> dict:
+    view = json.loads(json.dumps(nnJSON))
+    for key in HOST_NN_SETTINGS:
+        view['nn_config'].pop(key, None)
+        view['nn_config'].get('NN_specific_metadata', {}).pop(key, None)
+    return view
+
+
+def _confidence(nnJSON: dict):
+    nnConfig = nnJSON['nn_config']
+    if 'confidence_threshold' in nnConfig:
+        return nnConfig['confidence_threshold']
+    return nnConfig.get('NN_specific_metadata', {}).get('confidence_threshold')
+
+
+class ConfigWatcher:
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.lastPoll = time.monotonic()
+        self.nnFiles = {}
+        for file in self._nnFileNames():
+            try:
+                self.nnFiles[file] = _readNN(file)
+            except Exception:
+                pass
+        self.stamps = {file: self._stamp(file) for file in self._watchedFiles()}
+
+    def _nnFileNames(self):
+        files = {cm.NN_FILE}
+        for cam in cm.mvConfig.cameras:
+            for model in cam.nnModels():
+                files.add(model.file)
+        return files
+
+    def _watchedFiles(self):
+        return {cm.MV_FILE, cm.FRC_FILE} | self._nnFileNames()
+
+    def _stamp(self, file: str):
+        try:
+            st = os.stat(file)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    # Returns a ConfigChanges if something changed and validated, otherwise None
+
+    def poll(self) -> ConfigChanges:
+        now = time.monotonic()
+        if now - self.lastPoll < self.interval:
+            return None
+        self.lastPoll = now
+
+        changed = set()
+        for file in self._watchedFiles():
+            stamp = self._stamp(file)
+            if stamp != self.stamps.get(file):
+                self.stamps[file] = stamp
+                changed.add(file)
+
+        if len(changed) == 0:
+            return None
+
+        changes = ConfigChanges()
+
+        if cm.FRC_FILE in changed:
+            self._reloadFRC(changes)
+        if cm.MV_FILE in changed:
+            self._reloadMV(changes)
+
+        for file in changed & self._nnFileNames():
+            self._reloadNN(file, changes)
+
+        if not changes.any():
+            return None
+        return changes
+
+    def _reloadFRC(self, changes: ConfigChanges):
+        try:
+            new = cm.FRCConfig.load(cm.FRC_FILE)
+        except Exception as err:
+            Log.warning("Ignoring changed %s: %s", cm.FRC_FILE, err)
+            return
+
+        old = cm.frcConfig
+        if new.team != old.team or new.server != old.server:
+            Log.warning("Team number and ntmode changes in %s need a restart of MonsterVision", cm.FRC_FILE)
+        if new.hasDisplay != old.hasDisplay:
+            changes.restartAll = True
+        if new.LaserDotProjectorCurrent != old.LaserDotProjectorCurrent:
+            changes.laser = True
+
+        cm.frcConfig = new
+        Log.info("Reloaded %s", cm.FRC_FILE)
+
+    def _reloadMV(self, changes: ConfigChanges):
+        try:
+            new = cm.MVConfig.load(cm.MV_FILE)
+        except Exception as err:
+            Log.warning("Ignoring changed %s: %s", cm.MV_FILE, err)
+            return
+
+        old = cm.mvConfig
+
+        if new.tagFamily != old.tagFamily or new.tagSize != old.tagSize:
+            changes.retag = True
+
+        for setting in DEVICE_SETTINGS:
+            if getattr(new, setting) != getattr(old, setting):
+                changes.restartAll = True
+
+        for setting in RESTART_SETTINGS:
+            if getattr(new, setting) != getattr(old, setting):
+                Log.warning("%s changes in %s need a restart of MonsterVision", setting, cm.MV_FILE)
+
+        # Any change to a camera's own entry (name, invert, depth, NN file, ...) restarts that camera only
+
+        for cam in new.cameras + old.cameras:
+            if new.getCamera(cam.mxid) != old.getCamera(cam.mxid):
+                changes.restart.add(cam.mxid)
+
+        cm.mvConfig = new
+        Log.info("Reloaded %s", cm.MV_FILE)
+
+        # Start watching any NN files that were just added
+
+        for file in self._nnFileNames():
+            if file not in self.stamps:
+                self.stamps[file] = self._stamp(file)
+
+    def _reloadNN(self, file: str, changes: ConfigChanges):
+        try:
+            new = _readNN(file)
+        except Exception as err:
+            Log.warning("Ignoring changed %s: %s", file, err)
+            return
+
+        old = self.nnFiles.get(file)
+        self.nnFiles[file] = new
+
+        if file == cm.NN_FILE:
+            cm.nnConfig = cm.NNConfig.load(file)
+
+        if old is not None and _deviceView(old) == _deviceView(new):
+            if _confidence(old) != _confidence(new):
+                changes.thresholds[file] = _confidence(new)
+        else:
+            for cam in cm.mvConfig.cameras:
+                if any(model.file == file for model in cam.nnModels()):
+                    changes.restart.add(cam.mxid)
+
+        Log.info("Reloaded %s", file)
@@ -1,6 +1,6 @@
 import cv2
 import depthai as dai
-import ConfigManager as cm
+from Results import ResultBatch
 
 
 def _average_depth_coord(pt1, pt2, padding_factor):
@@ -11,8 +11,10 @@ def _average_depth_coord(pt1, pt2, padding_factor):
     av_pt2 = int(pt2[0] - x_shift), int(pt2[1] - y_shift)
     return av_pt1, av_pt2
 
+# inputSize is the NN's (width, height); the preview it sees is a centre crop of the frame
+
 def mapDetectionCoordinatesToFrame(roi : dai.Rect, inputSize, shape):
-    (height, width) = inputSize
+    (width, height) = inputSize
     (Height, Width, _depth) = shape
 
     scale = height / Height
@@ -32,25 +34,23 @@ INCHES_PER_MILLIMETER = 0.0393701
 
 class Detections:
 
-    def __init__(self, bbfraction, LABELS):
+    def __init__(self, bbfraction, LABELS, inputSize):
         self.bbfraction = bbfraction
         self.LABELS = LABELS
+        self.inputSize = inputSize          # The camera's NN input size, (width, height)
 
 
-    def ProcessOak1Detections(self, detections, frame):
+    def ProcessOak1Detections(self, detections, frame, results):
         height = frame.shape[0]
         width = frame.shape[1]
 
-        # re-initializes objects to zero/empty before each frame is read
-        objects = []
-
         for detection in detections:
             # Get the detection bounding box (in % coordinates), and denormalize it to the NN frame coordinates.
             detectionBB = dai.Rect(dai.Point2f(detection.xmin, detection.ymin), dai.Point2f(detection.xmax, detection.ymax))
-            roiDenorm = detectionBB.denormalize(cm.nnConfig.inputSize[0], cm.nnConfig.inputSize[1])
+            roiDenorm = detectionBB.denormalize(self.inputSize[0], self.inputSize[1])
             
             # Now map the denormalized bounding box to the full frame coordinates
-            roiMapped = mapDetectionCoordinatesToFrame(roiDenorm, cm.nnConfig.inputSize, frame.shape)
+            roiMapped = mapDetectionCoordinatesToFrame(roiDenorm, self.inputSize, frame.shape)
             topLeft = roiMapped.topLeft()
             bottomRight = roiMapped.bottomRight()
             xmin = int(topLeft.x)
@@ -96,28 +96,28 @@ class Detections:
 
             # cv2.rectangle(self.frame, (x1, y1), (x2, y2), color, cv2.FONT_HERSHEY_SIMPLEX)
 
-            objects.append({"objectLabel": self.LABELS[detection.label], "x": cX,
-                            "y": cY, "z": R,
-                            "confidence": round(detection.confidence, 2)})
+            results.addDetection(detection.label, detection.confidence, cX, cY, R)
 
-        return objects                
+        return results
 
 
-    def processDetections(self, detections, frame, depthFrameColor):
+    # Draws the detections on frame and adds them to results (a new ResultBatch if None), which is
+    # returned
+
+    def processDetections(self, detections, frame, depthFrameColor, results = None):
+        if results is None:
+            results = ResultBatch(self.LABELS)
 
         if frame is None:
-            return
+            return results
         
         # If no depth info, must be an OAK-1
         if depthFrameColor is None:
-            return self.ProcessOak1Detections(detections, frame)
+            return self.ProcessOak1Detections(detections, frame, results)
         
         # If the frame is available, draw bounding boxes on it and show the frame
         height = frame.shape[0]
         width = frame.shape[1]
-
-        # re-initializes objects to zero/empty before each frame is read
-        objects = []
         s_detections = sorted(detections, key=lambda det: det.label * 100000 + det.spatialCoordinates.z)
         # print(s_detections)
 
@@ -129,10 +129,10 @@ class Detections:
 
 # Get the detection bounding box (in % coordinates), and denormalize it to the NN frame coordinates.
             detectionBB = dai.Rect(dai.Point2f(detection.xmin, detection.ymin), dai.Point2f(detection.xmax, detection.ymax))
-            roiDenorm = detectionBB.denormalize(cm.nnConfig.inputSize[0], cm.nnConfig.inputSize[1])
+            roiDenorm = detectionBB.denormalize(self.inputSize[0], self.inputSize[1])
             
             # Now map the denormalized bounding box to the full frame coordinates
-            roiMapped = mapDetectionCoordinatesToFrame(roiDenorm, cm.nnConfig.inputSize, frame.shape)
+            roiMapped = mapDetectionCoordinatesToFrame(roiDenorm, self.inputSize, frame.shape)
             topLeft = roiMapped.topLeft()
             bottomRight = roiMapped.bottomRight()
             xmin = int(topLeft.x)
@@ -177,8 +177,6 @@ class Detections:
 
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), cv2.FONT_HERSHEY_SIMPLEX)
 
-            objects.append({"objectLabel": self.LABELS[detection.label], "x": x,
-                            "y": y, "z": z,
-                            "confidence": round(detection.confidence, 2)})
+            results.addDetection(detection.label, detection.confidence, x, y, z)
 
-        return objects            
\ No newline at end of file
+        return results            
\ No newline at end of file
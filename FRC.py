@@ -1,9 +1,9 @@
 # Import libraries
 import json
-import sys
 import time
 
 import ConfigManager as cm
+import Log
 
 
 usingNTCore = False
@@ -19,12 +19,6 @@ except ImportError:
 import cv2
 import platform
 
-cscoreAvailable = True
-try:
-    from cscore import CameraServer # type: ignore
-except ImportError:
-    cscoreAvailable = False
-
 
 
 class FRC:
@@ -53,10 +47,10 @@ class FRC:
 
         # Sets up the NT depending on config
         if cm.frcConfig.server:
-            print("Setting up NetworkTables server")
+            Log.info("Setting up NetworkTables server")
             self.ntinst.startServer()
         else:
-            print("Setting up NetworkTables client for team {}".format(cm.frcConfig.team))
+            Log.info("Setting up NetworkTables client for team %s", cm.frcConfig.team)
             self.ntinst.startClient4("Eclipse")
             self.ntinst.setServerTeam(cm.frcConfig.team)
             self.ntinst.startDSClient()
@@ -68,10 +62,20 @@ class FRC:
 
         # TODO perhaps width should be function of # of cameras
 
-        if cscoreAvailable:
-            # self.cs = CameraServer.getInstance()
-            CameraServer.enableLogging()
-            self.csoutput = CameraServer.putVideo("MonsterVision", cm.mvConfig.PREVIEW_WIDTH, cm.mvConfig.PREVIEW_HEIGHT) # TODOnot        
+        # cscore is only imported if we're actually going to stream to the DS (DS_SUBSAMPLING > 0)
+
+        self.csoutput = None
+
+        if cm.mvConfig.DS_SUBSAMPLING > 0:
+            try:
+                from cscore import CameraServer # type: ignore
+            except ImportError:
+                CameraServer = None
+
+            if CameraServer is not None:
+                # self.cs = CameraServer.getInstance()
+                CameraServer.enableLogging()
+                self.csoutput = CameraServer.putVideo("MonsterVision", cm.mvConfig.PREVIEW_WIDTH, cm.mvConfig.PREVIEW_HEIGHT) # TODOnot        
 
 
     # Return True if we're running on Romi.  False if we're a coprocessor on a big 'bot
@@ -82,19 +86,58 @@ class FRC:
                 json.load(f)
                 # j = json.load(f)
         except OSError as err:
-            print("Could not open '{}': {}".format(cm.ROMI_FILE, err), file=sys.stderr)
+            Log.error("Could not open '%s': %s", cm.ROMI_FILE, err)
             return False
         return True
 
 
-    # NT writing for NN detections and AprilTags
-    def writeObjectsToNetworkTable(self, objects, cam):
-        jasonString = json.dumps(objects)
-        res = self.sd.putString("ObjectTracker-" + cam.name, jasonString)
+    # NT writing for NN detections and AprilTags: results is a Results.ResultBatch.  The binary form
+    # always goes to ObjectTrackerRaw-<name>; the JSON form is only built if publishJSON is set.
+    def writeObjectsToNetworkTable(self, results, cam):
+        res = self.sd.putRaw("ObjectTrackerRaw-" + cam.name, results.encode())
+        if cm.mvConfig.publishJSON:
+            res = self.sd.putString("ObjectTracker-" + cam.name, results.toJSON())
         res = self.ntinst.flush() # Puts all values onto table immediately
         res = True
 
 
+    # The occupancy grid from the camera's latest depth frame, if there's a new one
+    def writeOccupancyToNetworkTable(self, cam):
+        if cam.pointCloud is not None and cam.pointCloudUpdated:
+            self.sd.putRaw("Occupancy-" + cam.name, cam.pointCloud.encode())
+            self.sd.putNumber("PointCloud-ms-" + cam.name, round(cam.pointCloud.elapsed * 1000, 1))
+            cam.pointCloudUpdated = False
+
+
+    # The camera's temperature, CPU and memory use, when a new SystemLogger report has arrived
+    def writeTelemetryToNetworkTable(self, cam):
+        t = cam.telemetry
+        if t is not None and cam.telemetryUpdated:
+            self.sd.putNumber("Temperature-" + cam.name, round(t.temperature, 1))
+            self.sd.putNumber("CssCpu-" + cam.name, round(t.cssCpu, 1))
+            self.sd.putNumber("MssCpu-" + cam.name, round(t.mssCpu, 1))
+            self.sd.putNumber("DDR-" + cam.name, round(t.ddr, 1))
+            self.sd.putNumber("CMX-" + cam.name, round(t.cmx, 1))
+            self.sd.putNumber("CssMemory-" + cam.name, round(t.cssMemory, 1))
+            self.sd.putNumber("MssMemory-" + cam.name, round(t.mssMemory, 1))
+            cam.telemetryUpdated = False
+
+
+    # Per-model NN scheduling: results per second and detections in the last result for each model
+    # (and the host decode time for host-decoded ones), and the camera's schedule, about once a second
+    def writeModelStatsToNetworkTable(self, cam):
+        models = cam.models
+        if models is not None and models.statsUpdated:
+            for model in models:
+                key = cam.name + "-" + model.name
+                self.sd.putNumber("NNRate-" + key, round(model.rate, 1))
+                self.sd.putNumber("NNDetections-" + key, len(model.detections) if model.detections is not None else 0)
+                if model.decoder is not None:
+                    self.sd.putNumber("NNDecode-ms-" + key, round(model.decodeTime * 1000, 1))
+            self.sd.putString("NNSchedule-" + cam.name, models.describe())
+            models.statsUpdated = False
+
+
     def displayCamResults(self, cam):
         if not self.onRobot:
             if cam.frame is not None:
@@ -112,7 +155,7 @@ class FRC:
     def sendResultsToDS(self, cams):
         # First, enumerate the images
 
-        if cscoreAvailable:
+        if self.csoutput is not None and cm.mvConfig.DS_SUBSAMPLING > 0:
             self.frame_counter += 1
 
             if self.frame_counter % cm.mvConfig.DS_SUBSAMPLING == 0:
@@ -0,0 +1,229 @@
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# The frame bus lets other local processes (a logger, a web dashboard, an experimental detector)
+# see what each camera sees without being patched into MonsterVision's main loop.
+#
+# Each camera publishes into its own named shared-memory block, "MonsterVision-<camera name>",
+# laid out as a small header followed by a ring of slots:
+#
+#   header   magic "MVFB", version, number of slots, slot size, rgb/depth/detection capacities,
+#            and the sequence number of the newest complete frame
+#   slot     seq, host time, device time, device sequence number, rgb shape, depth shape,
+#            detection count, then the rgb pixels, the depth pixels (uint16, mm) and the detections
+#
+# Detections are float32 rows of DETECTION_FIELDS.
+#
+# The producer never waits for anyone.  Each slot's seq is a seqlock: it is odd while the slot is
+# being written and even once it is complete.  A reader checks it before and after reading; if it
+# changed, the slot was overwritten under it and the frame is simply missed.  Readers that fall more
+# than a ring behind skip ahead to the newest frame.
+
+MAGIC = b"MVFB"
+VERSION = 1
+
+HEADER = struct.Struct("<4sIIQQQQ")
+SEQ = struct.Struct("<Q")
+HEADER_SIZE = 64                    # HEADER followed by the newest sequence number, padded
+WRITE_SEQ_OFFSET = HEADER.size
+
+SLOT = struct.Struct("<QddqIIIIII")
+SLOT_HEADER_SIZE = 64
+
+DETECTION_FIELDS = ("label", "confidence", "xmin", "ymin", "xmax", "ymax", "x", "y", "z")
+
+
+def busName(cameraName: str) -> str:
+    return "MonsterVision-" + "".join(c if c.isalnum() else "_" for c in cameraName)
+
+
+def _align(n: int) -> int:
+    return (n + 63) & ~63
+
+
+class FrameBusWriter:
+
+    def __init__(self, cameraName: str, nSlots: int, rgbShape, depthShape, maxDetections: int = 64):
+        self.name = busName(cameraName)
+        self.nSlots = nSlots
+        self.rgbCapacity = _align(int(np.prod(rgbShape)))
+        self.depthCapacity = _align(int(np.prod(depthShape)) * 2) if depthShape is not None else 0
+        self.maxDetections = maxDetections
+        self.detCapacity = _align(maxDetections * len(DETECTION_FIELDS) * 4)
+        self.slotSize = SLOT_HEADER_SIZE + self.rgbCapacity + self.depthCapacity + self.detCapacity
+        self.seq = 0
+
+        size = HEADER_SIZE + nSlots * self.slotSize
+
+        # A block left behind by a previous run that crashed would have the same name
+
+        try:
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, nSlots, self.slotSize, self.rgbCapacity, self.depthCapacity, maxDetections)
+        SEQ.pack_into(self.shm.buf, WRITE_SEQ_OFFSET, 0)
+
+    # Copy one frame bundle into the next slot.  Anything that doesn't fit is dropped rather than
+    # resizing the block under the readers' feet.
+
+    def publish(self, rgb, depth, detections, deviceTime: float = 0.0, deviceSeq: int = -1):
+        if rgb is None or rgb.nbytes > self.rgbCapacity:
+            return False
+        if depth is not None and depth.nbytes > self.depthCapacity:
+            depth = None
+        if detections is not None and len(detections) > self.maxDetections:
+            detections = detections[:self.maxDetections]
+
+        self.seq += 1
+        base = HEADER_SIZE + (self.seq % self.nSlots) * self.slotSize
+        buf = self.shm.buf
+
+        SEQ.pack_into(buf, base, 2 * self.seq - 1)         # Odd: slot is being written
+
+        rgbShape = rgb.shape + (1,) * (3 - rgb.ndim)
+        np.ndarray(rgb.shape, dtype=np.uint8, buffer=buf, offset=base + SLOT_HEADER_SIZE)[...] = rgb
+
+        depthShape = (0, 0)
+        if depth is not None:
+            depthShape = depth.shape
+            np.ndarray(depth.shape, dtype=np.uint16, buffer=buf, offset=base + SLOT_HEADER_SIZE + self.rgbCapacity)[...] = depth
+
+        nDet = 0
+        if detections is not None and len(detections) > 0:
+            nDet = len(detections)
+            np.ndarray((nDet, len(DETECTION_FIELDS)), dtype=np.float32, buffer=buf,
+                       offset=base + SLOT_HEADER_SIZE + self.rgbCapacity + self.depthCapacity)[...] = detections
+
+        SLOT.pack_into(buf, base, 2 * self.seq - 1, time.time(), deviceTime, deviceSeq,
+                       rgbShape[0], rgbShape[1], rgbShape[2], depthShape[0], depthShape[1], nDet)
+        SEQ.pack_into(buf, base, 2 * self.seq)             # Even: slot is complete
+        SEQ.pack_into(buf, WRITE_SEQ_OFFSET, self.seq)
+        return True
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class BusFrame:
+
+    __slots__ = ("seq", "hostTime", "deviceTime", "deviceSeq", "rgb", "depth", "detections")
+
+    def __init__(self, seq, hostTime, deviceTime, deviceSeq, rgb, depth, detections):
+        self.seq = seq
+        self.hostTime = hostTime
+        self.deviceTime = deviceTime
+        self.deviceSeq = deviceSeq
+        self.rgb = rgb
+        self.depth = depth
+        self.detections = detections
+
+
+class FrameBusReader:
+
+    def __init__(self, cameraName: str):
+        self.shm = shared_memory.SharedMemory(name=busName(cameraName))
+
+        # Attaching registers the block with this process's resource tracker, which would unlink it
+        # when we exit.  It belongs to MonsterVision, not to us.
+
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        (magic, version, self.nSlots, self.slotSize, self.rgbCapacity, self.depthCapacity, self.maxDetections) = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError(f"{busName(cameraName)} is not a version {VERSION} frame bus")
+
+        self.lastSeq = 0
+        self.missed = 0
+
+    def newest(self) -> int:
+        return SEQ.unpack_from(self.shm.buf, WRITE_SEQ_OFFSET)[0]
+
+    # Read frame seq.  With copy=False the arrays are views into shared memory; they are only valid
+    # while stillValid(frame) is True.  Returns None if the frame was overwritten while being read.
+
+    def read(self, seq: int, copy: bool = True) -> BusFrame:
+        base = HEADER_SIZE + (seq % self.nSlots) * self.slotSize
+        buf = self.shm.buf
+
+        (slotSeq, hostTime, deviceTime, deviceSeq, rgbH, rgbW, rgbC, depthH, depthW, nDet) = SLOT.unpack_from(buf, base)
+        if slotSeq != 2 * seq:
+            return None
+
+        rgb = np.ndarray((rgbH, rgbW, rgbC), dtype=np.uint8, buffer=buf, offset=base + SLOT_HEADER_SIZE)
+        depth = None
+        if depthH > 0:
+            depth = np.ndarray((depthH, depthW), dtype=np.uint16, buffer=buf, offset=base + SLOT_HEADER_SIZE + self.rgbCapacity)
+        detections = np.ndarray((nDet, len(DETECTION_FIELDS)), dtype=np.float32, buffer=buf,
+                                offset=base + SLOT_HEADER_SIZE + self.rgbCapacity + self.depthCapacity)
+
+        if copy:
+            rgb = rgb.copy()
+            depth = depth.copy() if depth is not None else None
+            detections = detections.copy()
+
+        frame = BusFrame(seq, hostTime, deviceTime, deviceSeq, rgb, depth, detections)
+        if not self.stillValid(frame):
+            return None
+        return frame
+
+    def stillValid(self, frame: BusFrame) -> bool:
+        base = HEADER_SIZE + (frame.seq % self.nSlots) * self.slotSize
+        return SEQ.unpack_from(self.shm.buf, base)[0] == 2 * frame.seq
+
+    # Return the next frame after the last one read, or None if there isn't one yet.  A reader that
+    # has fallen a full ring behind skips to the newest frame; skipped frames are counted in missed.
+
+    def next(self, copy: bool = True) -> BusFrame:
+        newest = self.newest()
+        if newest <= self.lastSeq:
+            return None
+
+        seq = self.lastSeq + 1
+        if newest - seq >= self.nSlots - 1:
+            seq = newest
+
+        self.missed += seq - self.lastSeq - 1
+        self.lastSeq = seq
+
+        frame = self.read(seq, copy)
+        if frame is None:
+            self.missed += 1
+        return frame
+
+    def close(self):
+        self.shm.close()
+
+
+# python FrameBus.py <camera name> prints the rate at which that camera's frames arrive on the bus
+
+if __name__ == "__main__":
+    reader = FrameBusReader(sys.argv[1])
+    count = 0
+    start = time.monotonic()
+
+    while True:
+        frame = reader.next(copy=False)
+        if frame is None:
+            time.sleep(0.005)
+            continue
+
+        count += 1
+        now = time.monotonic()
+        if now - start >= 1.0:
+            print(f"{count / (now - start):.1f} fps, {len(frame.detections)} detections, {reader.missed} missed, "
+                  f"latency {1000 * (time.time() - frame.hostTime):.1f} ms")
+            count = 0
+            start = now
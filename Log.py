@@ -0,0 +1,277 @@
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import ConfigManager as cm
+
+
+# MonsterVision's diagnostics, written without ever making the vision loop wait for the console or
+# the SD card:
+#
+#   Log.info("Restarting %s: %s", cam.name, reason)
+#
+# A call checks the rate limit and appends (time, level, message, args) to a bounded ring - nothing
+# else.  A background thread formats the records and writes them to the console and, once start()
+# has been called, to <cacheDir>/logs/monstervision.log.
+#
+# - The ring holds RING_SIZE records.  If the writer ever falls that far behind, the oldest
+#   unwritten records are dropped, and how many were dropped is logged.
+# - Each message (the format string, before the args are filled in) is written at most logRate
+#   times a second; the rest are counted and reported as "N more like: ...".
+# - The log file is rotated when it reaches logMaxKB, keeping logBackups old files.
+# - The records of the last logDumpSeconds are kept, written or not.  If MonsterVision dies of an
+#   uncaught exception they are saved, with the traceback, to <cacheDir>/logs/crash-<time>.log.
+
+INFO = "INFO"
+WARNING = "WARNING"
+ERROR = "ERROR"
+
+RING_SIZE = 4096
+FLUSH_INTERVAL = 0.1            # Seconds between the writer's passes over the ring
+
+
+def logDir() -> Path:
+    return Path(cm.mvConfig.cacheDir).expanduser() / "logs"
+
+
+def _text(record) -> str:
+    (t, level, message, args) = record
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError):
+            message = f"{message} {args!r}"
+    return message
+
+
+def _stamp(t: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) + f".{int(t % 1 * 1000):03d}"
+
+
+def _line(record) -> str:
+    return f"{_stamp(record[0])} {record[1]:7s} {_text(record)}\n"
+
+
+class _Writer:
+
+    def __init__(self):
+        self.pending = collections.deque(maxlen=RING_SIZE)      # Not yet written
+        self.history = collections.deque(maxlen=RING_SIZE)      # For the crash dump
+        self.dropped = 0
+        self.windows = {}           # message -> [start of its current second, records in it]
+        self.suppressed = {}        # message -> records held back by the rate limit
+        self.lastPrune = 0.0
+
+        self.configured = False     # Settings come from cm.mvConfig once start() has been called
+        self.rate = 10.0
+        self.dumpSeconds = 30.0
+        self.path = None
+        self.file = None
+        self.maxBytes = 0
+        self.backups = 0
+
+        self.lock = threading.Lock()        # Taken by the writer side; a logging call only takes it to start the writer
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def record(self, level: str, message: str, args):
+        now = time.time()
+
+        if self.rate > 0:
+            window = self.windows.get(message)
+            if window is None or now - window[0] >= 1.0:
+                window = self.windows[message] = [now, 0]
+            window[1] += 1
+            if window[1] > self.rate:
+                self.suppressed[message] = self.suppressed.get(message, 0) + 1
+                return
+
+        record = (now, level, message, args)
+        if len(self.pending) == RING_SIZE:
+            self.dropped += 1
+        self.pending.append(record)
+        self.history.append(record)
+
+        if self.thread is None:
+            self.startThread()
+
+    def startThread(self):
+        with self.lock:
+            if self.thread is None:         # Another thread may have got here first
+                self.thread = threading.Thread(target=self.run, name="log writer", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(FLUSH_INTERVAL):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        if self.configured:
+            self.rate = cm.mvConfig.logRate         # Follows mv.json reloads
+
+        with self.lock:
+            records = []
+            while True:
+                try:
+                    records.append(self.pending.popleft())
+                except IndexError:
+                    break
+
+            now = time.time()
+            if self.dropped > 0:
+                (dropped, self.dropped) = (self.dropped, 0)
+                records.append((now, WARNING, "%d log records dropped; the log writer fell behind", (dropped,)))
+
+            (suppressed, self.suppressed) = (self.suppressed, {})
+            for (message, count) in suppressed.items():
+                records.append((now, INFO, "%d more like: %s", (count, message)))
+
+            if len(records) > 0:
+                self.write(records)
+
+            if now - self.lastPrune >= 1.0:
+                self.prune(now)
+
+    def write(self, records):
+        for record in records:
+            if record[1] == INFO:
+                sys.stdout.write(_text(record) + "\n")
+            else:
+                sys.stderr.write(f"{record[1]}: {_text(record)}\n")
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        if self.file is not None:
+            try:
+                self.file.write("".join(_line(record) for record in records))
+                self.file.flush()
+                if self.file.tell() >= self.maxBytes:
+                    self.rotate()
+            except OSError as err:
+                sys.stderr.write(f"ERROR: writing {self.path} failed, logging to the console only: {err}\n")
+                self.file = None
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = Path(f"{self.path}.{i}")
+            if older.exists():
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "wt", encoding="utf-8")
+
+    # Forget the rate-limit windows of messages that haven't been seen for a second
+
+    def prune(self, now: float):
+        self.lastPrune = now
+        for message in list(self.windows):
+            window = self.windows.get(message)
+            if window is not None and now - window[0] >= 1.0:
+                self.windows.pop(message, None)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(1.0)
+        else:
+            self.flush()
+
+    # A forked process (a tag worker) starts with a fresh ring and logs to the console only
+
+    def afterFork(self):
+        self.pending.clear()
+        self.history.clear()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.file = None
+
+
+_writer = _Writer()
+os.register_at_fork(after_in_child=_writer.afterFork)
+atexit.register(_writer.stop)
+
+
+def info(message: str, *args):
+    _writer.record(INFO, message, args)
+
+
+def warning(message: str, *args):
+    _writer.record(WARNING, message, args)
+
+
+def error(message: str, *args):
+    _writer.record(ERROR, message, args)
+
+
+# Write the last logDumpSeconds of records (and reason) to a crash file.  Returns its path, or None.
+
+def dumpRecent(reason: str = ""):
+    cutoff = time.time() - _writer.dumpSeconds
+    records = [record for record in list(_writer.history) if record[0] >= cutoff]
+    path = logDir() / f"crash-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.log"
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wt", encoding="utf-8") as f:
+            f.write("".join(_line(record) for record in records))
+            if reason:
+                f.write(reason)
+    except OSError as err:
+        sys.stderr.write(f"ERROR: could not write crash log {path}: {err}\n")
+        return None
+    return path
+
+
+def _excepthook(kind, value, tb):
+    if not issubclass(kind, KeyboardInterrupt):
+        text = "".join(traceback.format_exception(kind, value, tb))
+        error("Uncaught exception:\n%s", text)
+        path = dumpRecent(text)
+        if path is not None:
+            error("Last %.0f s of log written to %s", _writer.dumpSeconds, path)
+    _writer.stop()
+    sys.__excepthook__(kind, value, tb)
+
+
+def _threadExcepthook(args):
+    if args.exc_type is not SystemExit:
+        text = "".join(traceback.format_exception(args.exc_type, args.exc_value, args.exc_traceback))
+        error("Uncaught exception in thread %s:\n%s", args.thread.name if args.thread is not None else "?", text)
+        dumpRecent(text)
+
+
+# Called once MonsterVision's configuration is loaded: starts the log file and the crash dump
+
+def start():
+    _writer.rate = cm.mvConfig.logRate
+    _writer.dumpSeconds = cm.mvConfig.logDumpSeconds
+    _writer.maxBytes = cm.mvConfig.logMaxKB * 1024
+    _writer.backups = cm.mvConfig.logBackups
+    _writer.configured = True
+
+    if _writer.maxBytes > 0:
+        path = logDir() / "monstervision.log"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with _writer.lock:
+                _writer.path = path
+                _writer.file = open(path, "at", encoding="utf-8")
+        except OSError as err:
+            warning("Could not open %s, logging to the console only: %s", path, err)
+
+    sys.excepthook = _excepthook
+    threading.excepthook = _threadExcepthook
+
+
+# Write whatever is still in the ring (also done at exit)
+
+def stop():
+    _writer.stop()
@@ -0,0 +1,188 @@
+import time
+from pathlib import Path
+
+
+# A camera can run several NN models (a game-piece model and a bumper model, say) by time-slicing
+# its frames between them, instead of needing a camera per model.
+#
+# The frames that get through the camera's "nn" gate (every nnEvery'th, see Profiles) go to a Script
+# node router on the device, which hands each one to the next model in a repeating schedule:
+#
+#   round-robin   the models take one frame each in turn
+#   priority      each model gets its priority's worth of frames per cycle, spread through it
+#                 (priorities 3 and 1 give A A B A, A A B A, ...)
+#
+# A model with "profiles" only runs while the camera is in one of those processing profiles, so the
+# robot can switch models by switching profiles.  The schedule is rebuilt and sent to the router
+# whenever the profile changes.
+#
+# Each model keeps its own labels and thresholds.  The camera's LABELS are every model's labels one
+# after the other, and a model's detections have its offset added to their label, so the merged
+# detections of all models look like one model's to the rest of MonsterVision.
+
+STATS_INTERVAL = 1.0            # Seconds between updates of the per-model rates
+
+
+class Model:
+
+    __slots__ = ("index", "config", "name", "stream", "nn", "labels", "labelOffset", "inputSize", "bbfraction",
+                 "confidenceThreshold", "decoder", "setupTime",
+                 "detections", "detectionTime", "nnInterval", "results", "rate", "decodeTime")
+
+    def __init__(self, index: int, config):
+        self.index = index
+        self.config = config                # ConfigManager.ModelConfig
+        self.name = Path(config.file).stem
+        self.stream = "detections" if index == 0 else f"detections{index}"
+        self.nn = None                      # The dict CameraPipeline.parseNNConfig returns
+        self.labels = []
+        self.labelOffset = 0
+        self.inputSize = None
+        self.bbfraction = 0.2
+        self.confidenceThreshold = 0.0
+        self.decoder = None                 # Set when the model's outputs are decoded on the host
+        self.setupTime = 0.0
+        self.detections = None
+        self.detectionTime = 0.0
+        self.nnInterval = 0.0               # Seconds between the last two results
+        self.results = 0                    # Results since the last stats update
+        self.rate = 0.0                     # Results per second
+        self.decodeTime = 0.0               # Seconds the last host decode took
+
+    def setNN(self, nn: dict):
+        self.nn = nn
+        self.labels = nn['labels']
+        self.inputSize = tuple(nn['inputSize'])
+        self.bbfraction = nn['bbfraction']
+        self.confidenceThreshold = nn['confidenceThreshold']
+
+    # A new result from the device (or the host decoder)
+
+    def accept(self, detections, now: float):
+        if self.detectionTime > 0:
+            self.nnInterval = now - self.detectionTime
+        self.detectionTime = now
+        self.results += 1
+
+        kept = []
+        for d in detections:
+            if d.confidence >= self.confidenceThreshold:
+                if self.labelOffset != 0:
+                    d.label += self.labelOffset
+                kept.append(d)
+        self.detections = kept
+
+
+# The order the router sends frames to the models in, for one profile, as a list of model indexes
+
+def buildSchedule(models: list, mode: str, profile: str) -> list:
+    active = [m for m in models if len(m.config.profiles) == 0 or profile in m.config.profiles]
+
+    if mode == "round-robin":
+        return [m.index for m in active]
+
+    # Smooth weighted round-robin: each step every model earns its priority and the richest one runs
+
+    total = sum(m.config.priority for m in active)
+    credit = {m.index: 0 for m in active}
+    schedule = []
+    for _ in range(total):
+        for m in active:
+            credit[m.index] += m.config.priority
+        best = max(credit, key=credit.get)
+        credit[best] -= total
+        schedule.append(best)
+    return schedule
+
+
+class ModelScheduler:
+
+    def __init__(self, configs: list, mode: str = "round-robin"):
+        self.models = [Model(i, config) for i, config in enumerate(configs)]
+        self.mode = mode
+        self.schedule = []
+        self.labels = []
+        self.lastStats = time.monotonic()
+        self.statsUpdated = False
+
+    def __len__(self):
+        return len(self.models)
+
+    def __iter__(self):
+        return iter(self.models)
+
+    # Once every model's NN config has been read: give each its label offset and build the merged list
+
+    def mergeLabels(self):
+        self.labels = []
+        for m in self.models:
+            m.labelOffset = len(self.labels)
+            self.labels.extend(m.labels)
+
+    def setSchedule(self, profile: str):
+        self.schedule = buildSchedule(self.models, self.mode, profile)
+
+    # The router's control message for the current schedule
+
+    def control(self) -> str:
+        return "schedule=" + ":".join(str(i) for i in self.schedule)
+
+    def describe(self) -> str:
+        return ",".join(self.models[i].name for i in self.schedule)
+
+    # A model whose outputs are decoded on the host would otherwise drop anything under the old
+    # threshold before accept() sees it.  A detection network filters on the device at the threshold
+    # it was built with, so returns True if threshold is below that: only a new pipeline can lower it.
+
+    def setConfidenceThreshold(self, file: str, threshold: float) -> bool:
+        rebuild = False
+        for m in self.models:
+            if m.config.file == file:
+                m.confidenceThreshold = threshold
+                if m.decoder is not None:
+                    m.decoder.setConfidenceThreshold(threshold)
+                elif m.nn is not None and threshold < m.nn['confidenceThreshold']:
+                    rebuild = True
+        return rebuild
+
+    def clear(self):
+        for m in self.models:
+            m.detections = None
+
+    # Every model's latest detections, merged, leaving out any that are older than two of that
+    # model's periods (its expected period, or the measured one if the NN is slower).  framePeriod is
+    # seconds per camera frame; nnEvery as in the camera's config.  None if no model has any.
+
+    def current(self, now: float, framePeriod: float, nnEvery: int):
+        merged = None
+
+        for m in self.models:
+            if m.detections is None:
+                continue
+
+            period = framePeriod
+            if nnEvery > 0:
+                slots = self.schedule.count(m.index)
+                if slots == 0:
+                    continue
+                period = max(nnEvery * framePeriod * len(self.schedule) / slots, m.nnInterval)
+
+            if now - m.detectionTime > 2 * period:
+                continue
+
+            merged = m.detections if merged is None else merged + m.detections
+
+        return merged
+
+    # Called every frame; turns the result counts into rates once every STATS_INTERVAL
+
+    def updateStats(self, now: float):
+        elapsed = now - self.lastStats
+        if elapsed < STATS_INTERVAL:
+            return
+
+        for m in self.models:
+            m.rate = m.results / elapsed
+            m.results = 0
+        self.lastStats = now
+        self.statsUpdated = True
@@ -1,24 +1,34 @@
 #!/usr/bin/env python3
 
+from StartupTimer import StartupTimer
+startupTimer = StartupTimer()
+
 import json
 import cv2
 import depthai as dai
 import contextlib
 
-import robotpy_apriltag
 import CameraPipeline as capPipe
 from Detections import Detections
-from AprilTag5 import AprilTag
 from FRC import FRC
+from CalibrationCache import CalibrationCache
+from BlobCache import getBlobCache
+from ConfigWatcher import ConfigChanges, ConfigWatcher
+from CameraSupervisor import CameraSupervisor
+from Profiles import ProfileController
+from Profiler import ProfilerControl
+import VisionLoop
 import ConfigManager as cm
+import Log
 
+startupTimer.mark("imports")
 
 # Prints "interesting" information about the camera
-# and returns the camera intrinsics
+# and returns the calibration data read from its EEPROM
 
 def printDeviceInfo(devInfo: dai.DeviceInfo):
-        device: dai.Device = dai.Device(deviceInfo)
-        mxId = deviceInfo.getMxId()
+        device: dai.Device = dai.Device(devInfo)
+        mxId = devInfo.getMxId()
         cameras = device.getConnectedCameras()
         usbSpeed = device.getUsbSpeed()
         calibData = device.readCalibration()
@@ -28,141 +38,222 @@ def printDeviceInfo(devInfo: dai.DeviceInfo):
             eepromData = None
         if eepromData is not None: productName = eepromData.productName
 
-        print("   >>> MXID:", mxId)
-        print("   >>> Num of cameras:", len(cameras))
+        Log.info("   >>> MXID: %s", mxId)
+        Log.info("   >>> Num of cameras: %d", len(cameras))
         for cam in cameras:
-            print("   >>> Camera:", cam)
-        print("   >>> USB speed:", usbSpeed)
+            Log.info("   >>> Camera: %s", cam)
+        Log.info("   >>> USB speed: %s", usbSpeed)
         if eepromData is not None and eepromData.boardName != "":
-            print("   >>> Board name:", eepromData.boardName)
+            Log.info("   >>> Board name: %s", eepromData.boardName)
         if eepromData is not None and eepromData.productName != "":
-            print("   >>> Product name:", eepromData.productName)
+            Log.info("   >>> Product name: %s", eepromData.productName)
 
         xxx = device.getIrDrivers()
-        print("   >>> IR drivers:", xxx)
+        Log.info("   >>> IR drivers: %s", xxx)
 
-        return
+        return calibData
 
 
-with contextlib.ExitStack() as stack:
-    frc = FRC()
+# Connects to one camera, builds and starts its pipeline and creates the detectors for it.
+# Returns the (camera, mxId, detector, tagDetector) tuple kept in oakCameras.
+
+def startCamera(deviceInfo: dai.DeviceInfo, calibration):
+    mxId = deviceInfo.getMxId()
+
+    # See if the camera has a friendly name in the config file.  If not, use the MXID
+
+    cameraConfig = cm.mvConfig.getCamera(mxId)
+    if cameraConfig is None:
+        cameraConfig = cm.CameraConfig(mxId)
+
+    camName = cameraConfig.name or mxId
+    useDepth = cameraConfig.useDepth
+    nnFile = cameraConfig.nnFile
+           
+    Log.info("===Connected to %s", camName)
+
+    # Here we can customize the NN being used on the camera
+    # You can have different NN's on each camera (or none)
+
+    # Even if the camera supports depth, you can force it to not use depth
+    Log.info("Using depth: %s    NN files: %s", useDepth, ", ".join(model.file for model in cameraConfig.nnModels()) or None)
+    cam1 = capPipe.CameraPipeline(camName, deviceInfo, useDepth, nnFile, calibration)
+
+    # The intrinsics come from the calibration cache, so the tag detector doesn't have to wait for the pipeline
+
+    tagDetector = makeTagDetector(cam1)
+
+    # This is where the camera is set up and the pipeline is built
+    # First, create the Spatial Detection Network (SDN) object
     
-    deviceInfos = dai.Device.getAllAvailableDevices()
+    sdn = cam1.setupSDN()
 
-    oakCameras = []
+    # Now build the pipeline
 
-    # This section enumerates all connected devices and prints out their information
-    # It needs to be customized to each year's set of cameras and uses
+    cam1.buildPipeline(sdn, cameraConfig.invert)
 
-    for deviceInfo in deviceInfos:
-        deviceInfo: dai.DeviceInfo
+    # Serialize the pipeline, if requested
 
-        mxId = deviceInfo.getMxId()
-        cameraIntrinsics = printDeviceInfo(deviceInfo)
+    if cameraConfig.dumpPipeline:
+        filename = camName + ".json"
+        cam1.serializePipeline(filename)
 
-        # In this sample code, we connect to every camera we find
+    # Start the pipeline
 
-        # See if the camera has a friendly name in the config file.  If not, use the MXID
+    cam1.startPipeline()
 
-        cameraConfig = None
+    # Either detector can be set to None if not needed for a particular camera
 
-        try:
-            cameraConfig = cm.mvConfig.getCamera(mxId)
-            camName = cm.mvConfig.getCamera(mxId)['name']
-        except:
-            camName = mxId
-               
-        print("===Connected to ", camName)
+    # (Each NN model's confidence threshold is applied by the camera, see Models)
 
-        try:
-            useDepth = cameraConfig['useDepth']
-        except:
-            useDepth = True
+    detector = Detections(cam1.bbfraction, cam1.LABELS, cam1.inputSize)
 
-        try:
-            nnFile = cameraConfig['nnFile']
-        except:
-            nnFile = None
+    return (cam1, mxId, detector, tagDetector)
 
-        try:
-            dumpPipeline = cameraConfig['dumpPipeline']
-        except:
-            dumpPipeline = False
 
-        # Here we can customize the NN being used on the camera
-        # You can have different NN's on each camera (or none)
+# The AprilTag code (and robotpy_apriltag/wpimath with it) is only imported if a tag family is configured
 
-        # Even if the camera supports depth, you can force it to not use depth
-        print(f"Using depth: {useDepth}    NN file: {nnFile}")
-        cam1 = capPipe.CameraPipeline(camName, deviceInfo, useDepth, nnFile)
+def makeTagDetector(cam):
+    if not cm.mvConfig.tagFamily:
+        return None
 
-        # This is where the camera is set up and the pipeline is built
-        # First, create the Spatial Detection Network (SDN) object
-        
-        sdn = cam1.setupSDN()
+    import robotpy_apriltag
+    from AprilTag5 import AprilTag
 
-        # Now build the pipeline
+    # With a worker pool the workers do the detecting; this object is still used to draw and publish
 
-        cam1.buildPipeline(sdn, cm.mvConfig.getCamera(mxId)['invert'])
+    distortion = cam.calibData.distortion if cam.calibData is not None else None
 
-        # Serialize the pipeline, if requested
+    if tagPool is not None:
+        tagPool.configure(cam.devInfo.getMxId(), cm.mvConfig.tagFamily, cm.mvConfig.tagSize, cam.cameraIntrinsics, distortion)
 
-        if dumpPipeline:
-            filename = camName + ".json"
-            cam1.serializePipeline(filename)
+    return AprilTag(cm.mvConfig.tagFamily, cm.mvConfig.tagSize, cam.cameraIntrinsics, robotpy_apriltag.AprilTagField.k2024Crescendo, distortion)
 
-        # Start the pipeline
 
-        cam1.startPipeline()
+# Used for cameras found at startup and for cameras plugged in later
 
-        # Either of the following can be set to None if not needed for a particular camera
+def connectCamera(deviceInfo: dai.DeviceInfo):
+    mxId = deviceInfo.getMxId()
+    calibration = calibrationCache.get(mxId, printDeviceInfo(deviceInfo))
+    Log.info("Calibration for %s: %s", mxId, "cached" if calibration.cacheHit else "read from device")
+    calibrations[mxId] = calibration
 
-        detector = Detections(cam1.bbfraction, cam1.LABELS)
-        tagDetector = AprilTag(cm.mvConfig.tagFamily, cm.mvConfig.tagSize, cam1.cameraIntrinsics, robotpy_apriltag.AprilTagField.k2024Crescendo)
+    return startCamera(deviceInfo, calibration)
 
-        # Add the camera to the list of cameras, along with the detectors, etc.
 
-        oakCameras.append((cam1, mxId, detector, tagDetector))
+# Used by the supervisor to bring a camera back after a failure or for a config change.
+# The calibration was validated when the camera first connected, so that copy is used as is (the
+# one on disk may be missing if the cache directory isn't writable).
 
-      
-    while True:
-        cam : capPipe
+def recoverCamera(mxId: str):
+    found, deviceInfo = dai.Device.getDeviceByMxId(mxId)
+    if not found:
+        raise RuntimeError(f"{mxId} is not available")
 
-        # Loop through all the cameras.  For each camera, process the next frame
+    calibration = calibrations.get(mxId)
+    if calibration is None:
+        return connectCamera(deviceInfo)
 
-        for (cam, mxId, detector, tagDetector) in oakCameras:
+    return startCamera(deviceInfo, calibration)
 
-            # Process the next frame.  If anything new arrived, processNextFrame will return True
 
-            if cam.processNextFrame():
+# Apply whatever the ConfigWatcher found.  Host-side settings take effect immediately; the
+# device-side ones go through control calls, and only cameras whose pipeline can't be changed
+# in place are restarted (in the background, by the supervisor).
 
-                # If the camera has a detection object, process the detections
+def applyConfigChanges(changes: ConfigChanges):
+    for entry in list(oakCameras):
+        (cam, mxId, detector, tagDetector) = entry
 
-                objects = []
+        if changes.restartAll or mxId in changes.restart:
+            supervisor.restart(entry, "configuration changed")
+            continue
 
-                if detector is not None and cam.detections is not None and len(cam.detections) != 0:
-                    objects = detector.processDetections(cam.detections, cam.frame, cam.depthFrameColor)
+        # (any, not a generator, so every model gets its new threshold)
 
-                # If the camera has an AprilTag object, detect any AprilTags that might be seen
+        if any([cam.setConfidenceThreshold(nnFile, threshold) for (nnFile, threshold) in changes.thresholds.items()]):
+            supervisor.restart(entry, "confidence threshold lowered below the device's")
+            continue
 
-                if tagDetector is not None and cam.frame is not None:
-                    objects.extend(tagDetector.detect(cam.frame, cam.depthFrame))
+        if changes.retag:
+            tagDetector = makeTagDetector(cam)
 
-                    cv2.putText(cam.frame, "fps: {:.2f}".format(cam.fps), (2, cam.frame.shape[0] - 4), cv2.FONT_HERSHEY_TRIPLEX, 0.4,
-                    (255, 255, 255))
+        if changes.laser:
+            cam.setLaser()
 
-                res = frc.sd.putString("ObjectTracker-fps", "fps : {:.2f}".format(cam.fps))
-                res = frc.ntinst.flush() # Puts all values onto table immediately
+        oakCameras[oakCameras.index(entry)] = (cam, mxId, detector, tagDetector)
+
+
+with contextlib.ExitStack() as stack:
+
+    # The tag workers are forked, so they have to start before any cameras or NetworkTables threads
+    # exist.  (If something is logged before then, the log writer thread is already running; Log
+    # resets itself in the forked workers, which log to the console only.)
+
+    tagPool = None
+    if cm.mvConfig.tagWorkers > 0 and cm.mvConfig.tagFamily:
+        from TagWorkerPool import TagWorkerPool
+        tagPool = TagWorkerPool(cm.mvConfig.tagWorkers)
+
+    # Diagnostics go through Log, which writes them on its own thread; see Log.py.  Started after the
+    # fork so the workers don't inherit the open log file or the crash hooks.
+
+    Log.start()
+
+    frc = FRC()
+    calibrationCache = CalibrationCache()
+    calibrations = {}           # mxId -> the CameraCalibration its camera was started with
+    startupTimer.mark("config and NetworkTables")
+    
+    deviceInfos = dai.Device.getAllAvailableDevices()
+    startupTimer.mark("device discovery")
+
+    oakCameras = []
+
+    # This section enumerates all connected devices and prints out their information
+    # It needs to be customized to each year's set of cameras and uses
+
+    for deviceInfo in deviceInfos:
+        deviceInfo: dai.DeviceInfo
+
+        # In this sample code, we connect to every camera we find
+
+        oakCameras.append(connectCamera(deviceInfo))
+        startupTimer.mark("camera " + oakCameras[-1][0].name)
+
+    Log.info("%s", getBlobCache().report())
+    Log.info("%s", startupTimer.report())
+    startupTimer.publish(frc.sd)
+
+    # Watch the config files so settings can be changed without restarting
+
+    configWatcher = ConfigWatcher()
+
+    # Rebuild cameras that fail or stall, and pick up cameras plugged in later
+
+    supervisor = CameraSupervisor(oakCameras, connectCamera, recoverCamera, frc.sd)
+
+    # Let the robot switch each camera between tags, NN, both or idle
+
+    profiles = ProfileController(frc.sd)
+
+    # A sampling profiler the robot (or SIGUSR1) can switch on to see where the time goes
+
+    profiler = ProfilerControl(frc.sd, tagPool)
+
+    while True:
 
-                # Display the results to the GUI and push frames to the camera server
-                
-                frc.displayCamResults(cam)
+        # Read every camera, detect and publish (see VisionLoop)
 
-                # Write the objects to the Network Table
+        VisionLoop.runOnce(oakCameras, frc, tagPool, supervisor.failed)
 
-                frc.writeObjectsToNetworkTable(objects, cam)
+        supervisor.poll()
+        profiles.poll(oakCameras)
+        profiler.poll()
 
-                frc.sendResultsToDS(oakCameras)
+        changes = configWatcher.poll()
+        if changes is not None:
+            applyConfigChanges(changes)
 
         # This won't work in the final version, but it's a way to exit the program
 
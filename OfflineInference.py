@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from YoloDecoder import YoloDecoder
+
+
+# Offline re-evaluation of the NN models in models/ against recorded footage, on the host CPU.
+#
+# The OpenVINO IR named in the NN JSON ("model": {"xml": ..., "bin": ...}, found next to the blobs in
+# models/) is compiled for the CPU with a fixed batch size, and batches are run through an
+# AsyncInferQueue so several inference requests are in flight at once.  Frames are preprocessed the
+# way the OAK's preview output does it (centre crop to the NN's aspect ratio, resize, planar BGR), and
+# the raw outputs are decoded by YoloDecoder into the same detection objects
+# Detections.processDetections consumes from the device.
+#
+#   python3 OfflineInference.py models/2024.json match1.mp4 --compare models/2022/nn-yolo6s640.json
+#
+# prints frames/second and detection statistics for each model, and can write every frame's
+# detections to a JSON-lines file for closer comparison.
+
+MODELS_DIR = Path(__file__).parent / "models"
+
+
+def readNNConfig(nnFile: str) -> dict:
+    with open(nnFile, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Yields (index, frame) from a video file or a directory of images
+
+def readFrames(source: str):
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+        for i, name in enumerate(names):
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                yield i, frame
+    else:
+        capture = cv2.VideoCapture(source)
+        i = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield i, frame
+            i += 1
+        capture.release()
+
+
+class OfflineEngine:
+
+    def __init__(self, nnFile: str, batchSize: int = 8, workers: int = 2, scale: float = 1.0):
+        try:
+            from openvino.runtime import AsyncInferQueue, Core  # type: ignore
+        except ImportError:
+            raise ImportError("OfflineInference needs the OpenVINO runtime: pip install openvino")
+
+        self.nnFile = nnFile
+        self.nnJSON = readNNConfig(nnFile)
+        self.labels = self.nnJSON['mappings']['labels']
+        self.decoder = YoloDecoder.fromJSON(self.nnJSON)
+        self.inputWidth = self.decoder.inputWidth
+        self.inputHeight = self.decoder.inputHeight
+        self.batchSize = batchSize
+        self.scale = scale
+
+        xml = MODELS_DIR / self.nnJSON['model']['xml']
+        if not xml.exists():
+            raise FileNotFoundError(f"OpenVINO IR '{xml}' not found")
+
+        core = Core()
+        model = core.read_model(str(xml))
+        model.reshape({model.inputs[0].get_any_name(): [batchSize, 3, self.inputHeight, self.inputWidth]})
+        self.compiled = core.compile_model(model, "CPU", {"PERFORMANCE_HINT": "THROUGHPUT"})
+        self.queue = AsyncInferQueue(self.compiled, workers)
+        self.queue.set_callback(self._done)
+
+        self.results = {}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.elapsed = 0.0
+
+    # Same geometry as the camera's preview output: centre crop to the NN's aspect ratio, then resize
+
+    def preprocess(self, frame):
+        h, w = frame.shape[:2]
+        cropW = min(w, int(h * self.inputWidth / self.inputHeight))
+        x0 = (w - cropW) // 2
+        resized = cv2.resize(frame[:, x0:x0 + cropW], (self.inputWidth, self.inputHeight))
+        return resized.transpose(2, 0, 1)
+
+    def _done(self, request, userdata):
+        (indices, count) = userdata
+        outputs = [request.get_output_tensor(i).data[:count].copy() for i in range(len(self.compiled.outputs))]
+        detections = self.decoder.decode(outputs)
+        with self.lock:
+            for index, dets in zip(indices, detections):
+                self.results[index] = dets
+
+    # Run every frame from frames (an iterable of (index, frame)).  Returns {index: [HostDetection]}.
+
+    def run(self, frames) -> dict:
+        self.results = {}
+        batch = np.zeros((self.batchSize, 3, self.inputHeight, self.inputWidth), dtype=np.float32)
+        indices = []
+        start = time.perf_counter()
+
+        for index, frame in frames:
+            batch[len(indices)] = self.preprocess(frame) * self.scale
+            indices.append(index)
+            if len(indices) == self.batchSize:
+                self.queue.start_async({0: batch.copy()}, (indices, len(indices)))
+                indices = []
+
+        if len(indices) > 0:
+            self.queue.start_async({0: batch.copy()}, (indices, len(indices)))
+
+        self.queue.wait_all()
+        self.elapsed += time.perf_counter() - start
+        self.frames += len(self.results)
+        return self.results
+
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    # Per-class detection counts and mean confidence, for comparing models on the same footage
+
+    def summarize(self, results: dict) -> dict:
+        counts = {}
+        confidence = {}
+        for dets in results.values():
+            for d in dets:
+                label = self.labels[d.label] if d.label < len(self.labels) else str(d.label)
+                counts[label] = counts.get(label, 0) + 1
+                confidence[label] = confidence.get(label, 0.0) + d.confidence
+        return {label: (counts[label], confidence[label] / counts[label]) for label in counts}
+
+
+def writeResults(path: str, engine: OfflineEngine, results: dict):
+    with open(path, "wt", encoding="utf-8") as f:
+        for index in sorted(results):
+            f.write(json.dumps({"frame": index, "detections": [
+                {"label": engine.labels[d.label] if d.label < len(engine.labels) else d.label, "confidence": round(d.confidence, 3),
+                 "xmin": round(d.xmin, 4), "ymin": round(d.ymin, 4), "xmax": round(d.xmax, 4), "ymax": round(d.ymax, 4)}
+                for d in results[index]]}) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the NN models in models/ over recorded footage on the host CPU")
+    parser.add_argument("nnFile", help="NN config file, e.g. models/2024.json")
+    parser.add_argument("source", nargs="+", help="Video files or directories of images")
+    parser.add_argument("--compare", nargs="*", default=[], help="Other NN config files to run on the same footage")
+    parser.add_argument("--batch", type=int, default=8, help="Frames per inference request")
+    parser.add_argument("--workers", type=int, default=2, help="Inference requests in flight")
+    parser.add_argument("--scale", type=float, default=1.0, help="Pixel scale, e.g. 0.00392 for models that expect 0..1")
+    parser.add_argument("--out", help="Directory for per-model JSON-lines detection files")
+    args = parser.parse_args()
+
+    for nnFile in [args.nnFile] + args.compare:
+        engine = OfflineEngine(nnFile, args.batch, args.workers, args.scale)
+
+        for source in args.source:
+            results = engine.run(readFrames(source))
+
+            print(f"{nnFile} on {source}: {len(results)} frames, {engine.fps():.1f} frames/s")
+            for label, (count, meanConfidence) in sorted(engine.summarize(results).items()):
+                print(f"   {label:<16} {count:6d} detections, mean confidence {meanConfidence:.2f}")
+
+            if args.out is not None:
+                os.makedirs(args.out, exist_ok=True)
+                name = Path(nnFile).stem + "-" + Path(source).stem + ".jsonl"
+                writeResults(os.path.join(args.out, name), engine, results)
@@ -0,0 +1,108 @@
+import math
+import struct
+import time
+
+import numpy as np
+
+import ConfigManager as cm
+
+
+# Turns a camera's depth frames into 3D points in robot coordinates and a 2D occupancy grid of the
+# floor in front of the robot.
+#
+# For a pixel (u, v) with depth d, the point is d times the pixel's ray, ((u-cx)/fx, (v-cy)/fy, 1) in
+# the camera's optical frame.  The rays only depend on the intrinsics, the depth size and the step,
+# so they are computed once - already rotated into robot axes by the camera's mount - and cached.
+# Each frame is then one multiply and one add over the valid pixels.
+#
+# The occupancy grid has one cell per cellSize square, rows running forward from the robot and
+# columns from its right (-width/2) to its left (+width/2).  It is published as Occupancy-<camera>:
+# a header of rows, columns (uint16) and cell size (float32), then the cells as packed bits, row by
+# row.
+
+GRID_HEADER = struct.Struct("<HHf")
+
+# Optical frame (x right, y down, z forward) to robot axes (x forward, y left, z up)
+
+OPTICAL_TO_ROBOT = np.array([[0, 0, 1],
+                             [-1, 0, 0],
+                             [0, -1, 0]], dtype=np.float64)
+
+_rayGrids = {}
+
+
+def mountRotation(mount: cm.MountConfig):
+    yaw = math.radians(mount.yaw)
+    pitch = math.radians(mount.pitch)
+    roll = math.radians(mount.roll)
+
+    rz = np.array([[math.cos(yaw), -math.sin(yaw), 0], [math.sin(yaw), math.cos(yaw), 0], [0, 0, 1]])
+    ry = np.array([[math.cos(pitch), 0, math.sin(pitch)], [0, 1, 0], [-math.sin(pitch), 0, math.cos(pitch)]])
+    rx = np.array([[1, 0, 0], [0, math.cos(roll), -math.sin(roll)], [0, math.sin(roll), math.cos(roll)]])
+    return rz @ ry @ rx
+
+
+# Rays for every step'th pixel of a width x height depth frame, in robot axes, as an (N, 3) array in
+# row-major pixel order.  intrinsics are (fx, fy, cx, cy) for that frame size.
+
+def rayGrid(intrinsics, width: int, height: int, step: int, rotation) -> np.ndarray:
+    key = (tuple(intrinsics), width, height, step, rotation.tobytes())
+    rays = _rayGrids.get(key)
+    if rays is None:
+        (fx, fy, cx, cy) = intrinsics
+        u = (np.arange(0, width, step, dtype=np.float64) - cx) / fx
+        v = (np.arange(0, height, step, dtype=np.float64) - cy) / fy
+        uu, vv = np.meshgrid(u, v)
+        optical = np.stack((uu, vv, np.ones_like(uu)), axis=-1).reshape(-1, 3)
+        rays = (optical @ (rotation @ OPTICAL_TO_ROBOT).T).astype(np.float32)
+        _rayGrids[key] = rays
+    return rays
+
+
+class PointCloud:
+
+    def __init__(self, config: cm.PointCloudConfig, mount: cm.MountConfig):
+        self.config = config
+        self.rotation = mountRotation(mount)
+        self.translation = np.array([mount.x, mount.y, mount.z], dtype=np.float32)
+
+        self.rows = int(math.ceil(config.range / config.cellSize))
+        self.cols = int(math.ceil(config.width / config.cellSize))
+        self.points = None
+        self.grid = np.zeros((self.rows, self.cols), dtype=bool)
+        self.elapsed = 0.0              # Seconds taken by the last update
+
+    # depth: uint16 mm.  intrinsics: the 3x3 camera matrix for a frame scale times the depth size.
+    # Returns the (N, 3) points in meters, robot coordinates.
+
+    def toPoints(self, depth, intrinsics, scale: float = 1.0):
+        step = self.config.step
+        (height, width) = depth.shape[:2]
+        k = 1.0 / scale
+        rays = rayGrid((intrinsics[0][0] * k, intrinsics[1][1] * k, intrinsics[0][2] * k, intrinsics[1][2] * k),
+                       width, height, step, self.rotation)
+
+        d = depth[::step, ::step].ravel()
+        valid = np.flatnonzero(d)
+        return rays[valid] * (d[valid, None] * np.float32(0.001)) + self.translation
+
+    def occupancy(self, points):
+        c = self.config
+        x = points[:, 0]
+        y = points[:, 1] + c.width / 2
+        z = points[:, 2]
+        keep = (z >= c.minHeight) & (z <= c.maxHeight) & (x >= 0) & (x < c.range) & (y >= 0) & (y < c.width)
+
+        cells = (x[keep] / c.cellSize).astype(np.int32) * self.cols + (y[keep] / c.cellSize).astype(np.int32)
+        counts = np.bincount(cells, minlength=self.rows * self.cols)
+        return (counts >= c.minPoints).reshape(self.rows, self.cols)
+
+    def update(self, depth, intrinsics, scale: float = 1.0):
+        start = time.perf_counter()
+        self.points = self.toPoints(depth, intrinsics, scale)
+        self.grid = self.occupancy(self.points)
+        self.elapsed = time.perf_counter() - start
+        return self.grid
+
+    def encode(self) -> bytes:
+        return GRID_HEADER.pack(self.rows, self.cols, self.config.cellSize) + np.packbits(self.grid).tobytes()
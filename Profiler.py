@@ -0,0 +1,152 @@
+import os
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import ConfigManager as cm
+import Log
+
+
+# A sampling profiler that can be switched on while MonsterVision is running on the robot.
+#
+# A background thread looks at every other thread's Python stack (sys._current_frames) every
+# interval seconds and counts each distinct stack.  When it stops - after profileSeconds, or when
+# told to - it writes the counts in the "collapsed stack" format flamegraph.pl and speedscope read:
+#
+#   MainThread;<module> (MonsterVision4.5.py:1);processNextFrame (CameraPipeline.py:612) 153
+#
+# to <cacheDir>/profiles/profile-<time>-<pid>.folded.  Sampling only reads stacks, so the vision
+# loop runs at full speed while it is on.
+#
+# ProfilerControl starts and stops it when the robot sets the Profiler entry in the MonsterVision
+# table (true starts, false stops early) or when the process gets SIGUSR1 (each signal toggles).
+# The AprilTag worker processes, if any, are profiled over the same window into their own files.
+
+
+class SamplingProfiler:
+
+    def __init__(self, outDir, duration: float = 10.0, interval: float = 0.01):
+        self.outDir = Path(outDir)
+        self.duration = duration
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = None
+        self.path = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.counts = {}
+        self.samples = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + self.duration
+
+        while not self.stopping.is_set() and time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stack = self._collapse(names.get(ident, str(ident)), frame)
+                    self.counts[stack] = self.counts.get(stack, 0) + 1
+
+            self.samples += 1
+            self.stopping.wait(self.interval)
+
+        self.path = self.write()
+        Log.info("Profiler: %d samples written to %s", self.samples, self.path)
+
+    @staticmethod
+    def _collapse(threadName: str, frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.append(threadName)
+        return ";".join(reversed(stack))
+
+    def write(self) -> Path:
+        self.outDir.mkdir(parents=True, exist_ok=True)
+        path = self.outDir / f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded"
+        with open(path, "wt", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def profileDir() -> Path:
+    return Path(cm.mvConfig.cacheDir).expanduser() / "profiles"
+
+
+class ProfilerControl:
+
+    def __init__(self, table = None, tagPool = None):
+        self.table = table
+        self.tagPool = tagPool
+        self.profiler = SamplingProfiler(profileDir(), cm.mvConfig.profileSeconds)
+        self.toggleRequested = False
+        self.lastRequest = False
+        self.wasRunning = False
+
+        if self.table is not None:
+            self.table.putBoolean("Profiler", False)
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self._onSignal)
+
+    def _onSignal(self, signum, frame):
+        self.toggleRequested = True         # Acted on in poll(), not inside the signal handler
+
+    # Called once per pass of the main loop
+
+    def poll(self):
+        if self.table is not None:
+            request = self.table.getBoolean("Profiler", False)
+            if request != self.lastRequest:
+                self.lastRequest = request
+                if request != self.profiler.running:
+                    self.toggleRequested = True
+
+        if self.toggleRequested:
+            self.toggleRequested = False
+            if self.profiler.running:
+                self.stop()
+            else:
+                self.start()
+
+        # Report when a profile finishes on its own
+
+        running = self.profiler.running
+        if self.wasRunning and not running and self.table is not None:
+            self.table.putBoolean("Profiler", False)
+            self.lastRequest = False
+            if self.profiler.path is not None:
+                self.table.putString("ProfilerFile", str(self.profiler.path))
+        self.wasRunning = running
+
+    def start(self):
+        Log.info("Profiler: sampling for up to %s s", self.profiler.duration)
+        self.profiler.start()
+        if self.tagPool is not None:
+            self.tagPool.profile(str(profileDir()), self.profiler.duration)
+
+    def stop(self):
+        self.profiler.stop()
+        if self.tagPool is not None:
+            self.tagPool.profile(None, 0)
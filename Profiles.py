@@ -0,0 +1,89 @@
+import time
+
+import Log
+
+
+# Processing profiles let the robot program decide, per camera and at any time, what MonsterVision
+# does with it:
+#
+#   both    NN detection and AprilTags (the default)
+#   tags    AprilTags only; the NN doesn't run on the device and no depth is sent
+#   nn      NN detection only; no AprilTag detection on the host
+#   idle    nothing is detected, and the camera only sends about two frames a second so it stays
+#           visible on the DS and the supervisor knows it's alive
+#
+# The robot writes a profile name to Profile-<camera name> (or to Profile, for every camera that
+# doesn't have its own entry) in the MonsterVision table.  Each camera's active profile is published
+# as ActiveProfile-<camera name>.
+#
+# Independently of the profile, a camera's NN only runs on every nnEvery'th frame (from its mv.json
+# entry).  With nnEvery 0 it runs only when the robot sets NNTrigger-<camera name> to true, once per
+# trigger; MonsterVision sets the entry back to false.  Frames in between still go to tag detection.
+#
+# On the device, the NN input, the RGB output and the depth output each pass through a small Script
+# node gate that forwards every Nth frame (0: none), so a disabled stage costs neither Myriad time
+# nor USB bandwidth.  On the host, the main loop skips the stages a camera's profile turns off.
+
+PROFILES = {
+    # name:  (run NN, run tags, send depth, idle)
+    "both": (True, True, True, False),
+    "tags": (False, True, False, False),
+    "nn":   (True, False, True, False),
+    "idle": (False, False, False, True)
+}
+
+DEFAULT_PROFILE = "both"
+
+
+# The gate periods for a profile: {"nn": every, "rgb": every, "depth": every}
+
+def gatePeriods(profile: str, fps: int, nnEvery: int = 1) -> dict:
+    (runNN, runTags, sendDepth, idle) = PROFILES[profile]
+    return {
+        "nn": nnEvery if runNN else 0,
+        "rgb": max(fps // 2, 1) if idle else 1,
+        "depth": 1 if sendDepth else 0
+    }
+
+
+class ProfileController:
+
+    def __init__(self, table, interval: float = 0.05):
+        self.table = table
+        self.interval = interval
+        self.lastPoll = 0
+        self.published = {}
+        self.table.setDefaultString("Profile", DEFAULT_PROFILE)
+
+    # Called once per pass of the main loop with the list of (cam, mxId, detector, tagDetector)
+
+    def poll(self, cameras: list):
+        now = time.monotonic()
+        if now - self.lastPoll < self.interval:
+            return
+        self.lastPoll = now
+
+        default = self.table.getString("Profile", DEFAULT_PROFILE)
+
+        for entry in cameras:
+            cam = entry[0]
+            key = "Profile-" + cam.name
+            wanted = self.table.getString(key, "") or default
+
+            # An unknown profile keeps the camera in its current one; triggers still work
+
+            if wanted not in PROFILES:
+                if wanted != cam.requestedProfile:
+                    Log.warning("Ignoring unknown profile '%s' for %s", wanted, cam.name)
+            elif wanted != cam.profile:
+                cam.setProfile(wanted)
+            cam.requestedProfile = wanted
+
+            trigger = "NNTrigger-" + cam.name
+            if self.table.getBoolean(trigger, False):
+                self.table.putBoolean(trigger, False)
+                cam.triggerNN()
+
+            if self.published.get(cam.name) != cam.profile:
+                self.table.putString("ActiveProfile-" + cam.name, cam.profile)
+                self.published[cam.name] = cam.profile
@@ -0,0 +1,112 @@
+import json
+import struct
+
+import numpy as np
+
+
+# One frame's results from a camera - NN detections and AprilTags together - held as rows of a
+# fixed-layout NumPy record array instead of a list of dicts.
+#
+# encode() gives the compact binary form published to NetworkTables as ObjectTrackerRaw-<camera>:
+#
+#   header   "MVRS", version (uint16), row count (uint16), frame timestamp in s (float64),
+#            frame sequence number (int64)                                        24 bytes
+#   rows     RESULT_DTYPE, little-endian                                          44 bytes each
+#
+# kind is KIND_NN (label is an index into the model's labels; x, y, z in inches, or centre x/y and
+# radius in pixels on a camera without depth) or KIND_TAG (label is the tag id; x, y, z in inches,
+# rx, ry, rz in degrees).  sx, sy, sz are a tag's stereo position in inches, NaN if not measured.
+#
+# toObjects()/toJSON() give the same dicts and JSON the ObjectTracker-<camera> entry always had.
+
+MAGIC = b"MVRS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHdq")
+
+KIND_NN = 0
+KIND_TAG = 1
+
+RESULT_DTYPE = np.dtype([
+    ("kind", "u1"), ("reserved", "u1"), ("label", "<i2"), ("confidence", "<f4"),
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+    ("rx", "<f4"), ("ry", "<f4"), ("rz", "<f4"),
+    ("sx", "<f4"), ("sy", "<f4"), ("sz", "<f4")
+])
+
+NAN = float("nan")
+
+
+class ResultBatch:
+
+    __slots__ = ("rows", "count", "labels", "tagFamily", "timestamp", "sequence")
+
+    def __init__(self, labels=None, tagFamily: str = "", timestamp: float = 0.0, sequence: int = -1, capacity: int = 16):
+        self.rows = np.zeros(capacity, dtype=RESULT_DTYPE)
+        self.count = 0
+        self.labels = labels
+        self.tagFamily = tagFamily
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def records(self):
+        return self.rows[:self.count]
+
+    def _add(self, row):
+        if self.count == len(self.rows):
+            self.rows = np.resize(self.rows, 2 * len(self.rows))
+        self.rows[self.count] = row
+        self.count += 1
+
+    def addDetection(self, label: int, confidence: float, x: float, y: float, z: float):
+        self._add((KIND_NN, 0, label, confidence, x, y, z, 0.0, 0.0, 0.0, NAN, NAN, NAN))
+
+    def addTag(self, tagId: int, x: float, y: float, z: float, rx: float, ry: float, rz: float, stereo=None):
+        (sx, sy, sz) = stereo if stereo is not None else (NAN, NAN, NAN)
+        self._add((KIND_TAG, 0, tagId, 1.0, x, y, z, rx, ry, rz, sx, sy, sz))
+
+    def encode(self) -> bytes:
+        return HEADER.pack(MAGIC, VERSION, self.count, self.timestamp, self.sequence) + self.records.tobytes()
+
+    @classmethod
+    def decode(cls, data: bytes, labels=None, tagFamily: str = "") -> "ResultBatch":
+        (magic, version, count, timestamp, sequence) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} result batch")
+
+        batch = cls(labels, tagFamily, timestamp, sequence, capacity=max(count, 1))
+        batch.rows[:count] = np.frombuffer(data, dtype=RESULT_DTYPE, count=count, offset=HEADER.size)
+        batch.count = count
+        return batch
+
+    def labelName(self, label: int) -> str:
+        if self.labels is not None and 0 <= label < len(self.labels):
+            return self.labels[label]
+        return str(label)
+
+    # The list of dicts MonsterVision used to publish, for anything that still wants JSON
+
+    def toObjects(self) -> list:
+        objects = []
+
+        for row in self.records.tolist():
+            (kind, _, label, confidence, x, y, z, rx, ry, rz, sx, sy, sz) = row
+
+            if kind == KIND_NN:
+                objects.append({"objectLabel": self.labelName(label), "x": round(x, 1), "y": round(y, 1), "z": round(z, 1),
+                                "confidence": round(confidence, 2)})
+            else:
+                obj = {"objectLabel": self.tagFamily + ": " + str(label), "x": round(x, 1), "y": round(y, 1), "z": round(z, 1),
+                       "confidence": 1.0, "rotation": {"x": round(rx), "y": round(ry), "z": round(rz)}}
+                if sz == sz:        # Not NaN
+                    obj["stereo"] = {"x": round(sx, 1), "y": round(sy, 1), "z": round(sz, 1)}
+                objects.append(obj)
+
+        return objects
+
+    def toJSON(self) -> str:
+        return json.dumps(self.toObjects())
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import resource
+import time
+
+import cv2
+import numpy as np
+
+import ConfigManager as cm
+from Profiles import PROFILES, DEFAULT_PROFILE
+from YoloDecoder import HostDetection
+
+
+# Finds how many cameras this host can keep up with, without needing that many OAKs.
+#
+# Each simulated camera behaves like a CameraPipeline to the main loop: it delivers frames at the
+# configured fps (dropping any the host is too slow to take, as the device's non-blocking queues
+# do), with AprilTags drawn in, synthetic depth and a few NN detections.  For 1, 2, ... cameras the
+# test runs the real main-loop code in VisionLoop - detection overlays, tag detection (in the tag
+# workers if asked), result batches, NetworkTables writes into an in-memory table and the DS
+# composite - and reports the frame rate actually processed, the latency from "capture" to
+# published, and the process's memory.  It stops at the first camera count the host can't sustain.
+#
+#   python3 SoakTest.py --max-cameras 6 --fps 25 --seconds 20
+
+APRILTAG_DICTIONARIES = {
+    "tag16h5": "DICT_APRILTAG_16h5",
+    "tag25h9": "DICT_APRILTAG_25h9",
+    "tag36h10": "DICT_APRILTAG_36h10",
+    "tag36h11": "DICT_APRILTAG_36h11"
+}
+
+FRAME_POOL = 16             # Distinct pre-rendered frames per camera
+SUSTAINED = 0.9             # A camera count is sustainable if every camera gets this much of its fps
+
+
+# An image of tag tagId, with the white quiet zone the detector needs around it
+
+def renderTag(family: str, tagId: int, size: int):
+    dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, APRILTAG_DICTIONARIES.get(family, "DICT_APRILTAG_36h11")))
+    if hasattr(cv2.aruco, "generateImageMarker"):
+        marker = cv2.aruco.generateImageMarker(dictionary, tagId, size)
+    else:
+        marker = cv2.aruco.drawMarker(dictionary, tagId, size)
+    border = size // 8
+    marker = cv2.copyMakeBorder(marker, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+    return cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+
+
+class SimulatedCamera:
+
+    def __init__(self, index: int, fps: int, width: int, height: int, tags: int, detections: int, depth: bool, labels=None):
+        self.name = f"sim{index}"
+        self.mxId = f"SIM{index:04d}"
+        self.NN_FILE = None
+        self.nn = {}
+        self.calibData = None
+        self.LABELS = list(labels) if labels else ["object"]
+        self.bbfraction = 0.2
+        self.inputSize = (width, height)        # The detections are made on the whole frame
+
+        f = 0.8 * width                 # About a 64 degree horizontal field of view
+        self.cameraIntrinsics = [[f, 0.0, width / 2], [0.0, f, height / 2], [0.0, 0.0, 1.0]]
+
+        self.frame = None
+        self.depthFrame = None
+        self.depthFrameColor = None
+        self.previewFrame = None
+        self.detections = None
+        self.spatialLocations = {}
+        self.pointCloud = None
+        self.pointCloudUpdated = False
+        self.telemetry = None
+        self.telemetryUpdated = False
+        self.models = None
+        self.profile = DEFAULT_PROFILE
+        self.requestedProfile = None
+
+        self.fps = 0
+        self.lastFrameTime = time.time()
+        self.frameTimestamp = 0.0
+        self.frameSequenceNum = -1
+        self.captureTime = 0.0          # time.monotonic() the current frame was "captured"
+        self.dropped = 0
+
+        self.period = 1 / fps
+        self.nextFrame = time.monotonic() + index * self.period / 7     # Don't have every camera tick together
+
+        rng = np.random.default_rng(index)
+        self.frames = [self.renderFrame(rng, width, height, tags) for _ in range(FRAME_POOL)]
+        self.depth = self.renderDepth(rng, width // 2, height // 2) if depth else None
+        self.boxes = [self.makeBox(rng) for _ in range(detections)]
+
+    @staticmethod
+    def renderFrame(rng, width: int, height: int, tags: int):
+        frame = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+        for tagId in range(tags):
+            tag = renderTag(cm.mvConfig.tagFamily, tagId, int(rng.integers(height // 12, height // 4)))
+            (h, w) = tag.shape[:2]
+            x = int(rng.integers(0, width - w))
+            y = int(rng.integers(0, height - h))
+            frame[y:y + h, x:x + w] = tag
+        return frame
+
+    # A floor sloping away from the camera, with sensor-like noise and holes
+
+    @staticmethod
+    def renderDepth(rng, width: int, height: int):
+        rows = np.linspace(6000, 600, height, dtype=np.float32)[:, None]
+        depth = rows + rng.normal(0, 20, (height, width)).astype(np.float32)
+        depth[rng.random((height, width)) < 0.05] = 0
+        return depth.astype(np.uint16)
+
+    def makeBox(self, rng):
+        (x, y) = rng.uniform(0.1, 0.7, 2)
+        (w, h) = rng.uniform(0.05, 0.2, 2)
+        detection = HostDetection(int(rng.integers(len(self.LABELS))), float(rng.uniform(0.6, 0.95)), x, y, x + w, y + h)
+        detection.spatialCoordinates.x = float(rng.uniform(-1000, 1000))
+        detection.spatialCoordinates.y = float(rng.uniform(-300, 300))
+        detection.spatialCoordinates.z = float(rng.uniform(500, 4000))
+        return detection
+
+    def processNextFrame(self) -> bool:
+        now = time.monotonic()
+        if now < self.nextFrame:
+            return False
+
+        # Frames the host was too slow to take are gone, as with the device's non-blocking queues
+
+        missed = int((now - self.nextFrame) / self.period)
+        self.dropped += missed
+        self.captureTime = self.nextFrame + missed * self.period
+        self.nextFrame = self.captureTime + self.period
+
+        self.frameSequenceNum += 1
+        self.frameTimestamp = self.captureTime
+        self.frame = self.frames[self.frameSequenceNum % FRAME_POOL].copy()
+
+        if self.depth is not None and PROFILES[self.profile][2]:
+            from CameraPipeline import colorizeDepth
+            self.depthFrame = self.depth
+            self.depthFrameColor = colorizeDepth(self.depth)
+
+        self.detections = self.boxes if self.runNN else None
+
+        wall = time.time()
+        self.fps = int(1 / max(wall - self.lastFrameTime, 1e-6))
+        self.lastFrameTime = wall
+        return True
+
+    def currentDetections(self):
+        return self.detections
+
+    @property
+    def runNN(self) -> bool:
+        return PROFILES[self.profile][0]
+
+    @property
+    def runTags(self) -> bool:
+        return PROFILES[self.profile][1]
+
+    def requestSpatialLocations(self, rois: dict):
+        pass
+
+    def setProfile(self, profile: str):
+        self.profile = profile
+
+    def triggerNN(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Stands in for the NetworkTables table and instance, keeping the last value written to each entry
+
+class MemoryTable:
+
+    def __init__(self):
+        self.values = {}
+
+    def _put(self, key, value):
+        self.values[key] = value
+        return True
+
+    putString = putNumber = putBoolean = putRaw = _put
+
+    def _get(self, key, default):
+        return self.values.get(key, default)
+
+    getString = getNumber = getBoolean = getRaw = _get
+
+    def setDefaultString(self, key, value):
+        self.values.setdefault(key, value)
+        return True
+
+    def flush(self):
+        pass
+
+
+class NullVideoOutput:
+
+    def putFrame(self, image):
+        pass
+
+
+def makeFRC(display: bool):
+    from FRC import FRC
+
+    # Everything FRC does per frame, with the table in memory instead of on the network
+
+    class SoakFRC(FRC):
+
+        def __init__(self):
+            self.onRobot = not display
+            self.ntinst = MemoryTable()
+            self.sd = self.ntinst
+            self.frame_counter = 0
+            self.lastTime = 0
+            self.csoutput = NullVideoOutput() if cm.mvConfig.DS_SUBSAMPLING > 0 else None
+
+    return SoakFRC()
+
+
+# The real config files if they load, else the defaults
+
+def loadConfigs():
+    defaults = {"frcConfig": lambda: cm.FRCConfig(team=0), "mvConfig": cm.MVConfig, "nnConfig": cm.NNConfig}
+    for name, default in defaults.items():
+        try:
+            getattr(cm, name)
+        except cm.ConfigError as err:
+            print(f"{err}; using defaults")
+            setattr(cm, name, default())
+
+
+# The labels of nnFile, or else of the first NN file in mv.json or nn.json that can be read, or
+# ["object"] if none can
+
+def loadLabels(nnFile: str = None) -> list:
+    if nnFile is not None:
+        files = [nnFile]
+    else:
+        files = [model.file for cam in cm.mvConfig.cameras for model in cam.nnModels()] + [cm.NN_FILE]
+
+    for file in files:
+        try:
+            with open(file, "rt", encoding="utf-8") as f:
+                labels = json.load(f)['mappings']['labels']
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        if isinstance(labels, list) and len(labels) > 0:
+            return labels
+
+    return ["object"]
+
+
+def residentMB() -> float:
+    try:
+        with open("/proc/self/statm", "rt") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def makeCamera(index: int, args, tagPool):
+    cam = SimulatedCamera(index, args.fps, args.width, args.height, args.tags, args.detections, not args.no_depth, args.labels)
+
+    from Detections import Detections
+    detector = Detections(cam.bbfraction, cam.LABELS, cam.inputSize) if args.detections > 0 else None
+
+    tagDetector = None
+    if cm.mvConfig.tagFamily:
+        from AprilTag5 import AprilTag
+        if tagPool is not None:
+            tagPool.configure(cam.mxId, cm.mvConfig.tagFamily, cm.mvConfig.tagSize, cam.cameraIntrinsics)
+        tagDetector = AprilTag(cm.mvConfig.tagFamily, cm.mvConfig.tagSize, cam.cameraIntrinsics)
+
+    return (cam, cam.mxId, detector, tagDetector)
+
+
+# The main loop's cv2.waitKey(1), which only needs a window to exist with --display
+
+def pause(args):
+    if args.display:
+        cv2.waitKey(1)
+    else:
+        time.sleep(0.001)
+
+
+# Run count cameras for the given time.  Returns a dict of the measurements.
+
+def soak(count: int, args, frc, tagPool) -> dict:
+    import VisionLoop
+
+    cameras = [makeCamera(i, args, tagPool) for i in range(count)]
+
+    def failed(entry, err):
+        raise err
+
+    # A second to settle (tag worker start-up, first allocations) before measuring
+
+    end = time.monotonic() + 1.0
+    while time.monotonic() < end:
+        VisionLoop.runOnce(cameras, frc, tagPool, failed)
+        pause(args)
+
+    for (cam, mxId, detector, tagDetector) in cameras:
+        cam.dropped = 0
+
+    startRSS = residentMB()
+    processed = {cam.name: 0 for (cam, _, _, _) in cameras}
+    latencies = []
+    start = time.monotonic()
+    end = start + args.seconds
+
+    while time.monotonic() < end:
+        ready = VisionLoop.runOnce(cameras, frc, tagPool, failed)
+        done = time.monotonic()
+        for entry in ready:
+            processed[entry[0].name] += 1
+            latencies.append(done - entry[0].captureTime)
+        pause(args)
+
+    elapsed = time.monotonic() - start
+    rates = [n / elapsed for n in processed.values()]
+    dropped = sum(cam.dropped for (cam, _, _, _) in cameras)
+    latency = np.percentile(np.array(latencies) * 1000, [50, 95, 99]) if latencies else [float("nan")] * 3
+
+    return {"cameras": count, "minFps": min(rates), "totalFps": sum(rates), "dropped": dropped,
+            "latency": latency, "rss": residentMB(), "rssGrowth": residentMB() - startRSS}
+
+
+def main():
+    loadConfigs()
+
+    parser = argparse.ArgumentParser(description="Find how many cameras this host can process at full rate")
+    parser.add_argument("--max-cameras", type=int, default=6)
+    parser.add_argument("--fps", type=int, default=cm.mvConfig.CAMERA_FPS)
+    parser.add_argument("--seconds", type=float, default=20, help="how long to run each camera count")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--tags", type=int, default=3, help="AprilTags in each frame")
+    parser.add_argument("--detections", type=int, default=2, help="NN detections in each frame")
+    parser.add_argument("--no-depth", action="store_true", help="simulate OAK-1s")
+    parser.add_argument("--nn-file", help="NN config whose labels the detections use (default: the first in mv.json)")
+    parser.add_argument("--tag-workers", type=int, default=cm.mvConfig.tagWorkers)
+    parser.add_argument("--display", action="store_true", help="show the frames, as off the robot")
+    args = parser.parse_args()
+    args.labels = loadLabels(args.nn_file)
+
+    # The tag workers are forked, so they start before anything else
+
+    tagPool = None
+    if args.tag_workers > 0 and cm.mvConfig.tagFamily:
+        from TagWorkerPool import TagWorkerPool
+        tagPool = TagWorkerPool(args.tag_workers)
+
+    frc = makeFRC(args.display)
+
+    print(f"{args.width}x{args.height} at {args.fps} fps, {args.tags} tags, {args.detections} detections, "
+          f"{'no depth' if args.no_depth else 'depth'}, {args.tag_workers} tag workers")
+    print("cameras  min fps  total fps  dropped   p50 ms   p95 ms   p99 ms   RSS MB   growth MB")
+
+    sustainable = 0
+
+    for count in range(1, args.max_cameras + 1):
+        r = soak(count, args, frc, tagPool)
+        (p50, p95, p99) = r["latency"]
+        print(f"{count:7d}  {r['minFps']:7.1f}  {r['totalFps']:9.1f}  {r['dropped']:7d}  {p50:7.1f}  {p95:7.1f}  {p99:7.1f}  "
+              f"{r['rss']:7.1f}  {r['rssGrowth']:10.1f}")
+
+        if r["minFps"] < SUSTAINED * args.fps:
+            break
+        sustainable = count
+
+    if tagPool is not None:
+        print(tagPool.report())
+        tagPool.close()
+
+    print(f"This host sustains {sustainable} camera(s) at {args.fps} fps")
+
+
+if __name__ == "__main__":
+    main()
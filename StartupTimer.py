@@ -0,0 +1,34 @@
+import time
+
+
+# Keeps track of how long each phase of startup takes (imports, config, each camera, ...) so that
+# startup time can be tracked from build to build.  The summary is printed once everything is
+# running and published to NetworkTables as Startup-<phase> values, in milliseconds.
+
+class StartupTimer:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    # Record the time since the previous mark under the given label
+
+    def mark(self, label: str):
+        now = time.perf_counter()
+        self.phases.append((label, now - self.last))
+        self.last = now
+
+    def total(self) -> float:
+        return self.last - self.start
+
+    def report(self) -> str:
+        lines = [f"Startup took {self.total() * 1000:.0f} ms"]
+        for label, elapsed in self.phases:
+            lines.append(f"   {label:<24} {elapsed * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def publish(self, table):
+        for label, elapsed in self.phases:
+            table.putNumber("Startup-" + label, round(elapsed * 1000, 1))
+        table.putNumber("Startup-total", round(self.total() * 1000, 1))
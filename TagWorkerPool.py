@@ -0,0 +1,189 @@
+import atexit
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+# TagWorkerPool moves AprilTag detection and pose estimation out of the main process so that, on a
+# Pi with several cameras, the work is spread over all the cores instead of being serialized by the
+# GIL.
+#
+# Frames are handed to the workers through a ring of slots in one shared-memory block: the main
+# process converts each frame to grayscale straight into a free slot, and only the slot number and
+# frame size go through the worker's queue.  The workers run AprilTag.findTags on the slot and send
+# back the compact tag records, which the main process draws and publishes as before.
+#
+# The workers are forked, so the pool must be created before any cameras are opened or
+# NetworkTables is started.
+
+MAX_FRAME_SHAPE = (1080, 1920)      # Largest grayscale frame a slot can hold
+
+
+def _worker(index, shmName, slotSize, tasks, results):
+    from AprilTag5 import AprilTag
+
+    shm = shared_memory.SharedMemory(name=shmName)
+    detectors = {}
+    profiler = None
+
+    while True:
+        task = tasks.get()
+        match task[0]:
+            case "configure":
+                (_, camKey, tagFamily, tagSize, intrinsics, distortion) = task
+                detectors[camKey] = AprilTag(tagFamily, tagSize, intrinsics, distortion=distortion)
+            case "detect":
+                (_, seq, camKey, slot, height, width) = task
+                start = time.perf_counter()
+                gray = np.ndarray((height, width), dtype=np.uint8, buffer=shm.buf, offset=slot * slotSize)
+                records = detectors[camKey].findTags(gray)
+                del gray
+                results.put((seq, camKey, slot, index, records, time.perf_counter() - start))
+            case "profile":
+                (_, outDir, duration) = task
+                if profiler is not None:
+                    profiler.stop()
+                if outDir is not None:
+                    from Profiler import SamplingProfiler
+                    profiler = SamplingProfiler(outDir, duration)
+                    profiler.start()
+            case "stop":
+                break
+
+    shm.close()
+
+
+class WorkerStats:
+
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+
+
+class TagWorkerPool:
+
+    def __init__(self, workers: int, slotsPerWorker: int = 2):
+        ctx = mp.get_context("fork")
+
+        self.slotSize = MAX_FRAME_SHAPE[0] * MAX_FRAME_SHAPE[1]
+        self.nSlots = workers * slotsPerWorker
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slotSize * self.nSlots)
+        self.freeSlots = list(range(self.nSlots))
+
+        self.results = ctx.Queue()
+        self.tasks = []
+        self.processes = []
+        self.outstanding = []       # Tasks in flight, per worker
+        self.stats = []
+
+        for i in range(workers):
+            tasks = ctx.Queue()
+            p = ctx.Process(target=_worker, args=(i, self.shm.name, self.slotSize, tasks, self.results), name=f"tagworker-{i}", daemon=True)
+            p.start()
+            self.tasks.append(tasks)
+            self.processes.append(p)
+            self.outstanding.append(0)
+            self.stats.append(WorkerStats())
+
+        self.seq = 0
+        self.pending = {}           # seq -> camKey for frames submitted but not collected yet
+        self.startTime = time.monotonic()
+        self.lastPublish = 0
+
+        atexit.register(self.close)
+
+    # Every worker gets its own detector for each camera, since any worker may get any camera's frame
+
+    def configure(self, camKey, tagFamily, tagSize, intrinsics, distortion=None):
+        for tasks in self.tasks:
+            tasks.put(("configure", camKey, tagFamily, tagSize, intrinsics, distortion))
+
+    # Start (outDir set) or stop (outDir None) a SamplingProfiler in every worker
+
+    def profile(self, outDir, duration: float):
+        for tasks in self.tasks:
+            tasks.put(("profile", outDir, duration))
+
+    # Queue a frame for detection.  Returns False (and the frame is skipped) if no slot is free.
+
+    def submit(self, camKey, image) -> bool:
+        height, width = image.shape[:2]
+        if len(self.freeSlots) == 0 or height * width > self.slotSize:
+            return False
+
+        slot = self.freeSlots.pop()
+        gray = np.ndarray((height, width), dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slotSize)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        del gray
+
+        worker = self.outstanding.index(min(self.outstanding))
+        self.outstanding[worker] += 1
+        self.seq += 1
+        self.pending[self.seq] = camKey
+        self.tasks[worker].put(("detect", self.seq, camKey, slot, height, width))
+        return True
+
+    # Wait (up to timeout seconds) for every submitted frame and return {camKey: records}
+
+    def collect(self, timeout: float = 0.5) -> dict:
+        found = {}
+        deadline = time.monotonic() + timeout
+
+        while len(self.pending) > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                (seq, camKey, slot, worker, records, elapsed) = self.results.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            self.freeSlots.append(slot)
+            self.outstanding[worker] -= 1
+            self.stats[worker].frames += 1
+            self.stats[worker].busy += elapsed
+
+            if self.pending.pop(seq, None) is not None:
+                found[camKey] = records
+
+        # Anything still pending has timed out; its slot comes back when the result eventually arrives
+
+        self.pending.clear()
+        return found
+
+    def report(self) -> str:
+        elapsed = max(time.monotonic() - self.startTime, 1e-6)
+        lines = []
+        for i, stats in enumerate(self.stats):
+            lines.append(f"Tag worker {i}: {stats.frames / elapsed:.1f} fps, {100 * stats.busy / elapsed:.0f}% busy")
+        return "\n".join(lines)
+
+    # Publishes TagWorker-<i>-fps and TagWorker-<i>-busy, at most once a second
+
+    def publish(self, table):
+        now = time.monotonic()
+        if now - self.lastPublish < 1.0:
+            return
+        self.lastPublish = now
+
+        elapsed = max(now - self.startTime, 1e-6)
+        for i, stats in enumerate(self.stats):
+            table.putNumber(f"TagWorker-{i}-fps", round(stats.frames / elapsed, 1))
+            table.putNumber(f"TagWorker-{i}-busy", round(100 * stats.busy / elapsed))
+
+    def close(self):
+        for tasks, p in zip(self.tasks, self.processes):
+            if p.is_alive():
+                tasks.put(("stop",))
+        for p in self.processes:
+            p.join(timeout=1.0)
+        self.processes = []
+
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,114 @@
+import cv2
+import ConfigManager as cm
+from Results import ResultBatch
+
+# What a camera whose link went down raises.  A USB reset or brown-out shows up as XLinkReadError or
+# XLinkWriteError from the device's queues, and a device that has already closed raises a plain
+# RuntimeError.  (SoakTest runs this loop without depthai installed.)
+
+try:
+    import depthai as dai
+    LINK_ERRORS = (dai.XLinkReadError, dai.XLinkWriteError, RuntimeError)
+except ImportError:
+    LINK_ERRORS = (RuntimeError,)
+
+
+# The per-frame work of MonsterVision's main loop, kept here so SoakTest.py can run exactly the same
+# code against simulated cameras.
+#
+# cameras is the main loop's list of (cam, mxId, detector, tagDetector) tuples.  cam is a
+# CameraPipeline, or anything with the same attributes and methods.
+
+
+# Get the next frame from every camera.  Returns the entries that had something new.  A camera
+# whose link went down is handed to failed(entry, err) and the others carry on.
+
+def readCameras(cameras: list, tagPool, failed) -> list:
+    ready = []
+
+    for entry in list(cameras):
+        (cam, mxId, detector, tagDetector) = entry
+
+        # Process the next frame.  If anything new arrived, processNextFrame will return True.
+
+        try:
+            newFrame = cam.processNextFrame()
+        except LINK_ERRORS as err:
+            failed(entry, err)
+            continue
+
+        if newFrame:
+            ready.append(entry)
+
+            # Hand the frame to the tag workers now, so they run while we do everything else
+
+            if tagPool is not None and tagDetector is not None and cam.frame is not None and cam.runTags:
+                tagPool.submit(mxId, cam.frame)
+
+    return ready
+
+
+# Detections, tags, annotations and publishing for one camera with a new frame
+
+def processCamera(entry, frc, tagRecords: dict, tagPool, cameras: list):
+    (cam, mxId, detector, tagDetector) = entry
+
+    # If the camera has a detection object, process the detections
+
+    results = ResultBatch(cam.LABELS, cm.mvConfig.tagFamily, cam.frameTimestamp, cam.frameSequenceNum)
+
+    detections = cam.currentDetections() if cam.runNN else None
+
+    if detector is not None and detections is not None and len(detections) != 0:
+        detector.processDetections(detections, cam.frame, cam.depthFrameColor, results)
+
+    # If the camera has an AprilTag object, detect any AprilTags that might be seen
+
+    if tagDetector is not None and cam.frame is not None and cam.runTags:
+        if tagPool is None:
+            records = tagDetector.findTags(cv2.cvtColor(cam.frame, cv2.COLOR_BGR2GRAY))
+        else:
+            records = tagRecords.get(mxId)
+
+        if records is not None:
+            tagDetector.drawTags(cam.frame, records)
+            tagDetector.tagResults(records, cam.spatialLocations, results)
+
+            # Ask the device for the stereo depth of these tags; it comes back with a later frame
+
+            cam.requestSpatialLocations(tagDetector.tagRois(records, cam.frame.shape))
+
+        cv2.putText(cam.frame, "fps: {:.2f}".format(cam.fps), (2, cam.frame.shape[0] - 4), cv2.FONT_HERSHEY_TRIPLEX, 0.4,
+        (255, 255, 255))
+
+    res = frc.sd.putString("ObjectTracker-fps", "fps : {:.2f}".format(cam.fps))
+    res = frc.ntinst.flush() # Puts all values onto table immediately
+
+    # Display the results to the GUI and push frames to the camera server
+
+    frc.displayCamResults(cam)
+
+    # Write the objects to the Network Table
+
+    frc.writeObjectsToNetworkTable(results, cam)
+    frc.writeOccupancyToNetworkTable(cam)
+    frc.writeTelemetryToNetworkTable(cam)
+    frc.writeModelStatsToNetworkTable(cam)
+
+    frc.sendResultsToDS(cameras)
+
+
+# One pass over all the cameras.  Returns the entries that were processed.
+
+def runOnce(cameras: list, frc, tagPool, failed) -> list:
+    ready = readCameras(cameras, tagPool, failed)
+
+    tagRecords = tagPool.collect() if tagPool is not None and len(ready) > 0 else {}
+
+    for entry in ready:
+        processCamera(entry, frc, tagRecords, tagPool, cameras)
+
+    if tagPool is not None:
+        tagPool.publish(frc.sd)
+
+    return ready
@@ -0,0 +1,229 @@
+import numpy as np
+
+
+# Host-side decoding of raw YOLO output tensors into the same detection objects the OAK's
+# YoloDetectionNetwork produces, so Detections.processDetections can consume either.
+#
+# Everything is vectorized over the batch, the anchors and the grid; the only Python loop is the
+# greedy NMS, which runs once per kept box.
+#
+# Two kinds of heads are understood, chosen by whether the NN JSON lists anchors:
+#
+#   anchor-based (YOLOv5 style)   one output per stride, shaped (B, A*(5+C), H, W).  The outputs
+#                                 named in anchor_masks ("side80" etc.) select the anchors by grid
+#                                 width (a 512x320 input at stride 32 is "side16", a 16x10 grid).  x, y = (2v - 0.5 + cell) * stride, w, h = (2v)^2 * anchor.
+#   anchor-free (YOLOv6 style)    one output per stride, shaped (B, 5+C, H, W), with the box given
+#                                 as left/top/right/bottom distances from the cell centre in stride
+#                                 units.
+#
+# In both, channel 4 is the objectness and the rest are class scores.  Luxonis exports already end
+# in a sigmoid; set "sigmoid": true in NN_specific_metadata for a model whose outputs are logits.
+# NN_specific_metadata may also give "class_confidence_thresholds" ({"note": 0.6, ...}) and "top_k".
+
+
+class SpatialPoint:
+
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x = 0.0, y = 0.0, z = 0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class HostDetection:
+
+    __slots__ = ("label", "confidence", "xmin", "ymin", "xmax", "ymax", "spatialCoordinates")
+
+    def __init__(self, label, confidence, xmin, ymin, xmax, ymax):
+        self.label = label
+        self.confidence = confidence
+        self.xmin = xmin
+        self.ymin = ymin
+        self.xmax = xmax
+        self.ymax = ymax
+        self.spatialCoordinates = SpatialPoint()
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areaA = (box[2] - box[0]) * (box[3] - box[1])
+    areaB = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(areaA + areaB - inter, 1e-9)
+
+
+# Class-wise NMS: boxes of different classes are shifted apart so they can never overlap, which
+# lets one greedy pass handle every class at once.  Returns the indices kept, best score first.
+
+def nms(boxes, scores, labels, iouThreshold: float, topK: int = 0):
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    offset = labels.astype(np.float32)[:, None] * (boxes.max() + 1.0)
+    shifted = boxes + offset
+    order = np.argsort(-scores)
+    keep = []
+
+    while len(order) > 0:
+        best = order[0]
+        keep.append(best)
+        if topK > 0 and len(keep) >= topK:
+            break
+        rest = order[1:]
+        order = rest[_iou(shifted[best], shifted[rest]) <= iouThreshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+class YoloDecoder:
+
+    # inputSize is (width, height); anchors and anchorMasks are as in the NN JSON.  classThresholds
+    # maps a label (name or index) to its own confidence threshold; other classes use
+    # confidenceThreshold.  At most topK boxes are kept per image (0: no limit).
+
+    def __init__(self, inputSize, classes: int, anchors, anchorMasks: dict, iouThreshold: float = 0.5,
+                 confidenceThreshold: float = 0.5, classThresholds: dict = None, labels=None,
+                 sigmoid: bool = False, topK: int = 100):
+        self.inputWidth, self.inputHeight = inputSize
+        self.classes = classes
+        self.iouThreshold = iouThreshold
+        self.confidenceThreshold = confidenceThreshold
+        self.applySigmoid = sigmoid
+        self.topK = topK
+
+        anchors = np.array(anchors, dtype=np.float32).reshape(-1, 2)
+        self.anchorsBySide = {}             # Grid width -> that output's anchors
+        for name, mask in anchorMasks.items():
+            side = int(name.replace("side", ""))
+            self.anchorsBySide[side] = anchors[mask]
+
+        self.classThresholds = np.full(classes, confidenceThreshold, dtype=np.float32)
+        self.classOverrides = {}            # Class index -> the threshold given for it
+        self.setClassThresholds(classThresholds or {}, labels)
+
+        self._grids = {}
+
+    # From the whole NN config file (the same one setupSDN reads)
+
+    @classmethod
+    def fromJSON(cls, nnJSON: dict, topK: int = 100):
+        nnConfig = nnJSON['nn_config']
+        metadata = nnConfig['NN_specific_metadata']
+        return cls(tuple(map(int, nnConfig['input_size'].split('x'))), metadata['classes'],
+                   metadata.get('anchors', []), metadata.get('anchor_masks', {}),
+                   metadata.get('iou_threshold', 0.5), metadata.get('confidence_threshold', 0.5),
+                   metadata.get('class_confidence_thresholds'), nnJSON['mappings']['labels'],
+                   metadata.get('sigmoid', False), metadata.get('top_k', topK))
+
+    # From the flat dict CameraPipeline.parseNNConfig returns
+
+    @classmethod
+    def fromNN(cls, nn: dict):
+        return cls(tuple(nn['inputSize']), nn['classes'], nn['anchors'], nn['anchorMasks'],
+                   nn['iouThreshold'], nn['confidenceThreshold'], nn['classThresholds'], nn['labels'],
+                   nn['sigmoid'], nn['topK'])
+
+    def setClassThresholds(self, classThresholds: dict, labels=None):
+        for label, threshold in classThresholds.items():
+            if labels is not None and label in labels:
+                index = labels.index(label)
+            else:
+                index = int(label)
+            self.classOverrides[index] = threshold
+            self.classThresholds[index] = threshold
+
+    # A new threshold for every class that doesn't have its own
+
+    def setConfidenceThreshold(self, threshold: float):
+        self.confidenceThreshold = threshold
+        self.classThresholds[:] = threshold
+        for index, classThreshold in self.classOverrides.items():
+            self.classThresholds[index] = classThreshold
+
+    def _grid(self, h, w):
+        grid = self._grids.get((h, w))
+        if grid is None:
+            gy, gx = np.meshgrid(np.arange(h, dtype=np.float32), np.arange(w, dtype=np.float32), indexing="ij")
+            grid = (gx, gy)
+            self._grids[(h, w)] = grid
+        return grid
+
+    # Turn one output tensor into (B, N, 4) boxes in input pixels and (B, N, 5+C) raw scores
+
+    def _decodeOutput(self, out):
+        out = np.asarray(out, dtype=np.float32)
+        if self.applySigmoid:
+            out = _sigmoid(out)
+
+        b, ch, h, w = out.shape
+        stride = self.inputWidth / w
+        gx, gy = self._grid(h, w)
+        n = 5 + self.classes
+
+        anchors = self.anchorsBySide.get(w)
+        if anchors is not None:
+            na = len(anchors)
+            out = out.reshape(b, na, n, h, w)
+            cx = (out[:, :, 0] * 2 - 0.5 + gx) * stride
+            cy = (out[:, :, 1] * 2 - 0.5 + gy) * stride
+            bw = (out[:, :, 2] * 2) ** 2 * anchors[:, 0, None, None]
+            bh = (out[:, :, 3] * 2) ** 2 * anchors[:, 1, None, None]
+            boxes = np.stack((cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2), axis=-1)
+            scores = np.moveaxis(out[:, :, 4:], 2, -1)
+        else:
+            out = out.reshape(b, n, h, w)
+            px = gx + 0.5
+            py = gy + 0.5
+            boxes = np.stack(((px - out[:, 0]) * stride, (py - out[:, 1]) * stride,
+                              (px + out[:, 2]) * stride, (py + out[:, 3]) * stride), axis=-1)
+            scores = np.moveaxis(out[:, 4:], 1, -1)
+
+        return boxes.reshape(b, -1, 4), scores.reshape(b, -1, n - 4)
+
+    # The device sends each output as a flat array.  Work out its (1, channels, h, w) shape from
+    # the strides a YOLO head can have.
+
+    def shapeOutput(self, flat):
+        flat = np.asarray(flat, dtype=np.float32)
+        for stride in (8, 16, 32, 64):
+            h = self.inputHeight // stride
+            w = self.inputWidth // stride
+            anchors = self.anchorsBySide.get(w)
+            ch = (5 + self.classes) * (len(anchors) if anchors is not None else 1)
+            if ch * h * w == flat.size:
+                return flat.reshape(1, ch, h, w)
+        raise ValueError(f"NN output of {flat.size} values doesn't match a YOLO head for {self.inputWidth}x{self.inputHeight}")
+
+    # outputs: the raw output tensors for a batch.  Returns one list of HostDetection per image.
+
+    def decode(self, outputs) -> list:
+        decoded = [self._decodeOutput(out) for out in outputs]
+        boxes = np.concatenate([d[0] for d in decoded], axis=1)
+        raw = np.concatenate([d[1] for d in decoded], axis=1)
+
+        classScores = raw[:, :, 1:] * raw[:, :, :1]            # objectness * class score
+        labels = classScores.argmax(axis=-1)
+        scores = np.take_along_axis(classScores, labels[..., None], axis=-1)[..., 0]
+
+        scale = np.array([self.inputWidth, self.inputHeight, self.inputWidth, self.inputHeight], dtype=np.float32)
+        results = []
+
+        for i in range(boxes.shape[0]):
+            candidates = scores[i] >= self.classThresholds[labels[i]]
+            b = boxes[i][candidates] / scale
+            s = scores[i][candidates]
+            l = labels[i][candidates]
+
+            keep = nms(b, s, l, self.iouThreshold, self.topK)
+            b = np.clip(b[keep], 0.0, 1.0)
+            results.append([HostDetection(int(l[k]), float(s[k]), *map(float, box)) for k, box in zip(keep, b)])
+
+        return results
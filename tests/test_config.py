@@ -0,0 +1,28 @@
+import pytest
+
+import ConfigManager as cm
+
+
+def test_depth_range_defaults_to_unfiltered():
+    stereo = cm._build(cm.StereoConfig, {}, "mv.json")
+    assert not stereo.hasDepthRange()
+    assert stereo.depthRange() == (100, 5000)
+
+
+def test_depth_range_open_end():
+    stereo = cm._build(cm.StereoConfig, {"minDepth": 6000}, "mv.json")
+    assert stereo.hasDepthRange()
+    assert stereo.depthRange() == (6000, 65535)
+
+
+def test_depth_range_must_be_ordered():
+    with pytest.raises(cm.ConfigError):
+        cm._build(cm.StereoConfig, {"minDepth": 3000, "maxDepth": 2000}, "mv.json")
+
+
+def test_model_profiles_are_checked():
+    model = cm._build(cm.ModelConfig, {"file": "nn.json", "profiles": ["both", "nn"]}, "mv.json")
+    assert model.profiles == ["both", "nn"]
+
+    with pytest.raises(cm.ConfigError, match="'tag'"):
+        cm._build(cm.ModelConfig, {"file": "nn.json", "profiles": ["tag"]}, "mv.json")
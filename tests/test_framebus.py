@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from FrameBus import HEADER_SIZE, SEQ, DETECTION_FIELDS, FrameBusReader, FrameBusWriter
+
+RGB_SHAPE = (6, 8, 3)
+DEPTH_SHAPE = (3, 4)
+
+
+@pytest.fixture
+def bus():
+    name = f"test{os.getpid()}"
+    writer = FrameBusWriter(name, 4, RGB_SHAPE, DEPTH_SHAPE)
+    reader = FrameBusReader(name)
+    yield (writer, reader)
+    reader.close()
+    writer.close()
+
+
+def publish(writer, i: int):
+    rgb = np.full(RGB_SHAPE, i, dtype=np.uint8)
+    depth = np.full(DEPTH_SHAPE, 10 * i, dtype=np.uint16)
+    detections = np.full((1, len(DETECTION_FIELDS)), i, dtype=np.float32)
+    assert writer.publish(rgb, depth, detections, deviceTime=i / 10, deviceSeq=i)
+
+
+def assertFrame(frame, i: int):
+    assert frame.seq == i
+    assert frame.deviceSeq == i
+    assert frame.rgb.shape == RGB_SHAPE and (frame.rgb == i).all()
+    assert frame.depth.shape == DEPTH_SHAPE and (frame.depth == 10 * i).all()
+    assert frame.detections.shape == (1, len(DETECTION_FIELDS)) and (frame.detections == i).all()
+
+
+def test_reader_follows_writer(bus):
+    (writer, reader) = bus
+    assert reader.next() is None
+
+    for i in (1, 2):
+        publish(writer, i)
+        assertFrame(reader.next(), i)
+
+    assert reader.next() is None
+    assert reader.missed == 0
+
+
+def test_reader_skips_to_newest_after_wrap(bus):
+    (writer, reader) = bus
+
+    for i in range(1, 11):                  # 10 frames through 4 slots
+        publish(writer, i)
+
+    assert reader.newest() == 10
+    assertFrame(reader.next(), 10)
+    assert reader.missed == 9
+    assert reader.next() is None
+
+
+def test_overwritten_frames_are_not_returned(bus):
+    (writer, reader) = bus
+
+    for i in range(1, 7):
+        publish(writer, i)
+
+    # Frame 2 shared a slot with frame 6, which replaced it
+
+    assert reader.read(2) is None
+    assertFrame(reader.read(6), 6)
+
+    # A view taken with copy=False is no longer valid once the writer wraps around to its slot
+
+    frame = reader.read(5, copy=False)
+    assertFrame(frame, 5)
+    for i in (7, 8):
+        publish(writer, i)
+    assert reader.stillValid(frame)
+    publish(writer, 9)                      # Same slot as frame 5
+    assert not reader.stillValid(frame)
+
+
+def test_slot_being_written_is_not_returned(bus):
+    (writer, reader) = bus
+    publish(writer, 1)
+
+    # What a reader sees while the writer is part way through the slot: an odd sequence number
+
+    SEQ.pack_into(writer.shm.buf, HEADER_SIZE + (1 % writer.nSlots) * writer.slotSize, 2 * 1 - 1)
+    assert reader.read(1) is None
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import ConfigManager as cm
+from Models import ModelScheduler
+from YoloDecoder import YoloDecoder
+
+from test_yolo_decoder import NN_FILE
+
+
+def test_confidence_threshold_reaches_host_decoder():
+    with open(NN_FILE) as f:
+        nnJSON = json.load(f)
+
+    models = ModelScheduler([cm.ModelConfig(str(NN_FILE)), cm.ModelConfig("other.json")])
+    models.models[0].decoder = YoloDecoder.fromJSON(nnJSON)
+    models.models[1].decoder = YoloDecoder.fromJSON(nnJSON)
+
+    models.setConfidenceThreshold(str(NN_FILE), 0.3)
+
+    assert models.models[0].confidenceThreshold == 0.3
+    assert models.models[0].decoder.classThresholds.tolist() == pytest.approx([0.3, 0.3])
+    assert models.models[1].decoder.classThresholds.tolist() == pytest.approx([0.5, 0.5])
+
+
+def test_lowering_device_threshold_needs_rebuild():
+    models = ModelScheduler([cm.ModelConfig("nn.json")])
+    models.models[0].nn = {"confidenceThreshold": 0.5}
+
+    assert not models.setConfidenceThreshold("nn.json", 0.6)
+    assert models.setConfidenceThreshold("nn.json", 0.4)
+    assert not models.setConfidenceThreshold("other.json", 0.1)
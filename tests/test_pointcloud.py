@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import ConfigManager as cm
+from PointCloud import GRID_HEADER, PointCloud
+
+WIDTH = 40
+HEIGHT = 30
+INTRINSICS = [[100.0, 0.0, 20.0], [0.0, 100.0, 15.0], [0.0, 0.0, 1.0]]      # fx = fy = 100, centred
+
+
+def flat(mm: int):
+    return np.full((HEIGHT, WIDTH), mm, dtype=np.uint16)
+
+
+def pointAt(points, u: int, v: int):
+    return points[v * WIDTH + u]
+
+
+def test_points_from_a_level_camera():
+    cloud = PointCloud(cm.PointCloudConfig(step=1), cm.MountConfig(z=0.3))
+    points = cloud.toPoints(flat(2000), INTRINSICS)
+
+    assert points.shape == (WIDTH * HEIGHT, 3)
+    assert pointAt(points, 20, 15) == pytest.approx([2.0, 0.0, 0.3], abs=1e-5)
+    assert pointAt(points, 30, 15) == pytest.approx([2.0, -0.2, 0.3], abs=1e-5)     # Right of centre is -y
+    assert pointAt(points, 20, 25) == pytest.approx([2.0, 0.0, 0.1], abs=1e-5)      # Below centre is lower
+
+
+def test_invalid_depth_is_dropped():
+    depth = flat(2000)
+    depth[:, :10] = 0
+    cloud = PointCloud(cm.PointCloudConfig(step=2), cm.MountConfig())
+    assert len(cloud.toPoints(depth, INTRINSICS)) == (HEIGHT // 2) * (WIDTH - 10) // 2
+
+
+def test_mount_rotation():
+    yawed = PointCloud(cm.PointCloudConfig(step=1), cm.MountConfig(yaw=90))
+    assert pointAt(yawed.toPoints(flat(2000), INTRINSICS), 20, 15) == pytest.approx([0.0, 2.0, 0.0], abs=1e-5)
+
+    # Pitched straight down from 2.5 m, the floor 2 m away is 0.5 m up
+
+    down = PointCloud(cm.PointCloudConfig(step=1), cm.MountConfig(z=2.5, pitch=90))
+    assert pointAt(down.toPoints(flat(2000), INTRINSICS), 20, 15) == pytest.approx([0.0, 0.0, 0.5], abs=1e-5)
+
+
+def test_occupancy_and_encoding():
+    config = cm.PointCloudConfig(step=1, cellSize=0.1, range=4.0, width=4.0)
+    cloud = PointCloud(config, cm.MountConfig(z=0.3))
+    grid = cloud.update(flat(2050), INTRINSICS)
+
+    # A wall 2.05 m ahead, about 0.4 m either side of centre; columns run from the right (-2 m)
+
+    assert grid.shape == (40, 40)
+    assert np.flatnonzero(grid.any(axis=1)).tolist() == [20]
+    assert np.flatnonzero(grid[20]).tolist() == list(range(16, 25))
+
+    data = cloud.encode()
+    (rows, cols, cellSize) = GRID_HEADER.unpack_from(data, 0)
+    assert (rows, cols) == (40, 40)
+    assert cellSize == pytest.approx(0.1)
+    assert len(data) == GRID_HEADER.size + 40 * 40 // 8
+
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=GRID_HEADER.size))[:rows * cols]
+    assert (bits.reshape(rows, cols).astype(bool) == grid).all()
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from Profiles import DEFAULT_PROFILE, ProfileController
+from SoakTest import MemoryTable
+
+
+class FakeCamera:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profile = DEFAULT_PROFILE
+        self.requestedProfile = DEFAULT_PROFILE
+        self.triggers = 0
+
+    def setProfile(self, profile: str):
+        self.profile = profile
+
+    def triggerNN(self):
+        self.triggers += 1
+
+
+def test_trigger_works_with_unknown_profile():
+    table = MemoryTable()
+    controller = ProfileController(table, interval=0)
+    cam = FakeCamera("front")
+
+    table.putString("Profile-front", "tag")
+    table.putBoolean("NNTrigger-front", True)
+    controller.poll([(cam, "MX", None, None)])
+
+    assert cam.profile == DEFAULT_PROFILE
+    assert cam.triggers == 1
+    assert table.getBoolean("NNTrigger-front", True) is False
+    assert table.getString("ActiveProfile-front", "") == DEFAULT_PROFILE
+
+
+def test_known_profile_is_applied():
+    table = MemoryTable()
+    controller = ProfileController(table, interval=0)
+    cam = FakeCamera("front")
+
+    table.putString("Profile-front", "tags")
+    controller.poll([(cam, "MX", None, None)])
+
+    assert cam.profile == "tags"
+    assert table.getString("ActiveProfile-front", "") == "tags"
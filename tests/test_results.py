@@ -0,0 +1,83 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from Results import HEADER, KIND_NN, KIND_TAG, RESULT_DTYPE, ResultBatch
+
+
+def makeBatch():
+    batch = ResultBatch(["blue", "red"], "tag36h11", 12.25, 42)
+    batch.addDetection(1, 0.75, 10.5, -2.25, 80.0)
+    batch.addTag(7, 1.5, 2.5, 100.0, 10.0, -20.0, 180.0, stereo=(1.25, 2.75, 99.5))
+    batch.addTag(3, -4.0, 0.5, 60.0, 0.0, 5.0, -90.0)
+    return batch
+
+
+def test_round_trip():
+    batch = makeBatch()
+    data = batch.encode()
+    assert len(data) == HEADER.size + 3 * RESULT_DTYPE.itemsize == 24 + 3 * 44
+
+    decoded = ResultBatch.decode(data, ["blue", "red"], "tag36h11")
+    assert (decoded.timestamp, decoded.sequence, len(decoded)) == (12.25, 42, 3)
+
+    rows = decoded.records
+    assert rows["kind"].tolist() == [KIND_NN, KIND_TAG, KIND_TAG]
+    assert rows["label"].tolist() == [1, 7, 3]
+    assert rows["confidence"].tolist() == [0.75, 1.0, 1.0]
+    assert rows[0]["x"] == 10.5 and rows[0]["z"] == 80.0
+    assert rows[1]["rz"] == 180.0
+    assert rows[1]["sz"] == 99.5
+
+    # NN rows and tags without a stereo measurement carry NaN
+
+    assert np.isnan(rows[0]["sx"]) and np.isnan(rows[0]["sz"])
+    assert np.isnan(rows[2]["sx"]) and np.isnan(rows[2]["sy"]) and np.isnan(rows[2]["sz"])
+
+
+def test_empty_batch():
+    data = ResultBatch(timestamp=1.5, sequence=7).encode()
+    assert len(data) == HEADER.size
+
+    decoded = ResultBatch.decode(data)
+    assert len(decoded) == 0
+    assert (decoded.timestamp, decoded.sequence) == (1.5, 7)
+    assert decoded.toJSON() == "[]"
+
+
+def test_grows_past_capacity():
+    batch = ResultBatch(capacity=2)
+    for i in range(5):
+        batch.addDetection(i, 0.5, float(i), 0.0, 0.0)
+
+    assert len(batch) == 5
+    assert len(batch.rows) >= 5
+    decoded = ResultBatch.decode(batch.encode())
+    assert decoded.records["label"].tolist() == [0, 1, 2, 3, 4]
+    assert decoded.records["x"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_bad_magic():
+    data = bytearray(makeBatch().encode())
+    data[0:4] = b"XXXX"
+    with pytest.raises(ValueError):
+        ResultBatch.decode(bytes(data))
+
+
+# The ObjectTracker-<camera> JSON keeps the layout Detections and AprilTag5 used to build by hand
+
+def test_json_matches_old_layout():
+    expected = [
+        {"objectLabel": "red", "x": 10.5, "y": -2.2, "z": 80.0, "confidence": 0.75},
+        {"objectLabel": "tag36h11: 7", "x": 1.5, "y": 2.5, "z": 100.0, "confidence": 1.0,
+         "rotation": {"x": 10, "y": -20, "z": 180}, "stereo": {"x": 1.2, "y": 2.8, "z": 99.5}},
+        {"objectLabel": "tag36h11: 3", "x": -4.0, "y": 0.5, "z": 60.0, "confidence": 1.0,
+         "rotation": {"x": 0, "y": 5, "z": -90}}
+    ]
+    assert makeBatch().toJSON() == json.dumps(expected)
+
+    objects = makeBatch().toObjects()
+    assert "stereo" not in objects[0] and "stereo" not in objects[2]
+    assert not any(isinstance(v, float) and math.isnan(v) for o in objects for v in o.values())
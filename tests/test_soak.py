@@ -0,0 +1,36 @@
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("cv2")
+
+import ConfigManager as cm
+import SoakTest
+
+MODELS = Path(__file__).resolve().parent.parent / "models"
+
+
+@pytest.fixture(autouse=True)
+def defaultConfig(monkeypatch):
+    monkeypatch.setitem(vars(cm), "mvConfig", cm.MVConfig())
+
+
+def test_load_labels_from_nn_file():
+    assert SoakTest.loadLabels(str(MODELS / "2022" / "nn-yolo.json")) == ["blue", "red"]
+
+
+def test_load_labels_falls_back():
+    assert SoakTest.loadLabels("/nonexistent/nn.json") == ["object"]
+
+
+def test_simulated_camera_delivers_frames():
+    cam = SoakTest.SimulatedCamera(0, 2, 320, 240, 2, 2, False, ["note"])
+    assert cam.LABELS == ["note"]
+
+    time.sleep(max(cam.nextFrame - time.monotonic(), 0) + 0.001)
+    assert cam.processNextFrame()
+    assert cam.frame.shape == (240, 320, 3)
+    assert len(cam.currentDetections()) == 2
+    assert all(d.label == 0 for d in cam.currentDetections())
+    assert not cam.processNextFrame()          # The next frame isn't due yet
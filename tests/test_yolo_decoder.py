@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from YoloDecoder import YoloDecoder
+
+
+NN_FILE = Path(__file__).resolve().parent.parent / "models" / "2022" / "nn-yolo.json"
+
+
+# models/2022/nn-yolo.json takes 512x320 input, so its heads are 16x10 ("side16") and 32x20 ("side32")
+
+@pytest.fixture
+def decoder():
+    with open(NN_FILE) as f:
+        return YoloDecoder.fromJSON(json.load(f))
+
+
+def test_non_square_outputs_are_shaped(decoder):
+    assert decoder.shapeOutput(np.zeros(3 * 7 * 10 * 16)).shape == (1, 21, 10, 16)
+    assert decoder.shapeOutput(np.zeros(3 * 7 * 20 * 32)).shape == (1, 21, 20, 32)
+
+
+def test_non_square_decode(decoder):
+    small = np.zeros((1, 21, 10, 16), dtype=np.float32)
+    large = np.zeros((1, 21, 20, 32), dtype=np.float32)
+
+    # Anchor 0 of side16 (81x82) in cell x=5, y=3, centred, at its anchor's size: class 1 ("red")
+
+    small[0, 0:4, 3, 5] = 0.5
+    small[0, 4, 3, 5] = 0.9
+    small[0, 6, 3, 5] = 0.8
+
+    [detections] = decoder.decode([small, large])
+
+    assert len(detections) == 1
+    d = detections[0]
+    assert d.label == 1
+    assert d.confidence == pytest.approx(0.72)
+    assert d.xmin * 512 == pytest.approx(176 - 40.5)
+    assert d.xmax * 512 == pytest.approx(176 + 40.5)
+    assert d.ymin * 320 == pytest.approx(112 - 41)
+    assert d.ymax * 320 == pytest.approx(112 + 41)
+
+
+def test_confidence_threshold_keeps_class_thresholds(decoder):
+    decoder.setClassThresholds({"red": 0.7}, ["blue", "red"])
+    decoder.setConfidenceThreshold(0.2)
+
+    assert decoder.confidenceThreshold == 0.2
+    assert decoder.classThresholds.tolist() == pytest.approx([0.2, 0.7])